@@ -0,0 +1,265 @@
+import os
+import time
+import fcntl
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted within the allowed wait"""
+
+    def __init__(self, retry_after, reason="Server is busy"):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class NodeSlots:
+    """Counting semaphore shared by all worker processes on a node
+
+    Each slot is a lock file held with flock(), so slots of a crashed worker
+    are released by the kernel. A name selects a separate set of slots in
+    the same directory, e.g. one set per client.
+    """
+
+    def __init__(self, directory, count):
+        self.directory = directory
+        self.count = count
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self, name='slot', count=None):
+        """Return an open file descriptor holding a free slot of name, or None"""
+        for index in range(count or self.count):
+            path = os.path.join(self.directory, f"{name}-{index}.lock")
+            fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            # sweep() may have removed the file between open() and flock()
+            try:
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        return None
+
+    def release(self, fd):
+        """Release a slot acquired with try_acquire"""
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def sweep(self, prefix):
+        """Remove the lock files of unused slots whose name starts with prefix"""
+        for filename in os.listdir(self.directory):
+            if not filename.startswith(prefix) or not filename.endswith('.lock'):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.unlink(path)
+            except (BlockingIOError, FileNotFoundError):
+                pass
+            finally:
+                os.close(fd)
+
+class Ticket:
+    """An admitted request; release() must be called exactly once when done"""
+
+    def __init__(self, controller, client):
+        self.controller = controller
+        self.client = client
+        self.granted = threading.Event()
+        self.node_fds = ()
+        self.started = None
+        self.released = False
+
+    def release(self):
+        """Give the slot back (safe to call more than once)"""
+        self.controller._release(self)
+
+class AdmissionController:
+    """Admission control with per-client limits and fair queuing
+
+    At most global_limit requests run at once (per process, and per node when
+    node_slots is given) and each client at most per_client_limit of them
+    (across the node's processes with node_slots). Requests over the limits
+    wait in a queue served round-robin across clients, so one client
+    scripting many requests cannot starve others. Waits are bounded by
+    max_wait; a full queue rejects immediately.
+
+    Slots freed in this process are handed to waiters right away; slots
+    freed by other processes are noticed by the waiters re-checking with a
+    growing interval (from min_poll to max_poll seconds).
+    """
+
+    # Lock files of per-client node slots are removed this often when unused
+    SWEEP_INTERVAL = 600
+
+    def __init__(self, name, global_limit=8, per_client_limit=2, max_queue=32,
+                 max_queue_per_client=2, max_wait=20, node_slots=None,
+                 min_poll=0.01, max_poll=0.5):
+        self.name = name
+        self.global_limit = global_limit
+        self.per_client_limit = per_client_limit
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.max_wait = max_wait
+        self.node_slots = node_slots
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+
+        self.active = 0
+        self.active_by_client = {}
+        self.waiting = OrderedDict()  # client -> deque of waiting tickets, in rotation order
+        self.queued = 0
+        self.avg_hold_time = 5.0      # EWMA of seconds a slot is held, for Retry-After
+        self.rejected = 0
+        self.swept_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, client):
+        """Admit a request for client, waiting in the fair queue if needed"""
+        ticket = Ticket(self, client)
+        deadline = time.monotonic() + self.max_wait
+
+        with self.lock:
+            if client in self.waiting or not self._try_grant(ticket):
+                client_queue = self.waiting.get(client)
+                if (self.queued >= self.max_queue or
+                        (client_queue and len(client_queue) >= self.max_queue_per_client)):
+                    self.rejected += 1
+                    raise AdmissionRejected(self._retry_after())
+                self.waiting.setdefault(client, deque()).append(ticket)
+                self.queued += 1
+                self._dispatch()
+
+        poll = self.min_poll
+        while not ticket.granted.is_set():
+            remaining = deadline - time.monotonic()
+            if ticket.granted.wait(max(0, min(remaining, poll))):
+                break
+            with self.lock:
+                if self.node_slots is not None:
+                    # Slots may have been freed by another process
+                    self._dispatch()
+                if ticket.granted.is_set():
+                    break
+                if remaining <= poll:
+                    self._remove_waiter(ticket)
+                    self.rejected += 1
+                    raise AdmissionRejected(self._retry_after())
+            poll = min(self.max_poll, poll * 2)
+
+        ticket.started = time.monotonic()
+        return ticket
+
+    def _client_slots_name(self, client):
+        return 'client-' + hashlib.sha1(client.encode()).hexdigest()[:16]
+
+    def _can_run(self, client):
+        """Whether client may start another request in this process (lock held)"""
+        return (self.active < self.global_limit and
+                self.active_by_client.get(client, 0) < self.per_client_limit)
+
+    def _try_grant(self, ticket):
+        """Mark a ticket as running if the limits allow it (lock held)
+
+        With node_slots, a node-wide slot and one of the client's node-wide
+        slots are taken as well.
+        """
+        if not self._can_run(ticket.client):
+            return False
+        if self.node_slots is not None:
+            node_fd = self.node_slots.try_acquire()
+            if node_fd is None:
+                return False
+            client_fd = self.node_slots.try_acquire(self._client_slots_name(ticket.client),
+                                                    self.per_client_limit)
+            if client_fd is None:
+                self.node_slots.release(node_fd)
+                return False
+            ticket.node_fds = (node_fd, client_fd)
+        self.active += 1
+        self.active_by_client[ticket.client] = self.active_by_client.get(ticket.client, 0) + 1
+        ticket.granted.set()
+        return True
+
+    def _remove_waiter(self, ticket):
+        """Drop a ticket that gave up waiting (lock held)"""
+        client_queue = self.waiting.get(ticket.client)
+        if client_queue and ticket in client_queue:
+            client_queue.remove(ticket)
+            self.queued -= 1
+            if not client_queue:
+                del self.waiting[ticket.client]
+
+    def _dispatch(self):
+        """Grant free slots to waiters, one client at a time in rotation (lock held)"""
+        for client in list(self.waiting):
+            if self.active >= self.global_limit:
+                return
+
+            client_queue = self.waiting[client]
+            if not self._try_grant(client_queue[0]):
+                continue
+            del self.waiting[client]
+            client_queue.popleft()
+            self.queued -= 1
+            if client_queue:
+                # Client goes to the back of the rotation
+                self.waiting[client] = client_queue
+
+    def _release(self, ticket):
+        """Release a granted ticket and wake the next waiters"""
+        with self.lock:
+            if ticket.released or not ticket.granted.is_set():
+                return
+            ticket.released = True
+
+            for fd in ticket.node_fds:
+                self.node_slots.release(fd)
+            ticket.node_fds = ()
+            if ticket.started is not None:
+                held = time.monotonic() - ticket.started
+                self.avg_hold_time = 0.8 * self.avg_hold_time + 0.2 * held
+
+            self.active -= 1
+            remaining = self.active_by_client.get(ticket.client, 1) - 1
+            if remaining > 0:
+                self.active_by_client[ticket.client] = remaining
+            else:
+                self.active_by_client.pop(ticket.client, None)
+
+            self._dispatch()
+
+            sweep = (self.node_slots is not None and
+                     time.monotonic() - self.swept_at > self.SWEEP_INTERVAL)
+            if sweep:
+                self.swept_at = time.monotonic()
+        if sweep:
+            self.node_slots.sweep('client-')
+
+    def _retry_after(self):
+        """Estimate how many seconds a rejected client should wait (lock held)"""
+        backlog = self.queued + self.active
+        return max(1, int(self.avg_hold_time * backlog / max(1, self.global_limit)) + 1)
+
+    def snapshot(self):
+        """Current state for metrics and the admin page"""
+        with self.lock:
+            return {
+                'name': self.name,
+                'active': self.active,
+                'queued': self.queued,
+                'clients': len(self.active_by_client),
+                'rejected': self.rejected,
+                'avg_hold_time': round(self.avg_hold_time, 2),
+            }
@@ -2,63 +2,449 @@ import os
 import logging
 import datetime
 import time
-import requests
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, send_file, make_response, Response
+import ipaddress
+import hmac
+import tempfile
+import threading
+from functools import wraps
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, send_file, make_response, Response, g
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 import urllib.parse
 from sqlalchemy import func
 
 # Import our modules
 from youtube_link_utils import get_video_info as get_yt_info, generate_clipto_url, generate_download_file_url, get_video_id
-from downloader import YoutubeDownloader
+from downloader import YoutubeDownloader, VideoUnavailableError, format_cache
 from cache_manager import CacheManager
-from models import db, Download, Statistics
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, 
-                   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+from models import db, Download, Statistics, Video, upgrade_download_catalog
+from db_profiles import normalize_database_url, get_engine_options, configure_engine
+from upstream_governor import governor
+from cookie_manager import refresh_cookies_async, start_cookie_refresher
+from admission import AdmissionController, AdmissionRejected, NodeSlots
+from downloader import postprocessor_timing_hook
+from transcoder import transcoder, audio_args, mux_args, TranscodeError
+from segmented_fetch import open_stream, UpstreamError
+from egress import egress
+from http_cache import cacheable, not_modified, no_store, static_page, uncached, make_etag, info_version
+from render_cache import RenderCache
+from assets import assets, build_assets
+from metrics import metrics
+from tracing import tracer, span
+from log_config import configure_logging, ytdlp_log_options
+
+# Configure logging (queued, rate limited; see log_config)
+configure_logging()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
 # Initialize Flask app
-app = Flask(__name__)
+# /static is served by static_file() below, with the built assets
+app = Flask(__name__, static_folder=None)
 app.secret_key = os.environ.get("SESSION_SECRET", "youtube_downloader_secret")
 
-# Configure database
-database_url = os.environ.get("DATABASE_URL")
-if database_url and database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
+# Behind the Replit proxy the client address is in X-Forwarded-For
+trusted_proxies = int(os.environ.get("TRUSTED_PROXIES", 1 if 'REPL_ID' in os.environ else 0))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
 
-# If database_url is None, provide a default SQLite database path
-if not database_url:
-    database_url = "sqlite:///youtube_downloader.db"
-    logger.warning("DATABASE_URL not found, using SQLite as fallback")
+# Configure database
+database_url = normalize_database_url(os.environ.get("DATABASE_URL"))
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-logger.debug(f"Database URL configured: {database_url is not None}")
+# Engine profile (pooling, timeouts, SQLite WAL) is selected from the URL
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(database_url)
+logger.debug("Database URL configured: %s", database_url is not None)
 
 # Initialize the database
 db.init_app(app)
+configure_engine(app, db)
+
+def init_database():
+    """Create missing tables and upgrade old schemas
+
+    Runs once per deploy (gunicorn's on_starting hook, `flask init-db` or
+    main.py), not on every worker import.
+    """
+    with app.app_context():
+        db.create_all()
+        upgrade_download_catalog()
+        logger.debug("Database tables created")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the database tables and run schema upgrades"""
+    init_database()
+    click.echo("Database initialised")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minify, fingerprint and precompress the static files"""
+    for name, sizes in build_assets().items():
+        click.echo(f"{name}: " + ", ".join(f"{kind} {size}" for kind, size in sizes.items()))
+
+# Templates link static files with asset_url('js/script.js')
+app.add_template_global(assets.url, 'asset_url')
+
+# Initialize the cache manager. Between the soft and hard TTL cached info is
+# served while it is refreshed in the background. Misses read the video
+# catalog, and new workers are warmed from it (see start_background_tasks)
+# so restarts and autoscale cold starts don't begin with an empty cache.
+cache_manager = CacheManager(max_size=50,  # Store info for up to 50 videos
+                             expiry_time=int(os.environ.get("INFO_CACHE_HARD_TTL", 3600)),
+                             soft_ttl=int(os.environ.get("INFO_CACHE_SOFT_TTL", 900)))
+INFO_CACHE_WARM_UP = int(os.environ.get("INFO_CACHE_WARM_UP", 20))
+
+# Rendered pages; /watch output is keyed by info version and lives as long as info in memory
+render_cache = RenderCache(max_size=int(os.environ.get("RENDER_CACHE_SIZE", 200)),
+                           expiry_time=cache_manager.expiry_time)
+render_cache.add_static_page('/', 'index.html')
+render_cache.add_static_page('/faq', 'faq.html',
+                             title='YouTube Downloader FAQ - Answers to Common Questions About Downloading Videos',
+                             description='Find answers to frequently asked questions about downloading YouTube videos and converting videos to MP3 using our free online tool.')
+render_cache.add_static_page('/privacy', 'privacy.html')
+render_cache.add_static_page('/disclaimer', 'disclaimer.html')
+render_cache.add_static_page('/donate', 'donate.html')
+
+@span('extract_video_info')
+def extract_video_info(url, video_id):
+    """Extract video info and record it in the video catalog"""
+    video_info = get_yt_info(url)
+    if video_id and isinstance(video_info, dict):
+        try:
+            Video.store_info(video_id, video_info)
+        except Exception as e:
+            # The catalog is only a cache, never fail the request because of it
+            logger.warning("Error storing video info in catalog: %s", e)
+            db.session.rollback()
+    return video_info
+
+def fetch_video_info(url):
+    """Get video info from the in-memory cache, the video catalog or a fresh extraction"""
+    video_id = get_video_id(url)
+    cache_key = video_id or url
+
+    def refresh():
+        # Runs in a background thread once the cached entry is past its soft TTL
+        with app.app_context():
+            return extract_video_info(url, video_id)
+
+    with span('info_cache'):
+        video_info = cache_manager.get_cache(cache_key, refresh=refresh)
+    if video_info:
+        return video_info
+
+    if video_id:
+        try:
+            with span('video_catalog'):
+                # Past the hard TTL catalog info is a miss, as in memory
+                catalog_entry = Video.get_cached_info(video_id, max_age=cache_manager.expiry_time)
+        except Exception as e:
+            logger.warning("Error reading video catalog: %s", e)
+            db.session.rollback()
+            catalog_entry = None
+        metrics.inc('cache_requests_total', cache='info', tier='catalog', result='hit' if catalog_entry else 'miss')
+        if catalog_entry:
+            # Cached with its extraction time, so it ages from when it was
+            # fetched; old entries are re-extracted in the background
+            video_info, stored_at = catalog_entry
+            cache_manager.add_to_cache(cache_key, video_info, stored_at=stored_at)
+            cache_manager.refresh_if_stale(cache_key, stored_at, refresh)
+            return video_info
+
+    video_info = extract_video_info(url, video_id)
+    cache_manager.add_to_cache(cache_key, video_info)
+    return video_info
+
+# Admission control for the endpoints that download/transcode or proxy whole files
+download_admission = AdmissionController(
+    'downloads',
+    global_limit=int(os.environ.get("DOWNLOAD_GLOBAL_LIMIT", 8)),
+    per_client_limit=int(os.environ.get("DOWNLOAD_PER_CLIENT_LIMIT", 2)),
+    max_queue=int(os.environ.get("DOWNLOAD_MAX_QUEUE", 32)),
+    max_wait=int(os.environ.get("DOWNLOAD_MAX_WAIT", 20)),
+    node_slots=NodeSlots(os.environ.get("DOWNLOAD_SLOT_DIR",
+                                        os.path.join(tempfile.gettempdir(), "ytdl-download-slots")),
+                         int(os.environ.get("DOWNLOAD_NODE_LIMIT", 8)))
+)
+
+def collect_runtime_gauges():
+    """Gauges for admission control, transcoding and egress of this process"""
+    admission = download_admission.snapshot()
+    transcodes = transcoder.snapshot()
+    bandwidth = egress.snapshot()
+    return [
+        ('admission_active', {'controller': admission['name']}, admission['active']),
+        ('admission_queued', {'controller': admission['name']}, admission['queued']),
+        ('admission_rejected', {'controller': admission['name']}, admission['rejected']),
+        ('transcode_queued', {}, transcodes['queued']),
+        ('transcode_running', {}, transcodes['running']),
+        ('ffmpeg_streaming', {}, transcodes['streaming']),
+        ('egress_streams', {}, bandwidth['streams']),
+        ('egress_throughput', {}, bandwidth['throughput']),
+    ]
+
+def collect_governor_gauges():
+    """Gauges for the upstream governor, whose state is shared by the node"""
+    upstream = governor.snapshot()
+    state_values = {governor.CLOSED: 0, governor.HALF_OPEN: 1, governor.OPEN: 2}
+    gauges = [
+        ('upstream_governor_state', {}, state_values[upstream['state']]),
+        ('upstream_governor_rate', {}, upstream['rate']),
+    ]
+    for event in ('calls', 'throttled', 'rejected', 'circuit_opened'):
+        gauges.append(('upstream_governor_events', {'event': event}, upstream[event]))
+    return gauges
+
+metrics.register_collector(collect_runtime_gauges)
+metrics.register_collector(collect_governor_gauges, node_wide=True)
+
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background_tasks():
+    """Per-process setup, run in every worker after fork
+
+    gunicorn calls this from post_fork (see gunicorn.conf.py); under other
+    servers it runs on the first request. Threads and connections created
+    before fork are not usable in the child, so they are (re)created here.
+    """
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        configure_logging()
+        with app.app_context():
+            # Drop pooled connections inherited from the parent without closing them
+            db.engine.dispose(close=False)
+            try:
+                cache_manager.warm_up(Video.recent_info(INFO_CACHE_WARM_UP, cache_manager.expiry_time))
+            except Exception as e:
+                logger.warning("Error warming up the info cache: %s", e)
+                db.session.rollback()
+        cache_manager.start()
+        render_cache.start()
+        try:
+            render_cache.prerender(app, templates=('download.html', 'error.html'))
+        except Exception as e:
+            # Pages are rendered on first use instead
+            logger.warning("Error pre-rendering pages: %s", e)
+        metrics.start()
+        if os.environ.get("COOKIE_REFRESHER", "1") == "1":
+            start_cookie_refresher()
+        _background_pid = os.getpid()
+
+@app.before_request
+def start_request_timer():
+    start_background_tasks()
+    g.request_started = time.perf_counter()
+    g.trace = tracer.start(f"{request.method} {request.path}")
+    if tracer.should_profile(request.headers.get('X-Profile')):
+        tracer.start_profiler(g.trace)
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_seconds', time.perf_counter() - started,
+                        endpoint=endpoint, status=response.status_code)
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_trace(exception=None):
+    # Teardown also runs when a view raised, so traces and profiles are always closed
+    tracer.finish(g.pop('trace', None), request.path, g.pop('response_status', 500))
+
+def count_proxied_bytes(chunks, endpoint):
+    """Yield chunks unchanged, adding their total size to the proxied bytes counter"""
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.inc('proxied_bytes_total', sent, endpoint=endpoint)
+
+def download_body(chunks, endpoint, length=None):
+    """Body of a streamed download: counted, and paced by the egress scheduler"""
+    return egress.throttle(count_proxied_bytes(chunks, endpoint), endpoint, length)
+
+# Content types of the audio containers YouTube serves and of converted MP3s
+AUDIO_MIME_TYPES = {
+    'm4a': 'audio/mp4',
+    'webm': 'audio/webm',
+    'opus': 'audio/ogg',
+    'mp3': 'audio/mpeg',
+}
+
+def native_audio_extension(downloader, url, format_id):
+    """Container extension of the audio stream a download resolves to
+
+    Uses the cached format index of the extraction get_direct_url just did.
+    """
+    fmt = downloader.get_cached_format(url, format_id, 'audio')
+    ext = fmt.get('ext') if fmt else None
+    if ext not in AUDIO_MIME_TYPES:
+        ext = 'webm' if format_id in ('250', '251') else 'm4a'
+    return ext
+
+def proxy_download(direct_url, filename, mime_type):
+    """Stream a googlevideo URL through this server as a file download
+
+    Large files are fetched as parallel byte ranges (see segmented_fetch).
+    """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+        'Accept': '*/*',
+        'Accept-Language': 'en-US,en;q=0.9',
+    }
 
-# Create database tables if they don't exist
-with app.app_context():
-    db.create_all()
-    logger.debug("Database tables created")
+    upstream = open_stream(direct_url, headers)
+    response = Response(download_body(upstream, 'download-file', upstream.length), upstream.status_code)
+    response.call_on_close(upstream.close)
 
-# Initialize the cache manager
-cache_manager = CacheManager(max_size=50)  # Store info for up to 50 videos
+    # Set proper headers for file download
+    response.headers['Content-Type'] = mime_type
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    if upstream.length is not None:
+        response.headers['Content-Length'] = str(upstream.length)
+
+    return response
+
+# Seconds a request waits for a conversion to produce its first bytes
+TRANSCODE_START_TIMEOUT = int(os.environ.get("TRANSCODE_START_TIMEOUT", 60))
+
+def transcoded_response(key, args, filename, mimetype):
+    """Hand a conversion to the transcode pool and stream its output
+
+    Identical conversions in flight are shared. Raises TranscodeError if
+    the job can't be queued or fails before producing output.
+    """
+    job = transcoder.submit(key, args)
+    try:
+        job.wait_for_output(TRANSCODE_START_TIMEOUT)
+    except TranscodeError:
+        transcoder.release(job)
+        raise
+
+    if job.state == 'finished':
+        # The whole output is on disk: send it as a file, which gunicorn
+        # hands to os.sendfile(). The open file outlives the release.
+        try:
+            metrics.inc('proxied_bytes_total', os.path.getsize(job.output_path), endpoint='download-file')
+            return send_file(job.output_path, mimetype=mimetype, as_attachment=True,
+                             download_name=filename)
+        finally:
+            transcoder.release(job)
+
+    response = Response(download_body(job.stream(), 'download-file'), mimetype=mimetype)
+    response.call_on_close(lambda: transcoder.release(job))
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def muxed_response(video_url, audio_url, filename):
+    """Stream separate video and audio streams muxed into one fragmented MP4
+
+    Raises TranscodeError if FFmpeg produces no output in time.
+    """
+    stream = transcoder.open_stream(mux_args(video_url, audio_url))
+    stream.wait_for_output(TRANSCODE_START_TIMEOUT)
+
+    response = Response(download_body(iter(stream), 'download-file'), mimetype='video/mp4')
+    response.call_on_close(stream.close)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def anonymize_ip(ip_address):
+    """Anonymize a client address (IPv4 /24, IPv6 /48) for storage and client keys"""
+    if not ip_address:
+        return ip_address
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return "0.0.0.0"  # Fallback
+    prefix = 24 if address.version == 4 else 48
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False).network_address)
+
+def admission_controlled(controller):
+    """Run a view only once admitted by controller, answering 429 when saturated
+
+    The slot is held until the response body has been sent, so streamed
+    downloads count against the limits for their whole duration.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            client = anonymize_ip(request.remote_addr) or 'unknown'
+            try:
+                ticket = controller.acquire(client)
+            except AdmissionRejected as e:
+                logger.warning("Rejected %s for %s: %s saturated", request.path, client, controller.name)
+                if request.headers.get('Accept', '').startswith('application/json'):
+                    response = jsonify({'error': 'Too many downloads in progress, please retry shortly'})
+                else:
+                    response = make_response(render_template(
+                        'error.html', error='Too many downloads in progress. Please try again in a moment.'))
+                response.status_code = 429
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                ticket.release()
+                raise
+            response.call_on_close(ticket.release)
+            return response
+        return wrapper
+    return decorator
+
+# Credential for the admin pages and actions; unset disables them
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def admin_required(view):
+    """Run an admin view only for requests carrying ADMIN_TOKEN
+
+    The token is accepted as a Bearer token or as the password of HTTP
+    Basic auth (any user name, so browsers prompt for it). Browsers resend
+    Basic credentials with any form post, so cross-site requests are refused.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Admin access is disabled, set ADMIN_TOKEN to enable it'}), 403
+        origin = request.headers.get('Origin')
+        if origin and origin.rstrip('/') != request.host_url.rstrip('/'):
+            return jsonify({'error': 'Cross-site admin requests are not allowed'}), 403
+        auth = request.authorization
+        token = auth and (auth.token if auth.type == 'bearer' else auth.password)
+        if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            logger.warning("Unauthorized admin request to %s", request.path)
+            response = jsonify({'error': 'Admin credentials required'})
+            response.status_code = 401
+            response.headers['WWW-Authenticate'] = 'Basic realm="admin"'
+            return response
+        return view(*args, **kwargs)
+    return wrapper
 
 @app.route('/')
 def index():
     """Main page with the video download form"""
-    # Record site visit for statistics
-    Statistics.record_visit()
-    return render_template('index.html')
+    etag = make_etag('index', time.strftime('%Y'))
+    response = not_modified(etag)
+    if response is None:
+        # Record site visit for statistics (revalidations and visits answered
+        # by a CDN are not counted)
+        Statistics.record_visit()
+        response = cacheable(render_cache.static('index.html'), 'static', etag)
+    # The page shows flashed messages, which live in the session cookie
+    response.vary.add('Cookie')
+    return response
 
 @app.route('/direct-url-process')
 def direct_url_process():
@@ -67,8 +453,8 @@ def direct_url_process():
     url = request.args.get('url', '')
     format_id = request.args.get('format', '22')  # Default to 720p
 
-    # Set download type based on format (140 is audio format)
-    download_type = 'audio' if format_id == '140' else 'video'
+    # Set download type based on format (140, 251 and mp3 are audio formats)
+    download_type = 'audio' if format_id in ('140', '251', 'mp3') else 'video'
 
     if not url:
         flash('Please enter a valid YouTube URL', 'danger')
@@ -82,34 +468,38 @@ def direct_url_process():
             return redirect(url_for('index'))
 
         # Log the direct processing
-        logger.info(f"Direct URL processing: {url}, format: {format_id}, type: {download_type}")
+        logger.info("Direct URL processing: %s, format: %s, type: %s", url, format_id, download_type)
 
         # Redirect directly to the watch page (this creates the 2-page experience)
         return redirect(url_for('watch_video', v=video_id, format=format_id, type=download_type))
     except Exception as e:
-        logger.error(f"Error processing URL: {str(e)}")
+        logger.error("Error processing URL: %s", e)
         flash(f"Error processing URL: {str(e)}", 'danger')
         return redirect(url_for('index'))
 
 @app.route('/direct-download')
+@uncached
 def direct_download():
     """Show download page with direct download button"""
     video_id = request.args.get('v', '')
     format_id = request.args.get('format', '18')  # Default to medium quality
     download_type = request.args.get('type', 'video')  # Default to video
-    timestamp = request.args.get('_t', '')  # Timestamp to avoid caching
     skip_redirect = request.args.get('skip_redirect', 'false') == 'true'  # Skip the redirection to direct URL
 
     if not video_id:
         flash("No video ID provided", 'danger')
         return redirect('/')
 
+    if download_type == 'audio' and format_id == 'mp3':
+        # MP3 is converted on the server, there is no direct URL to hand out
+        return redirect(url_for('download_file', v=video_id, format='mp3', type='audio'))
+
     try:
         # Create a YouTube URL from the video ID
         url = f"https://www.youtube.com/watch?v={video_id}"
 
         # Log download attempt for debugging
-        logger.info(f"Attempting direct download for video: {video_id}, format: {format_id}, type: {download_type}")
+        logger.info("Attempting direct download for video: %s, format: %s, type: %s", video_id, format_id, download_type)
 
         # Initialize the YouTube downloader
         downloader = YoutubeDownloader()
@@ -117,10 +507,10 @@ def direct_download():
         # Get video info to help set the filename before attempting to get direct URL
         # This ensures we have a good title even if the format is changed
         try:
-            video_info = get_yt_info(url)
+            video_info = fetch_video_info(url)
             title = video_info.get('title', f'youtube_{video_id}')
         except Exception as info_error:
-            logger.warning(f"Error getting video info: {str(info_error)}")
+            logger.warning("Error getting video info: %s", info_error)
             title = f'youtube_{video_id}'
 
         # Clean up the title for use as a filename
@@ -133,11 +523,16 @@ def direct_download():
         try:
             # First try with the requested format
             direct_url = downloader.get_direct_url(url, format_id, download_type)
-            logger.info(f"Got direct URL with requested format: {format_id}")
+            logger.info("Got direct URL with requested format: %s", format_id)
         except Exception as format_error:
-            logger.warning(f"Error getting direct URL with format {format_id}: {str(format_error)}")
+            logger.warning("Error getting direct URL with format %s: %s", format_id, format_error)
             error_message = str(format_error)
 
+            # Other formats won't help for a video that is restricted or gone
+            if isinstance(format_error, VideoUnavailableError):
+                flash(f"Error: {error_message}", 'danger')
+                return redirect('/')
+
             # Try with fallback formats
             try:
                 if download_type == 'video':
@@ -150,24 +545,24 @@ def direct_download():
                 for fallback_format in fallback_formats:
                     if fallback_format != format_id:  # Skip the one we already tried
                         try:
-                            logger.info(f"Trying fallback format: {fallback_format}")
+                            logger.info("Trying fallback format: %s", fallback_format)
                             direct_url = downloader.get_direct_url(url, fallback_format, download_type)
                             if direct_url:
-                                logger.info(f"Got direct URL with fallback format: {fallback_format}")
+                                logger.info("Got direct URL with fallback format: %s", fallback_format)
                                 break
                         except Exception as fallback_error:
-                            logger.warning(f"Error with fallback format {fallback_format}: {str(fallback_error)}")
+                            logger.warning("Error with fallback format %s: %s", fallback_format, fallback_error)
             except Exception as fallbacks_error:
-                logger.error(f"Error trying fallback formats: {str(fallbacks_error)}")
+                logger.error("Error trying fallback formats: %s", fallbacks_error)
 
         # If we couldn't get a direct URL, show an error
         if not direct_url:
-            logger.error(f"Failed to get direct URL for video {video_id}: {error_message}")
+            logger.error("Failed to get direct URL for video %s: %s", video_id, error_message)
             flash(f"Error: The requested format is not available. {error_message}", 'danger')
             return redirect(f'/watch?v={video_id}')
 
-        # Set the appropriate extension
-        extension = 'mp4' if download_type == 'video' else 'mp3'
+        # Set the appropriate extension (audio is handed out in its native container)
+        extension = 'mp4' if download_type == 'video' else native_audio_extension(downloader, url, format_id)
 
         # If we're skipping the redirect, return the direct URL as JSON
         if skip_redirect:
@@ -192,6 +587,8 @@ def direct_download():
                 format_label = 'Audio (128kbps M4A)'
             elif format_id == '251':
                 format_label = 'Audio (160kbps OPUS)'
+            elif format_id == 'mp3':
+                format_label = 'Audio (192kbps MP3)'
             else:
                 format_label = 'Audio'
 
@@ -199,18 +596,11 @@ def direct_download():
         Statistics.record_download(download_type)
 
         # Create download record with anonymized IP
-        ip_address = request.remote_addr
-        if ip_address:
-            # Anonymize IP by removing last octet
-            ip_parts = ip_address.split('.')
-            if len(ip_parts) == 4:  # IPv4
-                ip_address = f"{ip_parts[0]}.{ip_parts[1]}.{ip_parts[2]}.0"
-            else:
-                ip_address = "0.0.0.0"  # Fallback
+        ip_address = anonymize_ip(request.remote_addr)
 
         # Add download record
         Download.add_download(
-            url=url,
+            video_id=video_id,
             video_title=title,
             format_type=download_type,
             quality=format_id,
@@ -232,7 +622,7 @@ def direct_download():
                               video_id=video_id)
 
     except Exception as e:
-        logger.error(f"Error generating direct download: {str(e)}")
+        logger.error("Error generating direct download: %s", e)
         flash(f"Error: Unable to download video. {str(e)}", 'danger')
         # Redirect to the watch page if we have the video ID, otherwise to home
         if video_id:
@@ -241,21 +631,24 @@ def direct_download():
             return redirect('/')
 
 @app.route('/faq')
+@static_page
 def faq():
     """Frequently Asked Questions page"""
-    return render_template('faq.html', 
-                          title='YouTube Downloader FAQ - Answers to Common Questions About Downloading Videos',
-                          description='Find answers to frequently asked questions about downloading YouTube videos and converting videos to MP3 using our free online tool.')
+    return render_cache.static('faq.html')
 
-@app.route('/video_info', methods=['POST'])
+@app.route('/video_info', methods=['GET', 'POST'])
 def get_video_info():
-    """Get information about a YouTube video"""
+    """Get information about a YouTube video
+
+    GET /video_info?url=... is cacheable (by ETag of the video and its
+    formats); POST is still accepted for older clients.
+    """
     # Log raw request data for debugging
-    logger.info(f"Received video_info request. Form data: {request.form}")
-    logger.info(f"Request content type: {request.content_type}")
+    logger.debug("Received video_info request. Form data: %s, content type: %s",
+                 request.form, request.content_type)
 
     # Try to get URL from various sources in the request
-    url = request.form.get('url', '')
+    url = request.args.get('url', '') if request.method == 'GET' else request.form.get('url', '')
 
     if not url:
         # If not in form data, try to get from JSON data
@@ -271,21 +664,16 @@ def get_video_info():
                 parsed = parse_qs(request.data.decode('utf-8'))
                 url = parsed.get('url', [''])[0]
             except Exception as parse_error:
-                logger.error(f"Error parsing request data: {str(parse_error)}")
+                logger.error("Error parsing request data: %s", parse_error)
 
-    logger.info(f"Extracted URL: {url}")
+    logger.info("Extracted URL: %s", url)
 
     if not url:
-        return jsonify({'error': 'Please enter a valid YouTube URL'}), 400
+        return no_store(jsonify({'error': 'Please enter a valid YouTube URL'}), 400)
 
     try:
-        # Check if this URL is in cache
-        video_info = cache_manager.get_cache(url)
-
-        if not video_info:
-            # Not in cache, get the info
-            video_info = get_yt_info(url)
-            cache_manager.add_to_cache(url, video_info)
+        # Served from cache or the video catalog when possible
+        video_info = fetch_video_info(url)
 
         # Make sure this is a JSON-serializable dictionary
         if not isinstance(video_info, dict):
@@ -301,16 +689,25 @@ def get_video_info():
             }
 
         # Log successful response
-        logger.info(f"Successfully got video info for {url}")
+        logger.info("Successfully got video info for %s", url)
+
+        # Same video and formats, same ETag: repeat lookups are answered with 304
+        etag = make_etag('video_info', get_video_id(url) or url, info_version(video_info))
+        if request.method == 'GET':
+            cached = not_modified(etag)
+            if cached:
+                return cached
 
         # Add additional headers to ensure content type is correct
         response = jsonify(video_info)
         response.headers['Content-Type'] = 'application/json'
+        if request.method == 'GET':
+            return cacheable(response, 'video', etag)
         return response
 
     except Exception as e:
-        logger.error(f"Error getting video info: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        logger.error("Error getting video info: %s", e)
+        return no_store(jsonify({'error': str(e)}), 500)
 
 @app.route('/download', methods=['POST'])
 def download_video():
@@ -321,7 +718,7 @@ def download_video():
     playlist = request.form.get('playlist', 'false') == 'true'
     video_title = request.form.get('title', 'Unknown Video')
 
-    logger.info(f"Received download request - URL: {url}, Format: {format_id}, Type: {download_type}")
+    logger.info("Received download request - URL: %s, Format: %s, Type: %s", url, format_id, download_type)
 
     if not url:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -337,18 +734,11 @@ def download_video():
             raise ValueError("Could not extract video ID from the URL")
 
         # Get client IP (anonymize it for privacy)
-        ip_address = request.remote_addr
-        if ip_address:
-            # Anonymize IP by removing last octet
-            ip_parts = ip_address.split('.')
-            if len(ip_parts) == 4:  # IPv4
-                ip_address = f"{ip_parts[0]}.{ip_parts[1]}.{ip_parts[2]}.0"
-            else:
-                ip_address = "0.0.0.0"  # Fallback
+        ip_address = anonymize_ip(request.remote_addr)
 
         # Create download record in the database
         download_record = Download.add_download(
-            url=url,
+            video_id=video_id,
             video_title=video_title,
             format_type=download_type,
             quality=format_id,
@@ -382,7 +772,7 @@ def download_video():
             return redirect(watch_url)
 
     except Exception as e:
-        logger.error(f"Error generating download link: {str(e)}")
+        logger.error("Error generating download link: %s", e)
 
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return jsonify({'error': str(e)}), 500
@@ -402,9 +792,9 @@ def watch_video():
     if url and not video_id:
         try:
             video_id = get_video_id(url)
-            logger.info(f"Extracted video ID from URL: {video_id}")
+            logger.info("Extracted video ID from URL: %s", video_id)
         except Exception as e:
-            logger.error(f"Failed to extract video ID from URL: {str(e)}")
+            logger.error("Failed to extract video ID from URL: %s", e)
             flash("Invalid YouTube URL. Please check and try again.", "danger")
             return redirect('/')
 
@@ -415,80 +805,83 @@ def watch_video():
     url = f"https://www.youtube.com/watch?v={video_id}"
 
     try:
-        # Get video information with retry for rate limiting
-        try:
-            video_info = get_yt_info(url)
-        except Exception as info_error:
-            error_msg = str(info_error).lower()
-            # Check if the error is related to rate limiting
-            if "rate" in error_msg and ("exceeded" in error_msg or "limit" in error_msg):
-                logger.warning("Rate limit detected, waiting before retry...")
-                # Wait for a moment (give YouTube API a chance to reset)
-                time.sleep(2)
-                # Try again one more time
-                video_info = get_yt_info(url)
-            else:
-                # Re-raise the original error if it's not a rate limit issue
-                raise
+        # Get video information (rate limiting is handled by the upstream governor,
+        # retrying here would only make a throttle worse)
+        video_info = fetch_video_info(url)
+
+        # The page only depends on the video's info and the requested format
+        version = info_version(video_info)
+        etag = make_etag('watch', video_id, format_id, download_type, version)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        def render_page():
+            # Generate direct download URLs for all formats
+            video_formats = []
+            if video_info.get('video_formats'):
+                for format in video_info['video_formats']:
+                    format_size = format.get('filesize', 0)
+                    size_str = format_readable_size(format_size)
+
+                    video_formats.append({
+                        'format': format.get('format', f"Video {format.get('resolution', '360p')}"),
+                        'format_id': format.get('format_id', '18'),
+                        'ext': format.get('ext', 'mp4'),
+                        'size': size_str,
+                        'download_url': generate_download_file_url(url, format.get('format_id', '18'))
+                    })
+
+            audio_formats = []
+            if video_info.get('audio_formats'):
+                for format in video_info['audio_formats']:
+                    format_size = format.get('filesize', 0)
+                    size_str = format_readable_size(format_size)
+
+                    audio_formats.append({
+                        'format': format.get('format', f"Audio {format.get('abr', '128kbps')}"),
+                        'format_id': format.get('format_id', '140'),
+                        'ext': format.get('ext', 'm4a'),
+                        'size': size_str,
+                        'download_url': generate_download_file_url(url, format.get('format_id', '140'), 'audio')
+                    })
+
+            # Format the video duration
+            duration_str = "0:00"
+            if video_info.get('duration'):
+                minutes, seconds = divmod(video_info['duration'], 60)
+                hours, minutes = divmod(minutes, 60)
+                if hours > 0:
+                    duration_str = f"{hours}:{minutes:02d}:{seconds:02d}"
+                else:
+                    duration_str = f"{minutes}:{seconds:02d}"
 
-        # Generate direct download URLs for all formats
-        video_formats = []
-        if video_info.get('video_formats'):
-            for format in video_info['video_formats']:
-                format_size = format.get('filesize', 0)
-                size_str = format_readable_size(format_size)
-
-                video_formats.append({
-                    'format': format.get('format', f"Video {format.get('resolution', '360p')}"),
-                    'format_id': format.get('format_id', '18'),
-                    'size': size_str,
-                    'download_url': generate_download_file_url(url, format.get('format_id', '18'))
-                })
-
-        audio_formats = []
-        if video_info.get('audio_formats'):
-            for format in video_info['audio_formats']:
-                format_size = format.get('filesize', 0)
-                size_str = format_readable_size(format_size)
-
-                audio_formats.append({
-                    'format': format.get('format', f"Audio {format.get('abr', '128kbps')}"),
-                    'format_id': format.get('format_id', '140'),
-                    'size': size_str,
-                    'download_url': generate_download_file_url(url, format.get('format_id', '140'), 'audio')
-                })
-
-        # Format the video duration
-        duration_str = "0:00"
-        if video_info.get('duration'):
-            minutes, seconds = divmod(video_info['duration'], 60)
-            hours, minutes = divmod(minutes, 60)
-            if hours > 0:
-                duration_str = f"{hours}:{minutes:02d}:{seconds:02d}"
+            # Get the primary download URL for the requested format
+            if download_type == 'audio':
+                primary_download_url = generate_download_file_url(url, format_id, 'audio')
             else:
-                duration_str = f"{minutes}:{seconds:02d}"
+                primary_download_url = generate_download_file_url(url, format_id)
 
-        # Get the primary download URL for the requested format
-        if download_type == 'audio':
-            primary_download_url = generate_download_file_url(url, format_id, 'audio')
-        else:
-            primary_download_url = generate_download_file_url(url, format_id)
+            # Create an embed URL (can't directly embed YouTube videos, but we'll use a workaround)
+            embed_url = f"https://www.youtube.com/embed/{video_id}?autoplay=1&controls=1&rel=0"
 
-        # Create an embed URL (can't directly embed YouTube videos, but we'll use a workaround)
-        embed_url = f"https://www.youtube.com/embed/{video_id}?autoplay=1&controls=1&rel=0"
+            with span('render_template', template='download.html'):
+                return render_template('download.html',
+                                      title=video_info.get('title', 'YouTube Video'),
+                                      video_id=video_id,
+                                      embed_url=embed_url,
+                                      download_url=primary_download_url,
+                                      duration=duration_str,
+                                      video_formats=video_formats,
+                                      audio_formats=audio_formats)
 
-        return render_template('download.html',
-                              title=video_info.get('title', 'YouTube Video'),
-                              video_id=video_id,
-                              embed_url=embed_url,
-                              download_url=primary_download_url,
-                              duration=duration_str,
-                              video_formats=video_formats,
-                              audio_formats=audio_formats)
+        # Format lists and template are only built again when the info changes
+        page = render_cache.render(('download.html', version), render_page)
+        return cacheable(page, 'video', etag)
 
     except Exception as e:
         error_msg = str(e).lower()
-        logger.error(f"Error preparing download page: {error_msg}")
+        logger.error("Error preparing download page: %s", error_msg)
 
         # Provide a more user-friendly message for rate limiting
         if "rate" in error_msg and ("exceeded" in error_msg or "limit" in error_msg):
@@ -533,20 +926,24 @@ def page_not_found(e):
 @app.errorhandler(500)
 def server_error(e):
     """Handle 500 errors"""
-    logger.error(f"Server error: {str(e)}")
+    logger.error("Server error: %s", e)
     return render_template('error.html', error='Server error occurred'), 500
 
 @app.route('/robots.txt')
+@static_page
 def robots():
     """Serve robots.txt file"""
     return send_from_directory('static', 'robots.txt')
 
 @app.route('/sitemap.xml')
+@static_page
 def sitemap():
     """Serve sitemap.xml file"""
     return send_from_directory('static', 'sitemap.xml')
 
 @app.route('/process-download')
+@uncached
+@admission_controlled(download_admission)
 def process_download():
     """Server-side handler for downloading YouTube videos"""
     url = request.args.get('url', '')
@@ -557,7 +954,7 @@ def process_download():
         return redirect('/')
 
     try:
-        logger.info(f"Processing direct download for URL: {url[:50]}...")
+        logger.info("Processing direct download for URL: %s...", url[:50])
 
         # If it's a YouTube direct URL, we need to fetch it through our downloader
         if 'youtube.com' in url or 'youtu.be' in url:
@@ -570,7 +967,7 @@ def process_download():
                 # If we can't extract from URL, assume it's a direct streaming URL
                 logger.info("URL appears to be a direct streaming URL, passing through")
             else:
-                logger.info(f"Extracted video ID: {video_id}, attempting to get direct URL")
+                logger.info("Extracted video ID: %s, attempting to get direct URL", video_id)
                 # Determine if it's audio or video based on filename
                 download_type = 'audio' if filename.lower().endswith(('.mp3', '.m4a', '.opus', '.ogg')) else 'video'
 
@@ -578,17 +975,13 @@ def process_download():
                 url = downloader.get_direct_url(url, 'best', download_type)
 
         # Create a proxy request to the target URL
-        logger.info(f"Fetching content from: {url[:50]}...")
-
-        # Make a streaming request to the source
-        response = requests.get(
-            url, 
-            stream=True, 
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Referer': 'https://www.youtube.com/'
-            }
-        )
+        logger.info("Fetching content from: %s...", url[:50])
+
+        # Make a streaming request to the source (parallel byte ranges for large files)
+        response = open_stream(url, headers={
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Referer': 'https://www.youtube.com/'
+        })
 
         # Get content type from response or guess from filename
         content_type = response.headers.get('Content-Type')
@@ -607,33 +1000,33 @@ def process_download():
 
         # Create a flask response with streaming content
         flask_response = Response(
-            response.iter_content(chunk_size=4096),
+            download_body(response, 'process-download', response.length),
             content_type=content_type
         )
+        flask_response.call_on_close(response.close)
 
         # Add content-disposition header to force download with the specified filename
         flask_response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
 
         # Pass through content length if available
-        if 'Content-Length' in response.headers:
-            flask_response.headers['Content-Length'] = response.headers['Content-Length']
+        if response.length is not None:
+            flask_response.headers['Content-Length'] = str(response.length)
 
         # Record download statistics
         Statistics.record_download('video' if content_type.startswith('video') else 'audio')
 
-        logger.info(f"Sending file: {filename} with content type: {content_type}")
+        logger.info("Sending file: %s with content type: %s", filename, content_type)
         return flask_response
 
     except Exception as e:
         error_msg = str(e).lower()
-        logger.error(f"Error processing download: {error_msg}")
+        logger.error("Error processing download: %s", error_msg)
 
         # Provide a more user-friendly message for bot detection errors
         if "sign in to confirm you're not a bot" in error_msg or "bot" in error_msg:
             flash("YouTube has detected automated access. Please try again in a few moments as the system refreshes authentication.", 'warning')
-            # Force refresh cookies on bot detection errors
-            from cookie_manager import refresh_cookies
-            refresh_cookies()
+            # Refresh cookies in the background (at most one refresh at a time)
+            refresh_cookies_async()
         elif "rate" in error_msg and ("exceeded" in error_msg or "limit" in error_msg):
             flash("YouTube rate limit exceeded. Please wait a moment and try again.", 'warning')
         else:
@@ -646,10 +1039,17 @@ def google_verification():
     """Serve Google verification file"""
     return send_file('google07df394c40c0da6f.html')
 
+@app.route('/static/<path:filename>', endpoint='static')
+def static_file(filename):
+    """Static files, fingerprinted and precompressed once built (see assets)"""
+    return assets.send(filename)
+
 @app.route('/sw.js')
 def service_worker():
     """Serve the MonetAG service worker JavaScript file"""
-    response = send_file('sw.js')
+    # Compressed when built, but never fingerprinted: its URL must not change
+    built = assets.built_name('sw.js')
+    response = assets.send(built) if built else send_file('sw.js')
     # Set appropriate headers for a service worker
     response.headers['Content-Type'] = 'application/javascript'
     response.headers['Service-Worker-Allowed'] = '/'
@@ -657,11 +1057,12 @@ def service_worker():
     return response
 
 @app.route('/download-file')
+@uncached
+@admission_controlled(download_admission)
 def download_file():
     """Direct file download endpoint - this serves the actual file content instead of HTML"""
     import os
     import tempfile
-    import yt_dlp
 
     # Get parameters
     video_id = request.args.get('v', '')
@@ -675,12 +1076,20 @@ def download_file():
     # Create YouTube URL
     url = f"https://www.youtube.com/watch?v={video_id}"
 
+    # Audio is served in its native container unless MP3 was asked for explicitly
+    convert_to_mp3 = download_type == 'audio' and format_id == 'mp3'
+    if convert_to_mp3 and not transcoder.available():
+        # Never send m4a/webm bytes under an .mp3 name
+        logger.error("MP3 requested for %s but FFmpeg is not available", video_id)
+        flash("MP3 conversion is not available right now. Please choose one of the original audio formats.", "danger")
+        return redirect(f'/watch?v={video_id}')
+
     try:
         # Initialize downloader
         downloader = YoutubeDownloader()
 
         # Get direct URL to the YouTube content
-        logger.info(f"Getting direct URL for: {url} with format: {format_id}, type: {download_type}")
+        logger.info("Getting direct URL for: %s with format: %s, type: %s", url, format_id, download_type)
         direct_url = downloader.get_direct_url(url, format_id, download_type)
 
         if not direct_url:
@@ -689,19 +1098,23 @@ def download_file():
 
         # Try to get video info to set a good filename
         try:
-            video_info = get_yt_info(url)
+            video_info = fetch_video_info(url)
             title = video_info.get('title', f'youtube_{video_id}')
         except Exception as e:
-            logger.warning(f"Error getting video info: {str(e)}")
+            logger.warning("Error getting video info: %s", e)
             title = f'youtube_{video_id}'
 
         # Make the title safe for a filename
         safe_title = secure_filename(title).replace(' ', '_')
 
         # Set the appropriate extension and MIME type
-        if download_type == 'audio':
+        if convert_to_mp3:
             extension = '.mp3'
             mime_type = 'audio/mpeg'
+        elif download_type == 'audio':
+            audio_extension = native_audio_extension(downloader, url, format_id)
+            extension = f'.{audio_extension}'
+            mime_type = AUDIO_MIME_TYPES[audio_extension]
         else:
             extension = '.mp4'
             mime_type = 'video/mp4'
@@ -709,17 +1122,16 @@ def download_file():
         # Create proper filename
         filename = f"{safe_title}{extension}"
 
-        logger.info(f"Making request to: {direct_url[:50]}...")
+        logger.info("Making request to: %s...", direct_url[:50])
 
         # Fix for Replit's proxy issue: Instead of streaming through Flask,
         # we need to handle this differently for production vs. development
         from urllib.parse import urlparse
-        import requests
 
         # Make sure the URL is valid and properly formatted
         parsed_url = urlparse(direct_url)
         if not all([parsed_url.scheme, parsed_url.netloc]):
-            logger.error(f"Invalid direct URL format: {direct_url[:50]}...")
+            logger.error("Invalid direct URL format: %s...", direct_url[:50])
             flash("Error: Could not generate a valid download link", "danger")
             return redirect('/')
 
@@ -728,23 +1140,50 @@ def download_file():
             Statistics.record_download(download_type)
         except Exception as stats_error:
             # Don't let statistics recording issues prevent downloads
-            logger.error(f"Error recording statistics: {str(stats_error)}")
+            logger.error("Error recording statistics: %s", stats_error)
             pass
 
         # Check if we're in a redirect loop (direct_url pointing to our own domain)
         if 'replit.app' in parsed_url.netloc or 'repl.co' in parsed_url.netloc:
-            logger.error(f"Detected redirect loop to Replit domain: {parsed_url.netloc}")
+            logger.error("Detected redirect loop to Replit domain: %s", parsed_url.netloc)
             flash("Error: Download redirect loop detected. Please try again.", "warning")
             return redirect(f'/watch?v={video_id}')
 
         # Detect if we're running in a production environment (Replit deploy)
         is_production = 'REPL_ID' in os.environ and 'REPL_OWNER' in os.environ
-        logger.info(f"Running in {'production' if is_production else 'development'} environment")
+        logger.info("Running in %s environment", 'production' if is_production else 'development')
+
+        if download_type == 'audio' and not convert_to_mp3:
+            # Native audio needs no FFmpeg, stream it as it arrives
+            logger.info("Streaming native %s audio", extension)
+            return proxy_download(direct_url, filename, mime_type)
+
+        if download_type == 'video':
+            # Above 360p YouTube serves video and audio separately, mux them on the fly
+            video_format, audio_format = downloader.get_cached_streams(url, format_id)
+            if audio_format is not None and transcoder.available():
+                logger.info("Muxing video %s with audio %s", video_format['format_id'], audio_format['format_id'])
+                try:
+                    return muxed_response(video_format['url'], audio_format['url'], filename)
+                except TranscodeError as mux_error:
+                    logger.error("Error muxing video: %s", mux_error)
+                    flash(f"Error: {mux_error}", "danger")
+                    return redirect(f'/watch?v={video_id}')
+
+        if convert_to_mp3:
+            # Convert in the transcode pool straight from the audio stream
+            try:
+                return transcoded_response((video_id, 'mp3', '192'), audio_args(direct_url, 'mp3', '192'),
+                                           filename, mime_type)
+            except TranscodeError as transcode_error:
+                logger.error("Error converting audio: %s", transcode_error)
+                flash(f"Error: {transcode_error}", "danger")
+                return redirect(f'/watch?v={video_id}')
 
         if is_production:
             # In production, we need a more robust approach that's less likely to be flagged as a bot
             try:
-                logger.info(f"Production mode: Using direct download method...")
+                logger.info("Production mode: Using direct download method...")
 
                 import yt_dlp
                 import time
@@ -786,7 +1225,7 @@ def download_file():
                         # No post-processing needed for video
                         postprocessors = []
 
-                    logger.info(f"Using format string: {format_string}")
+                    logger.info("Using format string: %s", format_string)
 
                     # Generate a random request ID to avoid caching issues
                     request_id = ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=8))
@@ -795,13 +1234,11 @@ def download_file():
                     ydl_opts = {
                         'format': format_string,
                         'outtmpl': output_template,
-                        'quiet': False,
-                        'no_warnings': False,
+                        **ytdlp_log_options(),
                         'cookiefile': 'cookies.txt',
                         'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
                         'referer': 'https://www.youtube.com/feed/trending',
                         'ignoreerrors': False,
-                        'verbose': True,
                         'nocheckcertificate': True,
                         'geo_bypass': True,
                         'extractor_args': {'youtube': {'player_client': ['web']}},
@@ -814,17 +1251,19 @@ def download_file():
                             'Referer': 'https://www.youtube.com/',
                         },
                         'postprocessors': postprocessors,
+                        'postprocessor_hooks': [postprocessor_timing_hook],
                     }
 
                     # Create safe filename
                     safe_filename = f"{safe_title}.{file_extension}"
 
                     # Download the file using yt-dlp
-                    logger.info(f"Starting direct download to {temp_dir}...")
+                    logger.info("Starting direct download to %s...", temp_dir)
                     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                         try:
                             # Download the file
-                            info = ydl.extract_info(url, download=True)
+                            with metrics.timed('youtube_extract_seconds', download=True):
+                                info = governor.call(ydl.extract_info, url, download=True)
 
                             if not info:
                                 logger.error("Failed to extract video info")
@@ -842,24 +1281,26 @@ def download_file():
                                     base_path, _ = os.path.splitext(download_path)
                                     download_path = f"{base_path}.mp3"
 
-                            logger.info(f"Downloaded file to: {download_path}")
+                            logger.info("Downloaded file to: %s", download_path)
 
                             # Check if file exists
                             if not os.path.exists(download_path):
-                                logger.error(f"Downloaded file not found at {download_path}")
+                                logger.error("Downloaded file not found at %s", download_path)
                                 # Try to find any file in the temp directory
                                 files = os.listdir(temp_dir)
                                 if files:
                                     download_path = os.path.join(temp_dir, files[0])
-                                    logger.info(f"Found alternative file: {download_path}")
+                                    logger.info("Found alternative file: %s", download_path)
                                 else:
                                     flash("Error: Download failed, no file was created.", "danger")
                                     return redirect(f'/watch?v={video_id}')
 
                             # File exists, serve it directly
-                            logger.info(f"Serving file: {download_path}")
+                            logger.info("Serving file: %s", download_path)
 
                             # Serve the file
+                            metrics.inc('proxied_bytes_total', os.path.getsize(download_path),
+                                        endpoint='download-file')
                             return send_file(
                                 download_path,
                                 as_attachment=True,
@@ -868,16 +1309,16 @@ def download_file():
                             )
 
                         except Exception as download_error:
-                            logger.error(f"Error during direct download: {str(download_error)}")
+                            logger.error("Error during direct download: %s", download_error)
                             flash(f"Download error: {str(download_error)}", "danger")
                             return redirect(f'/watch?v={video_id}')
 
             except Exception as pytube_error:
-                logger.error(f"Error with pytube: {str(pytube_error)}")
+                logger.error("Error with pytube: %s", pytube_error)
 
                 # Try with our original proxy method as a fallback
                 try:
-                    logger.info(f"Falling back to direct file serving method...")
+                    logger.info("Falling back to direct file serving method...")
 
                     # Configure yt-dlp for direct download
                     ydl_opts = {
@@ -885,14 +1326,14 @@ def download_file():
                         'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
                         'cookiefile': 'cookies.txt',
                         'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
-                        'quiet': True,
-                        'no_warnings': True,
+                        **ytdlp_log_options(),
                         'nocheckcertificate': True,
                         'geo_bypass': True
                     }
 
                     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=True)
+                        with metrics.timed('youtube_extract_seconds', download=True):
+                            info = governor.call(ydl.extract_info, url, download=True)
                         if not info:
                             raise Exception("Could not download video")
 
@@ -903,6 +1344,8 @@ def download_file():
                             raise Exception("Downloaded file not found")
 
                         # Return the file directly
+                        metrics.inc('proxied_bytes_total', os.path.getsize(download_path),
+                                    endpoint='download-file')
                         return send_file(
                             download_path,
                             as_attachment=True,
@@ -910,47 +1353,29 @@ def download_file():
                             mimetype=mime_type
                         )
                 except Exception as proxy_error:
-                    logger.error(f"Error with fallback proxy: {str(proxy_error)}")
+                    logger.error("Error with fallback proxy: %s", proxy_error)
                     flash(f"Error: {str(pytube_error)}. Fallback also failed: {str(proxy_error)}", "danger")
                     return redirect(f'/watch?v={video_id}')
         else:
             # In development, redirect to the direct URL (works fine locally)
-            logger.info(f"Development mode: Redirecting to direct URL: {direct_url[:50]}...")
+            logger.info("Development mode: Redirecting to direct URL: %s...", direct_url[:50])
 
             # Stream the content through our server instead of redirecting
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
-                'Accept': '*/*',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Range': 'bytes=0-'
-            }
-
-            remote_response = requests.get(direct_url, headers=headers, stream=True)
-
-            def generate():
-                for chunk in remote_response.iter_content(chunk_size=8192):
-                    yield chunk
-
-            response = Response(generate(), remote_response.status_code)
-
-            # Set proper headers for file download
-            response.headers['Content-Type'] = mime_type
-            response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-            if 'Content-Length' in remote_response.headers:
-                response.headers['Content-Length'] = remote_response.headers['Content-Length']
-
-            return response
+            return proxy_download(direct_url, filename, mime_type)
 
     except Exception as e:
         error_msg = str(e).lower()
-        logger.error(f"Error in download_file: {error_msg}")
+        logger.error("Error in download_file: %s", error_msg)
+
+        if isinstance(e, UpstreamError) and e.status_code in (403, 410):
+            # The stream URL of the cached extraction was refused, extract again next time
+            format_cache.remove_from_cache(video_id)
 
         # Provide a more user-friendly message for bot detection errors
         if "sign in to confirm you're not a bot" in error_msg or "bot" in error_msg:
             flash("YouTube has detected automated access. Please try again in a few moments as the system refreshes authentication.", 'warning')
-            # Force refresh cookies on bot detection errors
-            from cookie_manager import refresh_cookies
-            refresh_cookies()
+            # Refresh cookies in the background (at most one refresh at a time)
+            refresh_cookies_async()
         elif "rate" in error_msg and ("exceeded" in error_msg or "limit" in error_msg):
             flash("YouTube rate limit exceeded. Please wait a moment and try again.", 'warning')
         else:
@@ -959,24 +1384,28 @@ def download_file():
         return redirect(f'/watch?v={video_id}')
 
 @app.route('/privacy')
+@static_page
 def privacy_policy():
     """Privacy Policy page"""
-    return render_template('privacy.html')
+    return render_cache.static('privacy.html')
 
 @app.route('/disclaimer')
+@static_page
 def disclaimer():
     """Disclaimer and Terms of Service page"""
-    return render_template('disclaimer.html')
+    return render_cache.static('disclaimer.html')
 
 @app.route('/donate')
+@static_page
 def donate():
     """Donation page"""
-    return render_template('donate.html')
+    return render_cache.static('donate.html')
 
 @app.route('/admin')
+@admin_required
+@uncached
 def admin_dashboard():
-    """Admin dashboard with download statistics"""
-    # This should have proper authentication in production
+    """Admin dashboard with download statistics (requires ADMIN_TOKEN)"""
 
     # Get overall statistics
     current_date = datetime.datetime.utcnow().date()
@@ -1016,19 +1445,20 @@ def admin_dashboard():
             from sqlalchemy import func
             popular_downloads_query = (
                 db.session.query(
-                    Download.video_title,
+                    func.coalesce(Video.title, Download.video_id).label('video_title'),
                     Download.format_type,
                     Download.quality,
                     func.count(Download.id).label('count')
                 )
+                .join(Video, Download.video_id == Video.id)
                 .filter(Download.status == 'completed')
-                .group_by(Download.video_title, Download.format_type, Download.quality)
+                .group_by(Download.video_id, Video.title, Download.format_type, Download.quality)
                 .order_by(func.count(Download.id).desc())
                 .limit(10)
             )
             popular_downloads = popular_downloads_query.all()
     except Exception as e:
-        logger.error(f"Error getting popular downloads: {str(e)}")
+        logger.error("Error getting popular downloads: %s", e)
         popular_downloads = []
 
     # Get recent downloads
@@ -1036,7 +1466,7 @@ def admin_dashboard():
     try:
         recent_downloads = Download.query.order_by(Download.created_at.desc()).limit(20).all()
     except Exception as e:
-        logger.error(f"Error getting recent downloads: {str(e)}")
+        logger.error("Error getting recent downloads: %s", e)
         recent_downloads = []
 
     return render_template(
@@ -1053,9 +1483,67 @@ def admin_dashboard():
             'downloads': downloads_data
         },
         popular_downloads=popular_downloads,
-        recent_downloads=recent_downloads
+        recent_downloads=recent_downloads,
+        slow_traces=tracer.slow_traces.slowest(),
+        profile_reports=list(tracer.profile_reports),
+        profile_budget=tracer.profile_budget
     )
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics aggregated across all worker processes"""
+    return Response(metrics.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/upstream')
+@admin_required
+def upstream_status():
+    """Current state of the upstream rate limiter and circuit breaker (requires ADMIN_TOKEN)"""
+    return jsonify(governor.snapshot())
+
+@app.route('/admin/admission')
+@admin_required
+def admission_status():
+    """Current state of download admission control (requires ADMIN_TOKEN)"""
+    return jsonify(download_admission.snapshot())
+
+@app.route('/admin/egress')
+@admin_required
+def egress_status():
+    """Egress scheduler settings and streams of this worker (requires ADMIN_TOKEN)"""
+    return jsonify(egress.snapshot())
+
+@app.route('/admin/egress', methods=['POST'])
+@admin_required
+def update_egress():
+    """Change egress settings on all workers (requires ADMIN_TOKEN)
+
+    Accepts JSON or form fields budget, stream_rate, small_bytes (bytes,
+    bytes/second) and weights ({"download-file": 2, ...}, JSON only).
+    """
+    changes = request.get_json(silent=True) or request.form.to_dict()
+    try:
+        return jsonify(egress.update(**changes))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/admin/traces')
+@admin_required
+def trace_status():
+    """Span trees of the slowest recent requests in this worker (requires ADMIN_TOKEN)"""
+    return jsonify(tracer.slow_traces.slowest())
+
+@app.route('/admin/profiling', methods=['POST'])
+@admin_required
+def arm_profiler():
+    """Profile the next N requests handled by this worker (requires ADMIN_TOKEN)"""
+    try:
+        count = int(request.form.get('count', 1))
+    except ValueError:
+        count = 1
+    tracer.arm_profiler(min(count, 100))
+    flash(f'Profiling the next {min(count, 100)} request(s) of this worker', 'info')
+    return redirect(url_for('admin_dashboard'))
+
 # SEO-optimized metadata for page titles and descriptions
 @app.context_processor
 def inject_seo_metadata():
@@ -0,0 +1,287 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+
+from flask import request, send_file, url_for, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are built
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT, 'static')
+# Build output inside the static directory, so it is served under /static/dist/
+DIST = 'dist'
+
+# Files served from the app root under a fixed URL: only compressed, never
+# fingerprinted (sw.js is minified already)
+STABLE_FILES = {'sw.js': os.path.join(ROOT, 'sw.js')}
+
+# Precompressed variants, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE = ('.js', '.css', '.svg', '.json', '.txt', '.xml', '.html')
+
+# Fingerprinted files never change, so browsers and CDNs may keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+FINGERPRINTED = re.compile(r'^(.+)\.([0-9a-f]{10})(\.[^./]+)$')
+
+def minify_js(source):
+    """Remove comments and indentation from JavaScript
+
+    Conservative: strings, template literals and regular expressions are
+    copied as they are, runs of spaces become one and line breaks are kept
+    (minus blank lines) so automatic semicolon insertion is unaffected.
+    """
+    out = []
+    i, n = 0, len(source)
+
+    def space(newline):
+        # Whitespace and comments between two tokens become one space or line break
+        if out and out[-1] in (' ', '\n'):
+            out[-1] = '\n' if newline or out[-1] == '\n' else ' '
+        elif out:
+            out.append('\n' if newline else ' ')
+    # One entry per open template literal: brace depth of its ${...} code
+    templates = []
+    last = ''  # Last significant code character, to tell regexes from division
+    word = ''  # Last identifier, for regexes after return/typeof/...
+    while i < n:
+        c = source[i]
+        if c in '"\'':
+            end = i + 1
+            while end < n and source[end] != c and source[end] != '\n':
+                end += 2 if source[end] == '\\' else 1
+            out.append(source[i:end + 1])
+            i, last, word = end + 1, c, ''
+        elif c == '`' or (c == '}' and templates and templates[-1] == 0):
+            if c == '}':
+                templates.pop()
+            end = i + 1
+            while end < n and source[end] != '`' and source[end:end + 2] != '${':
+                end += 2 if source[end] == '\\' else 1
+            if source[end:end + 2] == '${':
+                templates.append(0)
+                out.append(source[i:end + 2])
+                i, last, word = end + 2, '{', ''
+            else:
+                out.append(source[i:end + 1])
+                i, last, word = end + 1, '`', ''
+        elif source.startswith('//', i):
+            while i < n and source[i] != '\n':
+                i += 1
+            space(False)
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            space('\n' in source[i:end])
+            i = end
+        elif c == '/' and (not last or last in '(,=:[!&|?{};+-*%<>~^' or
+                           word in ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void')):
+            end, in_class = i + 1, False
+            while end < n and source[end] != '\n' and (in_class or source[end] != '/'):
+                if source[end] == '\\':
+                    end += 1
+                elif source[end] == '[':
+                    in_class = True
+                elif source[end] == ']':
+                    in_class = False
+                end += 1
+            end += 1
+            while end < n and (source[end].isalnum()):  # flags
+                end += 1
+            out.append(source[i:end])
+            i, last, word = end, '/', ''
+        elif c in ' \t\r\n':
+            end = i
+            while end < n and source[end] in ' \t\r\n':
+                end += 1
+            space('\n' in source[i:end])
+            i = end
+        else:
+            if templates and c in '{}':
+                templates[-1] += 1 if c == '{' else -1
+            if c.isalnum() or c in '_$':
+                word = word + c if (last.isalnum() or last in '_$') else c
+            else:
+                word = ''
+            out.append(c)
+            i, last = i + 1, c
+    return ''.join(out).strip() + '\n'
+
+def minify_css(source):
+    """Remove comments and whitespace that CSS does not need"""
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', source)
+    for index in range(0, len(parts), 2):
+        css = re.sub(r'/\*.*?\*/', '', parts[index], flags=re.S)
+        css = re.sub(r'\s+', ' ', css)
+        css = re.sub(r'\s*([{};,])\s*', r'\1', css)
+        css = re.sub(r':\s+', ':', css)
+        parts[index] = css.replace(';}', '}')
+    return ''.join(parts).strip() + '\n'
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+def _write(path, data):
+    """Write a build output unless it is already there with this content"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _sources(static_dir):
+    """(name, path, fingerprint) of every file to build"""
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        if dirpath == static_dir:
+            # Top level files (robots.txt, sitemap.xml) are served under fixed URLs
+            dirnames[:] = sorted(d for d in dirnames if d != DIST)
+            continue
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            yield os.path.relpath(path, static_dir).replace(os.sep, '/'), path, True
+    for name, path in STABLE_FILES.items():
+        if os.path.isfile(path):
+            yield name, path, False
+
+def build_assets(static_dir=STATIC_DIR):
+    """Minify, fingerprint and precompress the static files; returns {name: sizes}
+
+    Output goes to static/dist/ with a manifest.json mapping each source
+    name (as passed to asset_url) to its built file. Outputs of earlier
+    builds are kept, so pages cached elsewhere can still load them.
+    """
+    manifest, report = {}, {}
+    for name, path, fingerprint in _sources(static_dir):
+        with open(path, 'rb') as f:
+            data = f.read()
+        base, ext = os.path.splitext(name)
+        minify = MINIFIERS.get(ext)
+        if minify and fingerprint and not base.endswith('.min'):
+            data = minify(data.decode('utf-8')).encode('utf-8')
+        if fingerprint:
+            built = f"{DIST}/{base}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+        else:
+            built = f"{DIST}/{name}"
+        target = os.path.join(static_dir, built)
+        _write(target, data)
+
+        sizes = {'source': os.path.getsize(path), 'built': len(data)}
+        if ext in COMPRESSIBLE:
+            variants = {'gzip': gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                variants['br'] = brotli.compress(data, quality=11)
+            for encoding, suffix in ENCODINGS:
+                compressed = variants.get(encoding)
+                # Only kept when it saves something
+                if compressed is not None and len(compressed) < len(data):
+                    _write(target + suffix, compressed)
+                    sizes[encoding] = len(compressed)
+        manifest[name] = built
+        report[name] = sizes
+
+    _write(os.path.join(static_dir, DIST, 'manifest.json'),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    logger.info("Built %s assets (brotli %s)", len(manifest), 'on' if brotli else 'not installed')
+    return report
+
+class Assets:
+    """Built static files: URLs from the manifest and precompressed responses
+
+    Without a build (no manifest) the original files are served as before.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR):
+        self.static_dir = static_dir
+        self.manifest = None    # source name -> built file (relative to static_dir)
+        self.built = set()      # built files with a fingerprint
+        self.encodings = {}     # built file -> encodings it has a precompressed variant for
+
+    def load(self):
+        """Read the manifest (once per process; workers start after the build)"""
+        if self.manifest is not None:
+            return self.manifest
+        try:
+            with open(os.path.join(self.static_dir, DIST, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read asset manifest: %s", e)
+            manifest = {}
+        self.built = {built for name, built in manifest.items() if name not in STABLE_FILES}
+        self.encodings = {
+            built: [encoding for encoding, suffix in ENCODINGS
+                    if os.path.isfile(os.path.join(self.static_dir, built + suffix))]
+            for built in manifest.values()
+        }
+        self.manifest = manifest
+        return manifest
+
+    def url(self, filename, **kwargs):
+        """URL of a static file, its built version when there is one (the asset_url template helper)"""
+        return url_for('static', filename=self.load().get(filename, filename), **kwargs)
+
+    def built_name(self, name):
+        """Built file for a source name, None before a build"""
+        return self.load().get(name)
+
+    def send(self, filename):
+        """Response for a file of the static directory
+
+        Picks the precompressed variant the client accepts and marks
+        fingerprinted files immutable. A fingerprint from an older build
+        gets the current version of the file, without the long caching.
+        """
+        manifest = self.load()
+        path = safe_join(self.static_dir, filename)
+        if path is None or not os.path.isfile(path):
+            match = FINGERPRINTED.match(filename)
+            source = match and f"{match.group(1)[len(DIST) + 1:]}{match.group(3)}"
+            if not source or not filename.startswith(DIST + '/') or source not in manifest:
+                abort(404)
+            filename = manifest[source]
+            response = self._send_file(filename)
+            response.cache_control.no_cache = True
+            return response
+        response = self._send_file(filename)
+        if filename in self.built:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    def _send_file(self, filename):
+        path = os.path.join(self.static_dir, filename)
+        encodings = self.encodings.get(filename, ())
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings and request.accept_encodings[encoding]:
+                mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+                response = send_file(path + suffix, mimetype=mimetype,
+                                     download_name=os.path.basename(path))
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_file(path)
+        if encodings:
+            response.vary.add('Accept-Encoding')
+        return response
+
+# Process-wide view of the build, used by the static route and asset_url
+assets = Assets()
@@ -0,0 +1,284 @@
+"""Local stand-in for YouTube used by the load test.
+
+Serves just enough of YouTube for yt-dlp's extractor and cookie_manager to
+run offline:
+
+- /watch                      watch page with an embedded player response
+- POST /youtubei/v1/player    innertube player response (what yt-dlp's clients ask for)
+- POST /youtubei/v1/next      minimal initial data
+- /videoplayback              media byte stream, with Range support
+- /, /feed/*, /results        pages setting the cookies cookie_manager collects
+
+install_redirects() points yt-dlp and requests at the fake server by
+rewriting youtube.com URLs, so the app itself runs unmodified.
+
+Usage (standalone, for poking at it with curl):
+    python benchmarks/fake_upstream.py --port 8765
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+YOUTUBE_URL_RE = re.compile(r'^https?://(?:www\.|m\.|music\.)?youtube\.com')
+
+# itag, mime type, height, audio bitrate (kbps)
+FORMATS = [
+    (18, 'video/mp4; codecs="avc1.42001E, mp4a.40.2"', 360, 96),
+    (22, 'video/mp4; codecs="avc1.64001F, mp4a.40.2"', 720, 192),
+    (137, 'video/mp4; codecs="avc1.640028"', 1080, None),
+    (140, 'audio/mp4; codecs="mp4a.40.2"', None, 128),
+    (251, 'audio/webm; codecs="opus"', None, 160),
+]
+
+
+class FakeYouTube:
+    """Threaded HTTP server imitating the YouTube endpoints the app uses"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, stream_size=2 * 1024 * 1024,
+                 duration=212):
+        self.latency = latency
+        self.stream_size = stream_size
+        self.duration = duration
+        self.payload = bytes(range(256)) * (stream_size // 256 + 1)
+        self.counts = {}
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+        handler = type('Handler', (_Handler,), {'upstream': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def record(self, endpoint, sent=0):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            self.bytes_sent += sent
+
+    def snapshot(self):
+        """Call counts per endpoint and bytes served so far"""
+        with self.lock:
+            return {'calls': dict(self.counts), 'bytes_sent': self.bytes_sent}
+
+    def player_response(self, video_id):
+        """Innertube player response with unciphered format URLs"""
+        formats = []
+        for itag, mime, height, abr in FORMATS:
+            fmt = {
+                'itag': itag,
+                'url': f"{self.base_url}/videoplayback?id={video_id}&itag={itag}",
+                'mimeType': mime,
+                'bitrate': 1000000,
+                'contentLength': str(self.stream_size),
+                'approxDurationMs': str(self.duration * 1000),
+                'lastModified': '1700000000000000',
+            }
+            if height:
+                fmt.update(width=height * 16 // 9, height=height, fps=30,
+                           qualityLabel=f"{height}p", quality='medium')
+            if abr:
+                fmt.update(audioQuality='AUDIO_QUALITY_MEDIUM', averageBitrate=abr * 1000,
+                           audioSampleRate='44100', audioChannels=2)
+            formats.append(fmt)
+
+        return {
+            'playabilityStatus': {'status': 'OK'},
+            'streamingData': {
+                'expiresInSeconds': '21540',
+                'formats': [f for f in formats if f['itag'] in (18, 22)],
+                'adaptiveFormats': [f for f in formats if f['itag'] not in (18, 22)],
+            },
+            'videoDetails': {
+                'videoId': video_id,
+                'title': f"Benchmark video {video_id}",
+                'lengthSeconds': str(self.duration),
+                'channelId': 'UCbenchmark',
+                'author': 'Benchmark Channel',
+                'viewCount': '1000',
+                'shortDescription': 'Served by the fake upstream',
+                'thumbnail': {'thumbnails': []},
+                'isLiveContent': False,
+            },
+            'microformat': {'playerMicroformatRenderer': {
+                'uploadDate': '2024-01-01', 'publishDate': '2024-01-01', 'category': 'Music',
+            }},
+        }
+
+
+INITIAL_DATA = {'contents': {'twoColumnWatchNextResults': {'results': {'results': {
+    'contents': [{'videoPrimaryInfoRenderer': {}}]}}}}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    upstream = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type='text/html; charset=utf-8', status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _video_id(self, default='dQw4w9WgXcQ'):
+        match = re.search(r'[?&](?:v|id)=([\w-]{11})', self.path)
+        return match.group(1) if match else default
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if self.upstream.latency:
+            time.sleep(self.upstream.latency)
+
+        if path == '/watch':
+            self.upstream.record('watch')
+            player = json.dumps(self.upstream.player_response(self._video_id()))
+            page = (
+                '<html><head><title>Benchmark - YouTube</title></head><body>'
+                '<script>ytcfg.set({"INNERTUBE_API_KEY": "benchmark", "INNERTUBE_CONTEXT": '
+                '{"client": {"clientName": "WEB", "clientVersion": "2.20240101.00.00"}}});</script>'
+                f'<script>var ytInitialPlayerResponse = {player};</script>'
+                f'<script>var ytInitialData = {json.dumps(INITIAL_DATA)};</script>'
+                '</body></html>'
+            )
+            self._send(page.encode())
+        elif path == '/videoplayback':
+            self._send_stream()
+        elif path == '/' or path.startswith('/feed/') or path == '/results':
+            self.upstream.record('cookies')
+            self._send(b'<html><body>Benchmark</body></html>', headers={
+                'Set-Cookie': 'VISITOR_INFO1_LIVE=benchmark; Path=/',
+            })
+        elif path == '/iframe_api':
+            self.upstream.record('iframe_api')
+            self._send(b'var scriptUrl = "";', 'text/javascript')
+        else:
+            self.upstream.record('not_found')
+            self._send(b'Not found', status=404)
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            body = {}
+        if self.upstream.latency:
+            time.sleep(self.upstream.latency)
+
+        if path == '/youtubei/v1/player':
+            self.upstream.record('player_api')
+            response = self.upstream.player_response(body.get('videoId') or self._video_id())
+        elif path == '/youtubei/v1/next':
+            self.upstream.record('next_api')
+            response = INITIAL_DATA
+        else:
+            self.upstream.record('not_found')
+            return self._send(b'{}', 'application/json', status=404)
+        self._send(json.dumps(response).encode(), 'application/json')
+
+    def _send_stream(self):
+        """Serve the media payload, honouring a single byte range"""
+        size = self.upstream.stream_size
+        start, end, status = 0, size - 1, 200
+        match = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            status = 206
+
+        length = max(0, end - start + 1)
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if self.command == 'HEAD':
+            return self.upstream.record('videoplayback_head')
+
+        view = memoryview(self.upstream.payload)[start:start + length]
+        try:
+            for offset in range(0, length, 64 * 1024):
+                self.wfile.write(view[offset:offset + 64 * 1024])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.upstream.record('videoplayback', length)
+
+
+def install_redirects(base_url):
+    """Send yt-dlp and requests traffic for youtube.com to the fake server
+
+    Returns a function undoing the patches.
+    """
+    import requests
+    import yt_dlp
+    from yt_dlp.networking import Request
+
+    original_urlopen = yt_dlp.YoutubeDL.urlopen
+    original_request = requests.Session.request
+
+    def urlopen(self, req):
+        if isinstance(req, str):
+            req = Request(req)
+        req.url = YOUTUBE_URL_RE.sub(base_url, req.url)
+        return original_urlopen(self, req)
+
+    def request(self, method, url, *args, **kwargs):
+        return original_request(self, method, YOUTUBE_URL_RE.sub(base_url, url), *args, **kwargs)
+
+    yt_dlp.YoutubeDL.urlopen = urlopen
+    requests.Session.request = request
+
+    def undo():
+        yt_dlp.YoutubeDL.urlopen = original_urlopen
+        requests.Session.request = original_request
+    return undo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to each response")
+    parser.add_argument('--stream-size', type=int, default=2 * 1024 * 1024)
+    args = parser.parse_args()
+
+    upstream = FakeYouTube(args.host, args.port, args.latency, args.stream_size)
+    print(f"Fake upstream listening on {upstream.base_url}")
+    try:
+        upstream.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
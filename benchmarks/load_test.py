@@ -0,0 +1,280 @@
+"""Offline load test for the Flask app against a fake YouTube upstream.
+
+Starts benchmarks/fake_upstream.py, points yt-dlp and requests at it, serves
+the unmodified app with werkzeug's threaded server on a free port and drives
+its endpoints at the given concurrency. For every scenario it reports
+throughput, p50/p95/p99 latency, status codes, bytes received, resident
+memory and the upstream calls the scenario caused.
+
+Results are written as JSON; pass a previous result with --baseline to
+compare p95 latency and throughput against it (exit status 1 on regression).
+
+Usage:
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --concurrency 16 --requests 400 --output results.json
+    python benchmarks/load_test.py --scenarios watch,video_info --baseline results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_upstream import FakeYouTube, install_redirects  # noqa: E402
+
+SCENARIOS = ('video_info', 'watch', 'download_file', 'download_audio', 'process_download', 'admin')
+
+
+def video_ids(count):
+    """Deterministic pool of distinct 11 character video IDs"""
+    return [f"bench{index:06d}"[:11] for index in range(count)]
+
+
+def build_request(scenario, video_id):
+    """(method, path, form data) for one request of a scenario"""
+    if scenario == 'video_info':
+        return 'GET', f"/video_info?url=https://youtu.be/{video_id}", None
+    if scenario == 'watch':
+        return 'GET', f"/watch?v={video_id}", None
+    if scenario == 'download_file':
+        return 'GET', f"/download-file?v={video_id}&format=18&type=video", None
+    if scenario == 'download_audio':
+        return 'GET', f"/download-file?v={video_id}&format=140&type=audio", None
+    if scenario == 'process_download':
+        return ('GET', f"/process-download?url=https://www.youtube.com/watch?v={video_id}"
+                       f"&filename=bench.mp4", None)
+    if scenario == 'admin':
+        return 'GET', '/admin', None
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_scenario(base_url, scenario, total, concurrency, clients, ids, upstream):
+    """Send total requests of one scenario and summarise them"""
+    import requests
+
+    local = threading.local()
+    latencies, statuses, errors = [], {}, []
+    received = [0]
+    lock = threading.Lock()
+
+    def one(index):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        method, path, data = build_request(scenario, ids[index % len(ids)])
+        # Each simulated client gets its own /24 so admission control sees distinct clients
+        headers = {'X-Forwarded-For': f"10.{index % clients // 256}.{index % clients % 256}.7"}
+        if path.startswith('/admin'):
+            headers['Authorization'] = f"Bearer {os.environ['ADMIN_TOKEN']}"
+
+        started = time.perf_counter()
+        try:
+            response = session.request(method, base_url + path, data=data, headers=headers,
+                                       allow_redirects=False, stream=True, timeout=120)
+            size = 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                received[0] += size
+        except Exception as e:
+            with lock:
+                errors.append(str(e)[:200])
+
+    upstream_before = upstream.snapshot()
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+    upstream_after = upstream.snapshot()
+
+    latencies.sort()
+    upstream_calls = {
+        endpoint: count - upstream_before['calls'].get(endpoint, 0)
+        for endpoint, count in upstream_after['calls'].items()
+        if count - upstream_before['calls'].get(endpoint, 0)
+    }
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': _ms(percentile(latencies, 0.50)),
+            'p95': _ms(percentile(latencies, 0.95)),
+            'p99': _ms(percentile(latencies, 0.99)),
+            'max': _ms(latencies[-1] if latencies else None),
+            'mean': _ms(sum(latencies) / len(latencies) if latencies else None),
+        },
+        'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'bytes_received': received[0],
+        'rss_bytes': {'before': rss_before, 'after': rss_bytes()},
+        'upstream_calls': upstream_calls,
+        'upstream_bytes': upstream_after['bytes_sent'] - upstream_before['bytes_sent'],
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def compare(results, baseline, tolerance):
+    """Print p95/throughput changes against a baseline; returns regressed scenarios"""
+    regressions = []
+    for scenario, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        p95, old_p95 = current['latency_ms']['p95'], previous['latency_ms']['p95']
+        rps, old_rps = current['throughput_rps'], previous['throughput_rps']
+        line = f"{scenario:18} p95 {old_p95} -> {p95} ms, throughput {old_rps} -> {rps} rps"
+        if (p95 and old_p95 and p95 > old_p95 * (1 + tolerance)) or \
+                (rps and old_rps and rps < old_rps * (1 - tolerance)):
+            line += "  REGRESSION"
+            regressions.append(scenario)
+        print(line)
+    return regressions
+
+
+def prepare_environment(workdir, args):
+    """Environment for the app under test; must be set before importing app"""
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+        'DOWNLOAD_SLOT_DIR': os.path.join(workdir, 'slots'),
+        'EGRESS_DIR': os.path.join(workdir, 'egress'),
+        'GOVERNOR_DIR': os.path.join(workdir, 'governor'),
+        'TRUSTED_PROXIES': '1',
+        'LOG_PROFILE': 'production',
+        'LOG_LEVEL': args.log_level,
+        'UPSTREAM_MAX_RATE': str(args.upstream_rate),
+        'UPSTREAM_BURST': str(max(10, int(args.upstream_rate))),
+        'ADMIN_TOKEN': 'bench-admin-token',
+    })
+    # Development code paths (the production ones need REPL_ID/REPL_OWNER and ffmpeg)
+    for name in ('REPL_ID', 'REPL_OWNER', 'REPLIT_DEPLOYMENT'):
+        os.environ.pop(name, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against a fake YouTube")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=100, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=32, help="distinct simulated client addresses")
+    parser.add_argument('--videos', type=int, default=20, help="distinct video IDs requested")
+    parser.add_argument('--upstream-latency', type=float, default=0.05,
+                        help="seconds the fake upstream waits before each response")
+    parser.add_argument('--stream-size', type=int, default=2 * 1024 * 1024,
+                        help="bytes of each fake media stream")
+    parser.add_argument('--upstream-rate', type=float, default=1000,
+                        help="UPSTREAM_MAX_RATE for the app's governor")
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results', 'load_test.json'))
+    parser.add_argument('--baseline', help="previous result file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed relative p95/throughput regression against the baseline")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+
+    workdir = tempfile.mkdtemp(prefix='ytdl-load-')
+    prepare_environment(workdir, args)
+
+    upstream = FakeYouTube(latency=args.upstream_latency, stream_size=args.stream_size).start()
+    undo_redirects = install_redirects(upstream.base_url)
+
+    # cookie_manager writes cookies.txt to the working directory
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+
+    from werkzeug.serving import make_server
+    import app as app_module
+    from upstream_governor import governor
+    app_module.init_database()
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    results = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'scenarios': {},
+    }
+    try:
+        ids = video_ids(args.videos)
+        for scenario in scenarios:
+            print(f"Running {scenario} ({args.requests} requests, concurrency {args.concurrency})...")
+            summary = run_scenario(base_url, scenario, args.requests, args.concurrency,
+                                   args.clients, ids, upstream)
+            results['scenarios'][scenario] = summary
+            print(f"  {summary['throughput_rps']} rps, p50 {summary['latency_ms']['p50']} ms, "
+                  f"p95 {summary['latency_ms']['p95']} ms, p99 {summary['latency_ms']['p99']} ms, "
+                  f"statuses {summary['status_codes']}, upstream {summary['upstream_calls']}")
+    finally:
+        server.shutdown()
+        upstream.stop()
+        undo_redirects()
+        os.chdir(previous_cwd)
+
+    results['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    results['upstream_governor'] = governor.snapshot()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Proxy throughput benchmark: CPU seconds per GB streamed.
+
+The fake upstream (benchmarks/fake_upstream.py) runs in a child process so
+only the proxying side is measured. Three groups of measurements:
+
+- read strategies   reading an upstream body the ways the proxy could:
+                    iter_content() at 4/8/64 KiB, readinto() a reused
+                    buffer then copied to bytes (WSGI servers only accept
+                    bytes), and segmented_fetch.iter_body() (read1, 1 MiB)
+- endpoints         /download-file and /process-download called through the
+                    WSGI app in process, the body iterated and dropped; this
+                    includes segmented fetching but not the socket write to
+                    the client
+- local file        a finished file written to a pipe with read()/write()
+                    versus os.sendfile(), which gunicorn uses for send_file()
+
+CPU is time.process_time() of this process (all threads), per GB of body.
+
+Usage:
+    python benchmarks/proxy_throughput.py
+    python benchmarks/proxy_throughput.py --size 268435456 --rounds 5 --output proxy.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS)
+
+GB = 1024 ** 3
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_upstream(size):
+    """Fake upstream in a child process; returns (process, base URL)"""
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, 'fake_upstream.py'),
+                                '--port', str(port), '--stream-size', str(size)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Fake upstream did not start")
+
+
+def measure(run, rounds):
+    """Best of rounds: (CPU ms per GB, MB/s); run() returns the bytes it moved"""
+    best = None
+    for _ in range(rounds):
+        cpu, wall = time.process_time(), time.perf_counter()
+        size = run()
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        if not size:
+            raise RuntimeError("Nothing was transferred")
+        result = (cpu * 1000 * GB / size, size / wall / 1e6)
+        if best is None or result[0] < best[0]:
+            best = result
+    return {'cpu_ms_per_gb': round(best[0], 1), 'mb_per_s': round(best[1], 1)}
+
+
+def read_strategies(media_url):
+    import requests
+    from segmented_fetch import iter_body
+    session = requests.Session()
+
+    def readinto_copy(response, size=1024 * 1024):
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        while True:
+            count = response.raw.readinto(view)
+            if not count:
+                return
+            yield bytes(view[:count])
+
+    strategies = {
+        'iter_content_4k': lambda r: r.iter_content(4096),
+        'iter_content_8k': lambda r: r.iter_content(8192),
+        'iter_content_64k': lambda r: r.iter_content(64 * 1024),
+        'readinto_1m_copy': readinto_copy,
+        'iter_body_1m': iter_body,
+    }
+
+    def runner(strategy):
+        def run():
+            response = session.get(media_url, stream=True)
+            try:
+                return sum(len(chunk) for chunk in strategy(response))
+            finally:
+                response.close()
+        return run
+    return {name: runner(strategy) for name, strategy in strategies.items()}
+
+
+def endpoints(base_url):
+    """WSGI calls of the proxying endpoints, bodies dropped"""
+    from load_test import prepare_environment
+    from fake_upstream import install_redirects
+
+    workdir = tempfile.mkdtemp(prefix='ytdl-proxy-')
+    prepare_environment(workdir, argparse.Namespace(log_level='ERROR', upstream_rate=1000))
+    install_redirects(base_url)
+    os.chdir(workdir)
+
+    import app as app_module
+    from werkzeug.test import EnvironBuilder
+    app_module.init_database()
+
+    paths = {
+        'download_file': '/download-file?v=bench000001&format=18&type=video',
+        'process_download': ('/process-download?url=https://www.youtube.com/watch?v=bench000001'
+                             '&filename=bench.mp4'),
+    }
+
+    def runner(path):
+        def run():
+            environ = EnvironBuilder(path=path, headers={'X-Forwarded-For': '10.0.0.7'}).get_environ()
+            statuses = []
+            body = app_module.app(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            try:
+                size = sum(len(chunk) for chunk in body)
+            finally:
+                getattr(body, 'close', lambda: None)()
+            if not statuses[0].startswith('200'):
+                raise RuntimeError(f"{path} answered {statuses[0]}")
+            return size
+        return run
+
+    runners = {name: runner(path) for name, path in paths.items()}
+    # Extraction and cookies happen once, outside the measurement
+    for run in runners.values():
+        run()
+    return runners
+
+
+def local_file(size, chunk_size=1024 * 1024):
+    """Writing a finished file to a pipe drained by cat: read()/write() vs os.sendfile()"""
+    handle, path = tempfile.mkstemp(prefix='ytdl-proxy-')
+    with os.fdopen(handle, 'wb') as f:
+        block = os.urandom(chunk_size)
+        for _ in range(0, size, chunk_size):
+            f.write(block)
+
+    def run(use_sendfile):
+        sink = subprocess.Popen(['cat'], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        out = sink.stdin.fileno()
+        sent = 0
+        with open(path, 'rb', buffering=0) as f:
+            if use_sendfile:
+                while True:
+                    count = os.sendfile(out, f.fileno(), sent, chunk_size)
+                    if not count:
+                        break
+                    sent += count
+            else:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    sent += os.write(out, chunk)
+        sink.stdin.close()
+        sink.wait()
+        return sent
+
+    return {'read_write_1m': lambda: run(False), 'sendfile': lambda: run(True)}, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU per GB of the proxy data path")
+    parser.add_argument('--size', type=int, default=128 * 1024 * 1024, help="bytes per transfer")
+    parser.add_argument('--rounds', type=int, default=3, help="transfers per measurement (best is kept)")
+    parser.add_argument('--output', default=os.path.join(BENCHMARKS, 'results', 'proxy_throughput.json'))
+    args = parser.parse_args()
+
+    upstream, base_url = start_upstream(args.size)
+    previous_cwd = os.getcwd()
+    results = {'size': args.size, 'rounds': args.rounds}
+    local_path = None
+    try:
+        media_url = f"{base_url}/videoplayback?id=bench000001&itag=18"
+        groups = [('read_strategies', read_strategies(media_url)), ('endpoints', endpoints(base_url))]
+        files, local_path = local_file(args.size)
+        groups.append(('local_file', files))
+
+        for group, runners in groups:
+            results[group] = {}
+            for name, run in runners.items():
+                results[group][name] = measure(run, args.rounds)
+                print(f"{group:16} {name:18} {results[group][name]['cpu_ms_per_gb']:8.1f} ms CPU/GB "
+                      f"{results[group][name]['mb_per_s']:8.1f} MB/s")
+    finally:
+        upstream.kill()
+        os.chdir(previous_cwd)
+        if local_path:
+            os.remove(local_path)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Worker startup benchmark: import time and time to first response.
+
+Each run starts a fresh interpreter (like a gunicorn worker on an autoscale
+cold start) that imports the app, initialises the database the way
+gunicorn's on_starting hook does, and serves GET / through the test client.
+Reported per phase (medians over --runs):
+
+- import_ms          `import app`
+- init_db_ms         init_database() (once per deploy, not per worker)
+- first_response_ms  first GET / including start_background_tasks()
+- process_ms         interpreter spawn until the first response is done
+
+It also lists which heavy modules were loaded by the import and, with
+--importtime, the slowest modules reported by `python -X importtime`.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --importtime --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('yt_dlp', 'requests', 'sqlalchemy', 'flask_sqlalchemy')
+
+CHILD = r"""
+import sys, json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.init_database()
+initialised = time.perf_counter()
+client = app.app.test_client()
+status = client.get('/').status_code
+responded = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'init_db_ms': (initialised - imported) * 1000,
+    'first_response_ms': (responded - initialised) * 1000,
+    'status': status,
+    'loaded': {name: name in sys.modules for name in %r},
+}))
+""" % (HEAVY_MODULES,)
+
+
+def child_environment(workdir):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+        'DOWNLOAD_SLOT_DIR': os.path.join(workdir, 'slots'),
+        'LOG_LEVEL': 'WARNING',
+    })
+    return env
+
+
+def run_once(env):
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result['process_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def slowest_imports(env, limit=15):
+    """Modules with the largest cumulative import time"""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+    rows.sort(reverse=True)
+    return [{'module': name.strip(), 'depth': (len(name) - len(name.lstrip())) // 2,
+             'cumulative_ms': round(cumulative / 1000, 1), 'self_ms': round(self_time / 1000, 1)}
+            for cumulative, self_time, name in rows[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker startup benchmark")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', action='store_true',
+                        help="also report the slowest imports (python -X importtime)")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='ytdl-startup-') as workdir:
+        env = child_environment(workdir)
+        for index in range(args.runs):
+            runs.append(run_once(env))
+            print(f"run {index + 1}: import {runs[-1]['import_ms']:.0f} ms, "
+                  f"first response {runs[-1]['first_response_ms']:.0f} ms, "
+                  f"process {runs[-1]['process_ms']:.0f} ms")
+        imports = slowest_imports(env) if args.importtime else None
+
+    results = {
+        'runs': args.runs,
+        'median_ms': {
+            phase: round(statistics.median(run[phase] for run in runs), 1)
+            for phase in ('import_ms', 'init_db_ms', 'first_response_ms', 'process_ms')
+        },
+        'loaded_after_first_response': runs[-1]['loaded'],
+        'slowest_imports': imports,
+    }
+
+    print("median: " + ", ".join(f"{phase} {value}" for phase, value in results['median_ms'].items()))
+    print("heavy modules loaded: " + ", ".join(
+        f"{name}={'yes' if loaded else 'no'}" for name, loaded in results['loaded_after_first_response'].items()))
+    if imports:
+        for row in imports:
+            print(f"  {row['cumulative_ms']:8.1f} ms  {'  ' * row['depth']}{row['module']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
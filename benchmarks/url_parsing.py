@@ -0,0 +1,184 @@
+"""Micro-benchmark and regression guard for youtube_link_utils URL parsing.
+
+Checks parse_youtube_url / get_video_id / clean_youtube_url / is_playlist
+against a corpus of realistic URLs (expected results included, also the
+false positives of the old regex based get_video_id), then times them:
+
+- legacy:  the previous three-regex get_video_id
+- cold:    parse_youtube_url with an empty LRU cache (first sight of a URL)
+- warm:    get_video_id with the LRU cache (the common case within a request)
+
+Timings are the best of --repeats rounds, legacy and cold interleaved, so
+their ratio holds up on a noisy machine. Exits with status 1 when a
+correctness case fails, a cold parse takes more than --max-cold-ratio times
+the legacy parser, or a cached lookup is not faster than the legacy parser.
+
+Usage:
+    python benchmarks/url_parsing.py
+    python benchmarks/url_parsing.py --iterations 5000 --max-cold-ratio 2.5 --output results.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_link_utils import (  # noqa: E402
+    parse_youtube_url, get_video_id, clean_youtube_url, is_playlist,
+)
+
+VID = 'dQw4w9WgXcQ'
+WATCH = f"https://www.youtube.com/watch?v={VID}"
+
+# url, expected video_id, playlist_id, timestamp, host_kind
+CORPUS = [
+    (WATCH, VID, None, None, 'youtube'),
+    (f"https://youtube.com/watch?v={VID}", VID, None, None, 'youtube'),
+    (f"youtube.com/watch?v={VID}", VID, None, None, 'youtube'),
+    (f"http://www.youtube.com/watch?v={VID}", VID, None, None, 'youtube'),
+    (f"https://www.youtube.com/watch?feature=share&v={VID}", VID, None, None, 'youtube'),
+    (f"https://www.youtube.com/watch?v={VID}&list=PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI&index=3",
+     VID, 'PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI', None, 'youtube'),
+    (f"https://www.youtube.com/watch?v={VID}&t=1h2m3s", VID, None, 3723, 'youtube'),
+    (f"https://www.youtube.com/watch?v={VID}&t=90", VID, None, 90, 'youtube'),
+    (f"https://www.youtube.com/watch?v={VID}&si=AbCdEfGh123&utm_source=twitter&pp=ygUFaGVsbG8%3D",
+     VID, None, None, 'youtube'),
+    (f"https://youtu.be/{VID}", VID, None, None, 'short_link'),
+    (f"https://youtu.be/{VID}?si=Zx1y2W3v4U5t6S7r", VID, None, None, 'short_link'),
+    (f"https://youtu.be/{VID}?t=42", VID, None, 42, 'short_link'),
+    (f"youtu.be/{VID}", VID, None, None, 'short_link'),
+    (f"https://www.youtube.com/shorts/{VID}", VID, None, None, 'youtube'),
+    (f"https://youtube.com/shorts/{VID}?feature=share", VID, None, None, 'youtube'),
+    (f"https://www.youtube.com/embed/{VID}?start=30&autoplay=1", VID, None, 30, 'youtube'),
+    (f"https://www.youtube-nocookie.com/embed/{VID}", VID, None, None, 'nocookie'),
+    (f"https://www.youtube.com/v/{VID}", VID, None, None, 'youtube'),
+    (f"https://www.youtube.com/live/{VID}?si=abc", VID, None, None, 'youtube'),
+    (f"https://m.youtube.com/watch?v={VID}&feature=youtu.be", VID, None, None, 'mobile'),
+    (f"https://music.youtube.com/watch?v={VID}&list=RDAMVM{VID}", VID, f"RDAMVM{VID}", None, 'music'),
+    (f"  {WATCH}  ", VID, None, None, 'youtube'),
+    (f"https://www.youtube.com:443/watch?v={VID}", VID, None, None, 'youtube'),
+    ("https://www.youtube.com/playlist?list=PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI",
+     None, 'PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI', None, 'youtube'),
+    # The old patterns matched any 11 ID characters after a slash or "v="
+    ("https://rr3---sn-4g5e6nsz.googlevideo.com/videoplayback?expire=1700000000&itag=18",
+     None, None, None, None),
+    ("https://example.com/abcdefghijk/page", None, None, None, None),
+    ("https://example.com/article?v=dQw4w9WgXcQ", None, None, None, None),
+    ("https://www.youtube.com/channel/UCuAXFkgsw1L7xaCfnd5JJOw", None, None, None, 'youtube'),
+    ("https://www.youtube.com/@SomeChannel/videos", None, None, None, 'youtube'),
+    ("https://www.youtube.com/results?search_query=playlist+music", None, None, None, 'youtube'),
+    ("https://www.youtube.com/watch?v=tooshort", None, None, None, 'youtube'),
+    (f"https://www.youtube.com/watch?v={VID}extra", None, None, None, 'youtube'),
+    (f"https://notyoutube.com/watch?v={VID}", None, None, None, None),
+    ("not a url at all", None, None, None, None),
+    ("", None, None, None, None),
+    ("http://[broken", None, None, None, None),
+]
+
+LEGACY_PATTERNS = [
+    r'(?:v=|\/)([0-9A-Za-z_-]{11}).*',
+    r'(?:embed\/|v\/|youtu.be\/)([0-9A-Za-z_-]{11})',
+    r'(?:watch\?v=)([0-9A-Za-z_-]{11})'
+]
+
+
+def legacy_get_video_id(url):
+    """get_video_id as it was before parse_youtube_url"""
+    for pattern in LEGACY_PATTERNS:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+
+def check_corpus():
+    """Return a list of failure descriptions (empty when all cases pass)"""
+    failures = []
+    for url, video_id, playlist_id, timestamp, host_kind in CORPUS:
+        parsed = parse_youtube_url(url)
+        expected = (video_id, playlist_id, timestamp, host_kind)
+        if tuple(parsed) != expected:
+            failures.append(f"parse_youtube_url({url!r}) = {tuple(parsed)}, expected {expected}")
+        if get_video_id(url) != video_id:
+            failures.append(f"get_video_id({url!r}) = {get_video_id(url)!r}, expected {video_id!r}")
+        if is_playlist(url) != (playlist_id is not None):
+            failures.append(f"is_playlist({url!r}) = {is_playlist(url)}")
+        cleaned = clean_youtube_url(url)
+        expected_clean = f"https://www.youtube.com/watch?v={video_id}" if video_id else url
+        if cleaned != expected_clean:
+            failures.append(f"clean_youtube_url({url!r}) = {cleaned!r}, expected {expected_clean!r}")
+    return failures
+
+
+def time_per_call(func, urls, iterations, before_pass=None):
+    """Mean microseconds per call over iterations passes of urls"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if before_pass:
+            before_pass()
+        for url in urls:
+            func(url)
+    return (time.perf_counter() - started) / (iterations * len(urls)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="URL parsing micro-benchmark")
+    parser.add_argument('--iterations', type=int, default=1000, help="passes over the corpus per round")
+    parser.add_argument('--repeats', type=int, default=7, help="rounds, the best one counts")
+    parser.add_argument('--max-cold-ratio', type=float, default=3.0,
+                        help="fail if a cold parse takes longer than this many legacy parses")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    failures = check_corpus()
+    for failure in failures:
+        print(f"FAIL {failure}")
+
+    urls = [case[0] for case in CORPUS if case[0]]
+    timings = {'legacy': [], 'cold': [], 'warm': []}
+    for _ in range(args.repeats):
+        timings['legacy'].append(time_per_call(legacy_get_video_id, urls, args.iterations))
+        timings['cold'].append(time_per_call(parse_youtube_url, urls, args.iterations,
+                                             before_pass=parse_youtube_url.cache_clear))
+        timings['warm'].append(time_per_call(get_video_id, urls, args.iterations))
+    best = {name: min(values) for name, values in timings.items()}
+
+    results = {
+        'corpus_size': len(CORPUS),
+        'correctness_failures': len(failures),
+        'legacy_us': round(best['legacy'], 3),
+        'cold_us': round(best['cold'], 3),
+        'warm_us': round(best['warm'], 3),
+        'cold_ratio': round(best['cold'] / best['legacy'], 2),
+        'max_cold_ratio': args.max_cold_ratio,
+    }
+    # The legacy parser's answers on the same corpus, for the record
+    results['legacy_false_positives'] = sum(
+        1 for url, video_id, *_ in CORPUS if url and video_id is None and legacy_get_video_id(url)
+    )
+
+    print(f"legacy get_video_id:  {results['legacy_us']:.2f} us/url "
+          f"({results['legacy_false_positives']} false positives in corpus)")
+    print(f"parse (cold cache):   {results['cold_us']:.2f} us/url ({results['cold_ratio']:.2f}x legacy)")
+    print(f"get_video_id (cached): {results['warm_us']:.2f} us/url")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if failures:
+        print(f"{len(failures)} correctness failures")
+        sys.exit(1)
+    if results['cold_ratio'] > args.max_cold_ratio:
+        print(f"Cold parse slower than {args.max_cold_ratio}x the legacy parser")
+        sys.exit(1)
+    if best['warm'] >= best['legacy']:
+        print("Cached lookup not faster than the legacy parser")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
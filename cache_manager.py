@@ -3,57 +3,125 @@ import logging
 import threading
 from collections import OrderedDict
 
+from metrics import metrics
+
 logger = logging.getLogger(__name__)
 
 class CacheManager:
-    """Cache manager for storing video information to reduce API calls"""
+    """Cache manager for storing video information to reduce API calls
+
+    An in-memory LRU per worker process. Video info is also kept in the
+    video catalog (models.Video), which fetch_video_info reads on a miss
+    and warm_up() loads from.
+
+    expiry_time is the hard TTL. With a soft_ttl, entries older than it are
+    still returned but get refreshed in the background (stale-while-revalidate).
+    """
     
-    def __init__(self, max_size=100, expiry_time=3600):  # Default 1 hour expiry
+    def __init__(self, max_size=100, expiry_time=3600, soft_ttl=None, name='info'):  # Default 1 hour expiry
         """Initialize the cache with maximum size and expiry time"""
+        self.name = name  # Used to label metrics
         self.cache = OrderedDict()  # Use OrderedDict for LRU functionality
         self.max_size = max_size
         self.expiry_time = expiry_time
+        self.soft_ttl = soft_ttl if soft_ttl is not None else expiry_time
+        self.refreshing = set()  # Keys with a background refresh in flight
         self.lock = threading.Lock()
-        
-        # Start a cleanup thread
-        self.cleanup_thread = threading.Thread(target=self._cleanup_expired, daemon=True)
-        self.cleanup_thread.start()
+        self.cleanup_thread = None
+
+    def start(self):
+        """Start the cleanup thread (call once per worker process, after fork)"""
+        if self.cleanup_thread is None or not self.cleanup_thread.is_alive():
+            self.cleanup_thread = threading.Thread(target=self._cleanup_expired, daemon=True)
+            self.cleanup_thread.start()
     
-    def add_to_cache(self, key, value):
-        """Add an item to the cache with the current timestamp"""
+    def add_to_cache(self, key, value, stored_at=None):
+        """Add an item to the cache
+
+        stored_at is when the value was produced, now by default; values
+        copied from another store keep their age, as both TTLs count from it.
+        """
+        stored_at = stored_at or time.time()
         with self.lock:
             # Remove oldest item if cache is full
-            if len(self.cache) >= self.max_size:
+            if key not in self.cache and len(self.cache) >= self.max_size:
                 self.cache.popitem(last=False)
+                metrics.inc('cache_evictions_total', cache=self.name)
             
             # Add new item with timestamp
             self.cache[key] = {
                 'value': value,
-                'timestamp': time.time()
+                'stored_at': stored_at
             }
-            logger.debug(f"Added item to cache: {key}")
+            self.cache.move_to_end(key)
+            logger.debug("Added item to cache: %s", key)
     
-    def get_cache(self, key):
-        """Get an item from cache if it exists and is not expired"""
+    def get_cache(self, key, refresh=None):
+        """Get an item from cache if it exists and is not expired
+
+        If refresh is given and the item is past the soft TTL, the stale value
+        is returned and refresh() is run in a background thread (at most one
+        per key) to replace it.
+        """
         with self.lock:
             if key in self.cache:
                 cache_item = self.cache[key]
                 current_time = time.time()
                 
                 # Check if item is expired
-                if current_time - cache_item['timestamp'] > self.expiry_time:
+                if current_time - cache_item['stored_at'] > self.expiry_time:
                     # Remove expired item
                     self.cache.pop(key)
-                    logger.debug(f"Cache item expired: {key}")
-                    return None
-                
-                # Move item to the end (most recently used)
-                self.cache.move_to_end(key)
-                logger.debug(f"Cache hit: {key}")
-                return cache_item['value']
-            
-            logger.debug(f"Cache miss: {key}")
-            return None
+                    logger.debug("Cache item expired: %s", key)
+                else:
+                    # Move item to the end (most recently used)
+                    self.cache.move_to_end(key)
+                    logger.debug("Cache hit: %s", key)
+                    metrics.inc('cache_requests_total', cache=self.name, tier='l1', result='hit')
+                    if refresh is not None:
+                        self._maybe_refresh(key, cache_item['stored_at'], refresh)
+                    return cache_item['value']
+
+        logger.debug("Cache miss: %s", key)
+        metrics.inc('cache_requests_total', cache=self.name, tier='l1', result='miss')
+        return None
+
+    def refresh_if_stale(self, key, stored_at, refresh):
+        """Start a background refresh of a value found elsewhere if it is past the soft TTL"""
+        with self.lock:
+            self._maybe_refresh(key, stored_at, refresh)
+
+    def _maybe_refresh(self, key, stored_at, refresh):
+        """Start a background refresh for a stale key (caller holds the lock)"""
+        if time.time() - stored_at <= self.soft_ttl or key in self.refreshing:
+            return
+
+        self.refreshing.add(key)
+        thread = threading.Thread(target=self._run_refresh, args=(key, refresh), daemon=True)
+        thread.start()
+        logger.debug("Stale cache item, refreshing in background: %s", key)
+
+    def _run_refresh(self, key, refresh):
+        """Run a refresh callable and store its result"""
+        try:
+            value = refresh()
+            if value is not None:
+                self.add_to_cache(key, value)
+        except Exception as e:
+            logger.warning("Background refresh failed for %s: %s", key, e)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def warm_up(self, entries):
+        """Preload (key, value, stored_at) entries, most important first, into memory"""
+        entries = list(entries)[:self.max_size]
+        # Insert least important first so the first entries end up most recently used
+        for key, value, stored_at in reversed(entries):
+            self.add_to_cache(key, value, stored_at)
+
+        logger.info("Warmed up cache with %s entries", len(entries))
+        return len(entries)
     
     def clear_cache(self):
         """Clear all items from cache"""
@@ -66,7 +134,7 @@ class CacheManager:
         with self.lock:
             if key in self.cache:
                 self.cache.pop(key)
-                logger.debug(f"Removed item from cache: {key}")
+                logger.debug("Removed item from cache: %s", key)
                 return True
             return False
     
@@ -81,7 +149,7 @@ class CacheManager:
                 keys_to_remove = []
                 
                 for key, cache_item in self.cache.items():
-                    if current_time - cache_item['timestamp'] > self.expiry_time:
+                    if current_time - cache_item['stored_at'] > self.expiry_time:
                         keys_to_remove.append(key)
                 
                 # Remove expired items
@@ -89,4 +157,62 @@ class CacheManager:
                     self.cache.pop(key)
                 
                 if keys_to_remove:
-                    logger.debug(f"Cleanup: removed {len(keys_to_remove)} expired cache items")
+                    logger.debug("Cleanup: removed %s expired cache items", len(keys_to_remove))
+
+class NegativeCache:
+    """Cache of classified failures (e.g. removed or restricted videos)
+
+    Each failure class has its own TTL so that permanent failures are
+    remembered for long and transient ones (rate limiting) only briefly.
+    """
+
+    DEFAULT_TTLS = {
+        'restricted': 6 * 3600,
+        'removed': 24 * 3600,
+        'geo_blocked': 6 * 3600,
+        'rate_limited': 60,
+    }
+
+    def __init__(self, ttls=None, max_size=1000):
+        """Initialize the cache with per-class TTLs (seconds) and a maximum size"""
+        self.cache = OrderedDict()
+        self.ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def add(self, key, reason, message):
+        """Remember that key failed for the given reason"""
+        ttl = self.ttls.get(reason)
+        if not ttl:
+            return
+
+        with self.lock:
+            if key not in self.cache and len(self.cache) >= self.max_size:
+                self.cache.popitem(last=False)
+                metrics.inc('cache_evictions_total', cache='negative')
+            self.cache[key] = {
+                'reason': reason,
+                'message': message,
+                'expires': time.time() + ttl
+            }
+            self.cache.move_to_end(key)
+            logger.debug("Negative cache add: %s (%s)", key, reason)
+
+    def get(self, key):
+        """Return (reason, message) for a remembered failure, or None"""
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and time.time() > entry['expires']:
+                self.cache.pop(key)
+                entry = None
+            if not entry:
+                metrics.inc('cache_requests_total', cache='negative', tier='l1', result='miss')
+                return None
+            logger.debug("Negative cache hit: %s (%s)", key, entry['reason'])
+            metrics.inc('cache_requests_total', cache='negative', tier='l1', result='hit')
+            return entry['reason'], entry['message']
+
+    def remove(self, key):
+        """Forget a remembered failure"""
+        with self.lock:
+            return self.cache.pop(key, None) is not None
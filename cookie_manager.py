@@ -2,12 +2,18 @@
 import os
 import time
 import logging
-import requests
 import random
 import string
 import json
+import fcntl
+import threading
 from datetime import datetime, timedelta
 
+from upstream_governor import governor, UpstreamUnavailableError
+from http_client import new_session
+from metrics import metrics
+from tracing import span
+
 logger = logging.getLogger(__name__)
 COOKIE_FILE = 'cookies.txt'
 
@@ -43,7 +49,8 @@ def get_youtube_cookies_with_user_agent():
     # Try different user agents to get a variety of cookies
     for user_agent in user_agents:
         try:
-            session = requests.Session()
+            # Own cookie jar per user agent, pooled connections shared with the rest of the app
+            session = new_session()
             headers = {
                 'User-Agent': user_agent,
                 'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
@@ -62,28 +69,31 @@ def get_youtube_cookies_with_user_agent():
             
             # Visit multiple YouTube pages to gather more cookies
             for i, url in enumerate(youtube_urls):
-                logger.info(f"Fetching {url} with User-Agent: {user_agent[:20]}...")
+                logger.info("Fetching %s with User-Agent: %s...", url, user_agent[:20])
                 
                 # Add referrer for subsequent requests to appear more natural
                 if i > 0:
                     headers['Referer'] = youtube_urls[i-1]
                 
-                response = session.get(url, headers=headers, timeout=10)
+                response = governor.fetch(session.get, url, headers=headers, timeout=10)
                 
                 if response.status_code == 200:
                     # Add cookies from this request to our collection
                     for cookie in session.cookies:
                         if cookie.name not in all_cookies:
                             all_cookies[cookie.name] = cookie
-                    logger.info(f"Got {len(session.cookies)} cookies from YouTube request to {url}")
+                    logger.info("Got %s cookies from YouTube request to %s", len(session.cookies), url)
                     
                     # Briefly sleep between requests to avoid triggering rate limits
                     if i < len(youtube_urls) - 1:
                         time.sleep(0.5)
+        except UpstreamUnavailableError:
+            logger.warning("YouTube is throttling us, stopping cookie collection early")
+            break
         except Exception as e:
-            logger.warning(f"Error getting cookies with user agent {user_agent[:20]}: {e}")
+            logger.warning("Error getting cookies with user agent %s: %s", user_agent[:20], e)
     
-    logger.info(f"Collected {len(all_cookies)} unique cookies from YouTube")
+    logger.info("Collected %s unique cookies from YouTube", len(all_cookies))
     return all_cookies
 
 def create_netscape_cookies_file():
@@ -144,20 +154,24 @@ def create_netscape_cookies_file():
             line = f"{domain}\tTRUE\t{cookie.path}\t{'TRUE' if cookie.secure else 'FALSE'}\t{expires}\t{cookie.name}\t{cookie.value}"
             lines.append(line)
     
-    # Write file
+    # Write file (atomically, other workers may be reading it)
     content = "\n".join(lines)
-    with open(COOKIE_FILE, 'w') as f:
+    tmp_path = f"{COOKIE_FILE}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
         f.write(content)
+    os.replace(tmp_path, COOKIE_FILE)
     
-    logger.info(f"Created cookies file with {len(lines) - 4} cookies")
+    logger.info("Created cookies file with %s cookies", len(lines) - 4)
     return True
 
+@metrics.timed('cookie_refresh_seconds', step='refresh')
+@span('cookies.refresh')
 def refresh_cookies():
     """Create an improved YouTube cookies file"""
     try:
         return create_netscape_cookies_file()
     except Exception as e:
-        logger.error(f"Error creating cookies: {str(e)}")
+        logger.error("Error creating cookies: %s", e)
         # If everything fails, create a basic cookies file
         try:
             with open(COOKIE_FILE, 'w') as f:
@@ -171,23 +185,103 @@ def refresh_cookies():
             logger.error("Failed to create even basic cookies file")
             return False
 
+# Guards against several threads refreshing cookies at the same time
+_refresh_lock = threading.Lock()
+
+def refresh_cookies_async():
+    """Refresh cookies in a background thread unless a refresh is already running"""
+    if not _refresh_lock.acquire(blocking=False):
+        logger.info("Cookie refresh already in progress")
+        return False
+
+    def run():
+        try:
+            refresh_cookies()
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+# Cookies older than this are refreshed before use
+COOKIE_MAX_AGE = 1800
+
+_refresher_thread = None
+
+def start_cookie_refresher(interval=60, refresh_ahead=300):
+    """Keep the cookie file fresh from a background thread
+
+    Cookies are refreshed refresh_ahead seconds before they reach
+    COOKIE_MAX_AGE, so requests rarely pay for a refresh inline. Every
+    worker runs a refresher, but a lock file makes sure only one of them
+    refreshes at a time.
+    """
+    global _refresher_thread
+    if _refresher_thread is not None and _refresher_thread.is_alive():
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                if os.path.exists(COOKIE_FILE) and \
+                        os.path.getmtime(COOKIE_FILE) > time.time() - (COOKIE_MAX_AGE - refresh_ahead):
+                    continue
+                with open(f"{COOKIE_FILE}.lock", 'w') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # Another worker is refreshing
+                    # Re-check, another worker may have just finished a refresh
+                    if not os.path.exists(COOKIE_FILE) or \
+                            os.path.getmtime(COOKIE_FILE) <= time.time() - (COOKIE_MAX_AGE - refresh_ahead):
+                        logger.info("Refreshing cookies in the background")
+                        refresh_cookies()
+            except Exception as e:
+                logger.warning("Background cookie refresh failed: %s", e)
+
+    _refresher_thread = threading.Thread(target=run, daemon=True)
+    _refresher_thread.start()
+
+def _cookies_stale():
+    """Whether the cookie file is missing or older than COOKIE_MAX_AGE"""
+    return not os.path.exists(COOKIE_FILE) or \
+        os.path.getmtime(COOKIE_FILE) < (time.time() - COOKIE_MAX_AGE)
+
+def _refresh_stale_cookies():
+    """Refresh stale cookies, one refresh at a time per node
+
+    Callers arriving while a refresh is running (inline, from
+    refresh_cookies_async or in another worker) wait for it and use its
+    cookies instead of starting another one.
+    """
+    with _refresh_lock:
+        if not _cookies_stale():
+            return True
+        with open(f"{COOKIE_FILE}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not _cookies_stale():
+                return True
+            logger.info("Creating or refreshing cookie file")
+            return refresh_cookies()
+
+@metrics.timed('cookie_refresh_seconds', step='ensure_fresh')
+@span('cookies.ensure_fresh')
 def ensure_fresh_cookies():
     """Ensure cookies exist and are fresh (< 30 minutes old)"""
     try:
-        # Check if cookie file exists and is less than 30 minutes old (reduced from 2 hours)
-        # This helps avoid YouTube's bot detection by refreshing cookies more frequently
-        if not os.path.exists(COOKIE_FILE) or \
-           os.path.getmtime(COOKIE_FILE) < (time.time() - 1800):
-            logger.info("Creating or refreshing cookie file")
-            return refresh_cookies()
+        # Refreshing cookies often helps avoid YouTube's bot detection
+        if _cookies_stale():
+            return _refresh_stale_cookies()
         logger.info("Using existing cookie file")
         return True
     except Exception as e:
-        logger.error(f"Error checking cookies: {str(e)}")
+        logger.error("Error checking cookies: %s", e)
         # If there's any error, try to refresh cookies anyway
         try:
             logger.info("Attempting to refresh cookies due to previous error")
-            return refresh_cookies()
+            with _refresh_lock:
+                return refresh_cookies()
         except:
             logger.error("Failed to refresh cookies after error")
             return False
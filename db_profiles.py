@@ -0,0 +1,165 @@
+import os
+import logging
+import threading
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Default SQLite fallback used when DATABASE_URL is not set
+SQLITE_FALLBACK_URL = "sqlite:///youtube_downloader.db"
+
+# Set by begin_write(): the next SQLite transaction on this thread takes the write lock
+_write_intent = threading.local()
+
+
+def _env_int(name, default):
+    """Read an integer setting from the environment, falling back to a default"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        logger.warning("Invalid value for %s, using default %s", name, default)
+        return default
+
+
+def normalize_database_url(database_url):
+    """Return a SQLAlchemy compatible database URL (or the SQLite fallback)"""
+    if database_url and database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+
+    if not database_url:
+        logger.warning("DATABASE_URL not found, using SQLite as fallback")
+        database_url = SQLITE_FALLBACK_URL
+
+    return database_url
+
+
+def get_backend(database_url):
+    """Return the backend name ('sqlite', 'postgresql', ...) for a database URL"""
+    scheme = database_url.split(':', 1)[0]
+    return scheme.split('+', 1)[0]
+
+
+def sqlite_engine_options():
+    """Engine options for the SQLite fallback.
+
+    One connection per request thread, so WAL readers never wait for each
+    other; writers, within and across gunicorn workers, are serialised by
+    SQLite itself via BEGIN IMMEDIATE and busy_timeout (see begin_write).
+    """
+    busy_timeout = _env_int('SQLITE_BUSY_TIMEOUT', 15)
+    return {
+        "pool_size": _env_int('SQLITE_POOL_SIZE', _env_int('GUNICORN_THREADS', 8)),
+        "max_overflow": 0,
+        "pool_timeout": busy_timeout,
+        "pool_pre_ping": False,
+        "connect_args": {
+            "timeout": busy_timeout,
+            "check_same_thread": False,
+        },
+    }
+
+
+def postgresql_engine_options(database_url):
+    """Engine options for PostgreSQL with an explicit pool and statement timeout"""
+    statement_timeout_ms = _env_int('DB_STATEMENT_TIMEOUT_MS', 5000)
+    options = {
+        "pool_size": _env_int('DB_POOL_SIZE', 5),
+        "max_overflow": _env_int('DB_MAX_OVERFLOW', 5),
+        "pool_timeout": _env_int('DB_POOL_TIMEOUT', 10),
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+        # Size of SQLAlchemy's compiled statement cache
+        "query_cache_size": _env_int('DB_QUERY_CACHE_SIZE', 500),
+        "connect_args": {
+            "connect_timeout": _env_int('DB_CONNECT_TIMEOUT', 5),
+            "options": f"-c statement_timeout={statement_timeout_ms}",
+        },
+    }
+
+    # psycopg (v3) can use server-side prepared statements; psycopg2 has no
+    # equivalent, so there we rely on SQLAlchemy's compiled cache only
+    if database_url.startswith("postgresql+psycopg:"):
+        options["connect_args"]["prepare_threshold"] = _env_int('DB_PREPARE_THRESHOLD', 5)
+
+    return options
+
+
+def get_engine_options(database_url):
+    """Select the engine profile for the given database URL"""
+    backend = get_backend(database_url)
+    if backend == 'sqlite':
+        return sqlite_engine_options()
+    if backend == 'postgresql':
+        return postgresql_engine_options(database_url)
+
+    logger.warning("No tuned engine profile for backend '%s', using defaults", backend)
+    return {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+
+
+def begin_write(session):
+    """Declare that the session's next transaction writes: on SQLite it begins with BEGIN IMMEDIATE
+
+    Call before the reads of a read-then-write transaction. A read-only
+    transaction the session already has open is ended first, since WAL
+    can't upgrade it to a writer once another writer has committed. One
+    with pending changes is kept, and no BEGIN follows, so nothing is
+    declared.
+    """
+    if hasattr(session, 'registry'):
+        session = session()  # scoped_session (Flask-SQLAlchemy's db.session)
+    if session.get_bind().dialect.name != 'sqlite':
+        return
+    if session.in_transaction():
+        if session.new or session.dirty or session.deleted:
+            return
+        session.rollback()
+    _write_intent.pending = True
+
+
+def _install_sqlite_pragmas(engine):
+    """Enable WAL; write transactions take the write lock up front (see begin_write)"""
+    busy_timeout_ms = _env_int('SQLITE_BUSY_TIMEOUT', 15) * 1000
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself instead of pysqlite
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        # Writes are short read-then-write (e.g. Statistics counters); taking
+        # the write lock at BEGIN makes competing writers wait on busy_timeout
+        # instead of failing on a lock upgrade. Reads stay deferred so they
+        # run concurrently with a writer under WAL.
+        if getattr(_write_intent, 'pending', False):
+            _write_intent.pending = False
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        else:
+            connection.exec_driver_sql("BEGIN")
+
+    @event.listens_for(engine, "commit")
+    @event.listens_for(engine, "rollback")
+    def end(connection):
+        # A declared write intent applies to the next BEGIN only; never let
+        # it outlive the transaction that was open when it was declared
+        _write_intent.pending = False
+
+
+def configure_engine(app, db):
+    """Attach backend specific connection hooks to the app's engine"""
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            _install_sqlite_pragmas(engine)
+            logger.debug("SQLite engine profile applied (WAL, synchronous=NORMAL)")
+        else:
+            logger.debug("Engine profile applied for %s", engine.dialect.name)
@@ -1,16 +1,116 @@
 import os
+import time
 import logging
-import yt_dlp
+import threading
 from cookie_manager import ensure_fresh_cookies
+from cache_manager import CacheManager, NegativeCache
+from format_index import FormatIndex
+from youtube_link_utils import get_video_id
+from upstream_governor import governor, UpstreamUnavailableError
+from metrics import metrics
+from tracing import span
+from log_config import ytdlp_log_options
+from transcoder import transcoder, audio_args
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Error message patterns for each failure class, checked in order
+FAILURE_PATTERNS = [
+    ('rate_limited', ['http error 429', 'too many requests', 'rate limit',
+                      "confirm you're not a bot", 'confirm you\u2019re not a bot']),
+    ('geo_blocked', ['not available in your country', 'blocked it in your country',
+                     'geo restrict', 'geo-restrict']),
+    ('restricted', ['sign in to confirm your age', 'age-restricted', 'private video',
+                    'video is private', 'members-only', 'join this channel']),
+    ('removed', ['video unavailable', 'this video is not available', 'has been removed',
+                 'has been terminated', 'no longer available']),
+]
+
+# User-facing messages for each failure class
+FAILURE_MESSAGES = {
+    'rate_limited': "YouTube rate limit exceeded. Please wait a moment and try again.",
+    'geo_blocked': "This video is not available in our server's region and cannot be downloaded.",
+    'restricted': "This video has restrictions (age, privacy, or requires login) and cannot be downloaded publicly.",
+    'removed': "This video is unavailable or has been removed.",
+}
+
+# Shared across downloader instances (one is created per request)
+negative_cache = NegativeCache()
+
+# Format index per video, so format resolution doesn't re-extract. Entries
+# also expire with the signed URLs they contain (see FormatIndex.expired).
+format_cache = CacheManager(max_size=int(os.environ.get('FORMAT_CACHE_SIZE', 200)),
+                            expiry_time=int(os.environ.get('FORMAT_CACHE_TTL', 1800)),
+                            name='formats')
+
+class VideoUnavailableError(Exception):
+    """Raised when a video failed for a known reason (restricted, removed, ...)"""
+
+    def __init__(self, reason, message=None):
+        super().__init__(message or FAILURE_MESSAGES.get(reason, "This video is unavailable."))
+        self.reason = reason
+
+def classify_error(error):
+    """Return the failure class of an error (looking at chained errors too), or None"""
+    messages = []
+    while error is not None and len(messages) < 5:
+        messages.append(str(error).lower())
+        error = error.__cause__ or error.__context__
+    error_text = ' '.join(messages)
+
+    for reason, patterns in FAILURE_PATTERNS:
+        if any(pattern in error_text for pattern in patterns):
+            return reason
+    return None
+
+# Start times of running post-processors, per thread
+_pp_started = threading.local()
+
+def postprocessor_timing_hook(d):
+    """yt-dlp postprocessor hook recording how long FFmpeg post-processing takes"""
+    name = d.get('postprocessor', 'unknown')
+    if d.get('status') == 'started':
+        setattr(_pp_started, name, time.perf_counter())
+    elif d.get('status') == 'finished':
+        started = getattr(_pp_started, name, None)
+        if started is not None:
+            delattr(_pp_started, name)
+            metrics.observe('ffmpeg_postprocess_seconds', time.perf_counter() - started,
+                            postprocessor=name)
+
+def load_yt_dlp():
+    """Import yt-dlp on first use
+
+    yt-dlp is the heaviest import of the app, and most requests (cached
+    video info, static pages) never need it.
+    """
+    import yt_dlp
+    return yt_dlp
+
+def warm_up_yt_dlp():
+    """Import yt-dlp and compile the URL patterns of all its extractors
+
+    extract_info() tries the extractors in order and each compiles its
+    pattern on first use. Doing it once in the gunicorn master before fork
+    lets the workers share these pages copy-on-write.
+    """
+    load_yt_dlp()
+    from yt_dlp.extractor import gen_extractor_classes
+
+    url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    count = 0
+    for extractor in gen_extractor_classes():
+        try:
+            extractor.suitable(url)
+        except Exception:
+            pass
+        count += 1
+    return count
+
 class YoutubeDownloader:
     def __init__(self):
         self.base_opts = {
-            'quiet': True,
-            'no_warnings': True,
+            **ytdlp_log_options(),
             'extract_flat': True,
             'cookiefile': 'cookies.txt',
             'format_sort': [
@@ -36,28 +136,105 @@ class YoutubeDownloader:
         if os.environ.get('USE_PROXY'):
             self.base_opts['proxy'] = os.environ.get('PROXY_URL')
 
+    def _ydl(self, options):
+        """Create a YoutubeDL instance with the given options"""
+        return load_yt_dlp().YoutubeDL(options)
+
+    def _extract(self, ydl, url, download):
+        """Run extract_info under the upstream governor, timing the call"""
+        with metrics.timed('youtube_extract_seconds', download=download), \
+                span('yt_dlp.extract_info', download=download):
+            return governor.call(ydl.extract_info, url, download=download)
+
+    def _check_negative_cache(self, url):
+        """Fail fast if this video recently failed for a known reason"""
+        video_id = get_video_id(url)
+        entry = negative_cache.get(video_id) if video_id else None
+        if entry:
+            reason, message = entry
+            logger.info("Skipping extraction for %s, cached failure: %s", video_id, reason)
+            raise VideoUnavailableError(reason, message)
+
+    def _cached_index(self, url):
+        """FormatIndex of a recent extraction of this video, or None"""
+        video_id = get_video_id(url)
+        index = format_cache.get_cache(video_id) if video_id else None
+        if index is not None and index.expired():
+            format_cache.remove_from_cache(video_id)
+            return None
+        return index
+
+    def _index_formats(self, url, info):
+        """Build the FormatIndex of an extraction result and cache it"""
+        index = FormatIndex(info.get('formats') or [])
+        video_id = get_video_id(url)
+        if video_id and len(index):
+            format_cache.add_to_cache(video_id, index)
+        return index
+
+    def get_cached_format(self, url, format_id, download_type='video'):
+        """The format get_direct_url resolves to, from the cached format index, or None"""
+        index = self._cached_index(url)
+        return index.resolve(format_id, download_type) if index is not None else None
+
+    def get_cached_streams(self, url, format_id):
+        """(video, audio) formats for a video download, from the cached format index
+
+        audio is None unless the video format must be muxed with it; both
+        are None when there is no cached index.
+        """
+        index = self._cached_index(url)
+        return index.resolve_streams(format_id) if index is not None else (None, None)
+
+    def _convert_to_mp3(self, path, mp3=True):
+        """Convert a downloaded audio file to MP3 in the transcode pool (if mp3)"""
+        if not mp3:
+            return path
+        target = os.path.splitext(path)[0] + '.mp3'
+        job = transcoder.submit(('file', path, 'mp3', '192'), audio_args(path, 'mp3', '192'),
+                                output_path=target)
+        try:
+            job.wait(transcoder.time_limit + 60)
+        finally:
+            transcoder.release(job)
+        os.remove(path)
+        return target
+
+    def _record_failure(self, url, error):
+        """Remember classified failures so repeat requests skip the retries"""
+        if isinstance(error, (VideoUnavailableError, UpstreamUnavailableError)):
+            return
+        video_id = get_video_id(url)
+        reason = classify_error(error)
+        if video_id and reason:
+            negative_cache.add(video_id, reason, FAILURE_MESSAGES[reason])
+
+    @metrics.timed('youtube_downloader_seconds', method='get_video_info')
+    @span('downloader.get_video_info')
     def get_video_info(self, url):
         try:
-            logger.info(f"Getting video info for: {url}")
+            logger.info("Getting video info for: %s", url)
+            self._check_negative_cache(url)
 
             # Always ensure we have fresh cookies for each request
             ensure_fresh_cookies()
 
             # Create a copy of base options with enhanced settings
             opts = self.base_opts.copy()
-            opts['ignoreerrors'] = True
             opts['skip_download'] = True
-            opts['quiet'] = False  # Enable more detailed logging
 
             # Try to get video info with enhanced options and cookies
             try:
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
+                with self._ydl(opts) as ydl:
+                    info = self._extract(ydl, url, download=False)
                     if not info:
                         raise Exception("Could not retrieve video information")
                     logger.info("Successfully retrieved video info using cookies")
+            except UpstreamUnavailableError:
+                # Circuit is open, retrying with other settings would only add load
+                raise
             except Exception as e:
-                logger.warning(f"Failed to get video info with cookies: {str(e)}")
+                logger.warning("Failed to get video info with cookies: %s", e)
                 logger.info("Trying with alternative settings")
 
                 # Check for specific error patterns related to restrictions
@@ -73,14 +250,12 @@ class YoutubeDownloader:
 
                         # Try with alternative settings
                         alt_opts = self.base_opts.copy()
-                        alt_opts['ignoreerrors'] = True
                         alt_opts['skip_download'] = True
-                        alt_opts['quiet'] = False
                         alt_opts['http_headers']['User-Agent'] = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36'
                         alt_opts['http_headers']['Referer'] = 'https://www.youtube.com/feed/trending'
 
-                        with yt_dlp.YoutubeDL(alt_opts) as ydl:
-                            info = ydl.extract_info(url, download=False)
+                        with self._ydl(alt_opts) as ydl:
+                            info = self._extract(ydl, url, download=False)
                             if not info:
                                 raise Exception("Could not retrieve video information")
                             logger.info("Successfully retrieved video info with alternative settings")
@@ -92,8 +267,8 @@ class YoutubeDownloader:
                 else:
                     try:
                         opts.pop('cookiefile', None)
-                        with yt_dlp.YoutubeDL(opts) as ydl:
-                            info = ydl.extract_info(url, download=False)
+                        with self._ydl(opts) as ydl:
+                            info = self._extract(ydl, url, download=False)
                             if not info:
                                 raise Exception("Could not retrieve video information")
                             logger.info("Successfully retrieved video info anonymously")
@@ -111,35 +286,23 @@ class YoutubeDownloader:
 
             # Filter formats to only include standard resolutions
             if 'formats' in info:
-                seen_qualities = set()
-                filtered_formats = []
-
-                # Sort formats by quality (higher resolution first)
-                sorted_formats = sorted(info['formats'],
-                                        key=lambda x: int(x.get('height', 0) or 0),
-                                        reverse=True
-                                        )
-
-                for f in sorted_formats:
-                    format_note = f.get('format_note', '').replace('p60', 'p')
-                    if (format_note in ['1080p', '720p', '480p', '360p', '240p', '144p'] and
-                            not f.get('format_note', '').startswith('storyboard') and
-                            f.get('vcodec', 'none') != 'none' and
-                            format_note not in seen_qualities):
-
-                        filtered_formats.append(f)
-                        seen_qualities.add(format_note)
-
-                info['formats'] = filtered_formats
+                index = self._index_formats(url, info)
+                by_id = {f.get('format_id'): f for f in info['formats']}
+                info['formats'] = [by_id[f['format_id']] for f in index.standard_formats()]
+                info['format_index'] = index.to_dict()
 
             return info
 
         except Exception as e:
-            logger.error(f"Error getting video info: {str(e)}")
+            logger.error("Error getting video info: %s", e)
+            self._record_failure(url, e)
             raise
 
+    @metrics.timed('youtube_downloader_seconds', method='download_video')
+    @span('downloader.download_video')
     def download_video(self, url, output_path, format_id='18'):
         try:
+            self._check_negative_cache(url)
             ensure_fresh_cookies()
 
             options = {
@@ -148,18 +311,32 @@ class YoutubeDownloader:
                 'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s')
             }
 
-            with yt_dlp.YoutubeDL(options) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with self._ydl(options) as ydl:
+                info = self._extract(ydl, url, download=True)
                 downloaded_file = os.path.join(output_path, ydl.prepare_filename(info))
-                logger.info(f"Successfully downloaded video to {downloaded_file}")
+                logger.info("Successfully downloaded video to %s", downloaded_file)
                 return downloaded_file
 
         except Exception as e:
-            logger.error(f"Error downloading video: {str(e)}")
+            logger.error("Error downloading video: %s", e)
+            self._record_failure(url, e)
             raise
 
+    @metrics.timed('youtube_downloader_seconds', method='get_direct_url')
+    @span('downloader.get_direct_url')
     def get_direct_url(self, url, format_id, download_type='video'):
         try:
+            self._check_negative_cache(url)
+
+            # Resolve against the formats of a recent extraction if there is one
+            index = self._cached_index(url)
+            fmt = index.resolve(format_id, download_type) if index is not None else None
+            if fmt is not None:
+                logger.info("Resolved format %s from the format index (%s)", format_id, fmt['format_id'])
+                metrics.inc('format_index_lookups_total', result='hit')
+                return fmt['url']
+            metrics.inc('format_index_lookups_total', result='miss')
+
             ensure_fresh_cookies()
 
             format_string = format_id
@@ -174,34 +351,44 @@ class YoutubeDownloader:
                 'skip_download': True,
             }
 
-            with yt_dlp.YoutubeDL(options) as ydl:
-                info = ydl.extract_info(url, download=False)
+            with self._ydl(options) as ydl:
+                info = self._extract(ydl, url, download=False)
                 if not info:
                     raise Exception("Could not retrieve video information")
 
+                index = self._index_formats(url, info)
                 if 'url' in info:
-                    logger.info(f"Found direct URL in info: {url[:30]}...")
+                    logger.info("Found direct URL in info: %s...", url[:30])
                     return info['url']
-                elif 'formats' in info:
-                    logger.info(f"Available formats: {[f.get('format_id') for f in info['formats']]}")
+                elif len(index):
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Available formats: %s", list(index.by_id))
 
-                    for fmt in info['formats']:
-                        if fmt.get('format_id') == format_id and 'url' in fmt:
-                            logger.info(f"Found exact format match for {format_id}")
-                            return fmt['url']
+                    fmt = index.get(format_id)
+                    if fmt is not None:
+                        logger.info("Found exact format match for %s", format_id)
+                        return fmt['url']
 
-                    logger.warning(f"Format {format_id} not found, using best match")
-                    return info['formats'][-1]['url']
+                    logger.warning("Format %s not found, using best match", format_id)
+                    return (index.resolve(format_id, download_type) or index.formats[-1])['url']
 
                 raise Exception("No suitable format found")
 
         except Exception as e:
-            logger.error(f"Error getting direct URL: {str(e)}")
+            logger.error("Error getting direct URL: %s", e)
+            self._record_failure(url, e)
             raise
 
-    def download_audio(self, url, output_path=None, progress_hook=None, playlist=False):
+    @metrics.timed('youtube_downloader_seconds', method='download_audio')
+    @span('downloader.download_audio')
+    def download_audio(self, url, output_path=None, progress_hook=None, playlist=False, mp3=False):
+        """Download the best audio stream in its native container (m4a/webm)
+
+        With mp3=True it is converted to MP3 in the transcode pool.
+        """
         try:
-            logger.info(f"Starting audio download for URL: {url}")
+            logger.info("Starting audio download for URL: %s", url)
+            self._check_negative_cache(url)
 
             # Always ensure we have fresh cookies for each request
             ensure_fresh_cookies()
@@ -218,30 +405,26 @@ class YoutubeDownloader:
                                 d['progress'] = percent
                                 progress_hook(d)
                     except Exception as e:
-                        logger.error(f"Error calculating progress: {e}")
+                        logger.error("Error calculating progress: %s", e)
                 elif d['status'] == 'finished':
                     if progress_hook:
                         d['progress'] = 100
                         progress_hook(d)
                 elif d['status'] == 'error':
-                    logger.error(f"Download error: {d.get('error')}")
+                    logger.error("Download error: %s", d.get('error'))
                     if progress_hook:
                         progress_hook(d)
 
-            # Enhanced options with better browser simulation for audio
+            # Enhanced options with better browser simulation for audio.
+            # An MP3 conversion runs in the transcode pool, not in yt-dlp.
             options = {
                 'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                }],
                 'progress_hooks': [combined_progress_hook],
                 'outtmpl': '%(title)s.%(ext)s',
-                'verbose': True,
+                **ytdlp_log_options(),
                 'cookiefile': 'cookies.txt',
                 'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'referer': 'https://www.youtube.com/',
-                'ignoreerrors': True
+                'referer': 'https://www.youtube.com/'
             }
 
             if output_path:
@@ -249,18 +432,19 @@ class YoutubeDownloader:
 
             # Try to download with enhanced options and cookies
             try:
-                with yt_dlp.YoutubeDL(options) as ydl:
-                    info = ydl.extract_info(url, download=True)
+                with self._ydl(options) as ydl:
+                    info = self._extract(ydl, url, download=True)
                     if not info:
                         raise Exception("Could not download audio information")
-                    downloaded_file = os.path.join(output_path if output_path else '.', ydl.prepare_filename(info))
-                    # For audio files, the extension might be changed after post-processing
-                    if not os.path.exists(downloaded_file) and downloaded_file.endswith('.webm'):
-                        downloaded_file = downloaded_file.replace('.webm', '.mp3')
-                    logger.info(f"Successfully downloaded audio to {downloaded_file}")
+                    downloaded_file = self._convert_to_mp3(
+                        os.path.join(output_path if output_path else '.', ydl.prepare_filename(info)), mp3)
+                    logger.info("Successfully downloaded audio to %s", downloaded_file)
                     return downloaded_file
+            except UpstreamUnavailableError:
+                # Circuit is open, retrying with other settings would only add load
+                raise
             except Exception as cookie_error:
-                logger.warning(f"Failed to download audio with primary settings: {str(cookie_error)}")
+                logger.warning("Failed to download audio with primary settings: %s", cookie_error)
 
                 # Check for specific error patterns related to restrictions
                 error_str = str(cookie_error).lower()
@@ -278,15 +462,13 @@ class YoutubeDownloader:
                         alt_options['user_agent'] = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36'
                         alt_options['referer'] = 'https://www.youtube.com/feed/trending'
 
-                        with yt_dlp.YoutubeDL(alt_options) as ydl:
-                            info = ydl.extract_info(url, download=True)
+                        with self._ydl(alt_options) as ydl:
+                            info = self._extract(ydl, url, download=True)
                             if not info:
                                 raise Exception("Could not download audio")
-                            downloaded_file = os.path.join(output_path if output_path else '.', ydl.prepare_filename(info))
-                            # Handle potential extension change after audio processing
-                            if not os.path.exists(downloaded_file) and downloaded_file.endswith('.webm'):
-                                downloaded_file = downloaded_file.replace('.webm', '.mp3')
-                            logger.info(f"Successfully downloaded restricted audio with alternative settings to {downloaded_file}")
+                            downloaded_file = self._convert_to_mp3(
+                                os.path.join(output_path if output_path else '.', ydl.prepare_filename(info)), mp3)
+                            logger.info("Successfully downloaded restricted audio with alternative settings to %s", downloaded_file)
                             return downloaded_file
                     except Exception as restricted_error:
                         # Provide a user-friendly error message
@@ -297,15 +479,13 @@ class YoutubeDownloader:
                 # Try one more time without cookies for non-restricted videos
                 try:
                     options.pop('cookiefile', None)
-                    with yt_dlp.YoutubeDL(options) as ydl:
-                        info = ydl.extract_info(url, download=True)
+                    with self._ydl(options) as ydl:
+                        info = self._extract(ydl, url, download=True)
                         if not info:
                             raise Exception("Could not download audio")
-                        downloaded_file = os.path.join(output_path if output_path else '.', ydl.prepare_filename(info))
-                        # Handle potential extension change
-                        if not os.path.exists(downloaded_file) and downloaded_file.endswith('.webm'):
-                            downloaded_file = downloaded_file.replace('.webm', '.mp3')
-                        logger.info(f"Successfully downloaded audio anonymously to {downloaded_file}")
+                        downloaded_file = self._convert_to_mp3(
+                            os.path.join(output_path if output_path else '.', ydl.prepare_filename(info)), mp3)
+                        logger.info("Successfully downloaded audio anonymously to %s", downloaded_file)
                         return downloaded_file
                 except Exception as anonymous_error:
                     # Check for specific error patterns in the second attempt as well
@@ -320,5 +500,6 @@ class YoutubeDownloader:
                         raise Exception(f"Failed to download audio: {str(anonymous_error)}")
 
         except Exception as e:
-            logger.error(f"Error downloading audio: {str(e)}")
+            logger.error("Error downloading audio: %s", e)
+            self._record_failure(url, e)
             raise
\ No newline at end of file
@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Shared by the worker processes of a node: settings.json and one weight file per worker
+EGRESS_DIR = os.environ.get("EGRESS_DIR", os.path.join(tempfile.gettempdir(), "ytdl-egress"))
+
+DEFAULT_SETTINGS = {
+    # Bytes/second for all streams of the node, 0 for no limit
+    'budget': int(os.environ.get("EGRESS_BUDGET", 0)),
+    # Bytes/second for any single stream, 0 for no limit
+    'stream_rate': int(os.environ.get("EGRESS_STREAM_RATE", 0)),
+    # Responses up to this size, and the first bytes of larger ones, are never throttled
+    'small_bytes': int(os.environ.get("EGRESS_SMALL_BYTES", 2 * 1024 * 1024)),
+    # Fair share weight by stream kind (the endpoint), 1 when not listed
+    'weights': {},
+}
+
+# No stream is ever allocated less (bytes/second), so a stream that was idle can restart
+MIN_RATE = 64 * 1024
+
+class EgressStream:
+    """Sending side of one throttled response"""
+
+    def __init__(self, kind, weight):
+        self.kind = kind
+        self.weight = weight
+        self.rate = None          # allocated bytes/second, None for unlimited
+        self.debt = 0.0           # bytes sent ahead of the allocation
+        self.last = time.monotonic()
+        self.started = self.last
+        self.sent = 0
+        self.interval_bytes = 0   # sent since the last allocation
+        self.interval_slept = 0.0 # seconds held back since the last allocation
+        # Decaying sums of bytes and of seconds not held back: their ratio is
+        # the rate the stream manages on its own (client or upstream bound)
+        self.window_bytes = 0.0
+        self.window_seconds = 0.0
+        self.throttled_seconds = 0.0
+
+    def demand(self):
+        """Rate the stream would use if not held back, None if unknown or unbounded"""
+        if self.window_seconds <= 0:
+            return None
+        # Some room to speed up again
+        return 1.25 * self.window_bytes / self.window_seconds
+
+    def _delay(self, size, free_bytes):
+        """Seconds to wait before sending size more bytes"""
+        now = time.monotonic()
+        self.sent += size
+        self.interval_bytes += size
+        if self.rate is None or self.sent <= free_bytes:
+            self.debt, self.last = 0.0, now
+            return 0.0
+        # Debt bucket: what the allocation allowed since the last chunk pays
+        # off the debt; at most half a second of unused allocation is kept
+        self.debt = max(-self.rate / 2, self.debt - (now - self.last) * self.rate) + size
+        self.last = now
+        return max(0.0, self.debt / self.rate)
+
+class EgressScheduler:
+    """Shares the node's outgoing bandwidth between download streams
+
+    - A global budget (bytes/second) for the node, split between worker
+      processes by the total weight of their streams.
+    - Within a process the share is divided by weighted max-min fairness:
+      streams limited by their client get what they use, the rest is split
+      by weight between the streams the scheduler is holding back.
+    - An optional cap per stream.
+    - Small responses and the first small_bytes of every stream are not
+      throttled, so pages, thumbnails and short files stay fast.
+
+    Allocations are recomputed every `interval` seconds by whichever stream
+    sends next; there is no scheduler thread. Settings changed with
+    update() are written to EGRESS_DIR and picked up by every worker.
+    """
+
+    def __init__(self, directory=EGRESS_DIR, interval=0.5):
+        self.directory = directory
+        self.interval = interval
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings_mtime = None
+        self.streams = set()
+        self.allocated_at = 0.0
+        self.node_weight = 0.0
+        self.throughput = 0.0     # bytes/second of this process's streams in the last interval
+        self.lock = threading.Lock()
+
+    @property
+    def settings_path(self):
+        return os.path.join(self.directory, 'settings.json')
+
+    def throttle(self, chunks, kind, length=None):
+        """Yield chunks at the pace the scheduler allows for this stream"""
+        if length is not None and length <= self.settings['small_bytes']:
+            yield from chunks
+            return
+
+        stream = self._open(kind)
+        try:
+            for chunk in chunks:
+                delay = self._pace(stream, len(chunk))
+                while delay > 0:
+                    # Sleep in steps so a new allocation applies quickly
+                    step = min(delay, self.interval)
+                    time.sleep(step)
+                    stream.throttled_seconds += step
+                    stream.interval_slept += step
+                    delay = self._pace(stream, 0)
+                yield chunk
+        finally:
+            self._close(stream)
+
+    def _open(self, kind):
+        stream = EgressStream(kind, float(self.settings['weights'].get(kind, 1)))
+        with self.lock:
+            self.streams.add(stream)
+            self._allocate(force=True)
+        return stream
+
+    def _close(self, stream):
+        with self.lock:
+            self.streams.discard(stream)
+            self._allocate(force=True)
+        elapsed = time.monotonic() - stream.started
+        if stream.sent and elapsed > 0:
+            metrics.observe('egress_stream_bytes_per_second', stream.sent / elapsed, kind=stream.kind)
+        if stream.throttled_seconds:
+            metrics.inc('egress_throttled_seconds_total', stream.throttled_seconds, kind=stream.kind)
+
+    def _pace(self, stream, size):
+        with self.lock:
+            self._allocate()
+            return stream._delay(size, self.settings['small_bytes'])
+
+    def _allocate(self, force=False):
+        """Recompute the rate of every stream (lock held)"""
+        now = time.monotonic()
+        elapsed = now - self.allocated_at
+        if not force and elapsed < self.interval:
+            return
+        self._reload_settings()
+
+        if elapsed >= self.interval:
+            self.throughput = sum(s.interval_bytes for s in self.streams) / elapsed
+            for stream in self.streams:
+                active = min(elapsed, now - stream.started) - stream.interval_slept
+                stream.window_bytes = stream.window_bytes * 0.8 + stream.interval_bytes
+                stream.window_seconds = stream.window_seconds * 0.8 + max(active, 0.0)
+                stream.interval_bytes = 0
+                stream.interval_slept = 0.0
+            self.allocated_at = now
+        demands = {stream: stream.demand() for stream in self.streams}
+
+        cap = self.settings['stream_rate'] or None
+        budget = self.settings['budget'] or None
+        if budget is not None:
+            budget = self._process_share(budget)
+        for stream, rate in allocate(demands, budget, cap).items():
+            stream.rate = max(rate, MIN_RATE) if rate is not None else None
+
+    def _process_share(self, budget):
+        """This process's part of the node budget, by total stream weight"""
+        weight = sum(stream.weight for stream in self.streams)
+        node_weight = weight
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"weight-{os.getpid()}")
+            with open(path, 'w') as f:
+                f.write(str(weight))
+            stale = time.time() - 10 * self.interval - 5
+            for name in os.listdir(self.directory):
+                if not name.startswith('weight-') or name == f"weight-{os.getpid()}":
+                    continue
+                other = os.path.join(self.directory, name)
+                try:
+                    if os.path.getmtime(other) < stale:
+                        # Idle or exited worker
+                        continue
+                    with open(other) as f:
+                        node_weight += float(f.read() or 0)
+                except (OSError, ValueError):
+                    continue
+        except OSError as e:
+            logger.warning("Could not share egress weights: %s", e)
+        self.node_weight = node_weight
+        return budget * weight / node_weight if node_weight else budget
+
+    def _reload_settings(self):
+        """Pick up settings written by any worker (lock held)"""
+        try:
+            mtime = os.path.getmtime(self.settings_path)
+        except OSError:
+            return
+        if mtime == self.settings_mtime:
+            return
+        try:
+            with open(self.settings_path) as f:
+                self.settings = dict(DEFAULT_SETTINGS, **json.load(f))
+            self.settings_mtime = mtime
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read egress settings: %s", e)
+
+    def reset_directory(self):
+        """Forget runtime settings and weights of previous server runs (call before forking workers)"""
+        if not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename == 'settings.json' or filename.startswith('weight-'):
+                os.remove(os.path.join(self.directory, filename))
+
+    def update(self, **changes):
+        """Change settings on every worker of the node; raises ValueError on bad values"""
+        for name, value in changes.items():
+            if name not in DEFAULT_SETTINGS:
+                raise ValueError(f"Unknown egress setting: {name}")
+            if name == 'weights':
+                if not isinstance(value, dict) or any(float(w) <= 0 for w in value.values()):
+                    raise ValueError("weights must map stream kinds to positive numbers")
+            elif int(value) < 0:
+                raise ValueError(f"{name} must not be negative")
+        with self.lock:
+            self._reload_settings()
+            settings = dict(self.settings)
+            for name, value in changes.items():
+                settings[name] = {k: float(w) for k, w in value.items()} if name == 'weights' else int(value)
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self.settings_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(settings, f)
+            os.replace(tmp_path, self.settings_path)
+            self.settings = settings
+            self.settings_mtime = os.path.getmtime(self.settings_path)
+            self._allocate(force=True)
+        logger.info("Egress settings changed: %s", changes)
+        return self.snapshot()
+
+    def snapshot(self):
+        """Settings and the streams of this process, for the admin API and metrics"""
+        with self.lock:
+            self._reload_settings()
+            now = time.monotonic()
+            return {
+                'settings': dict(self.settings),
+                'streams': len(self.streams),
+                'throughput': round(self.throughput) if self.streams else 0,
+                'node_weight': self.node_weight,
+                'stream_rates': sorted(
+                    ({'kind': s.kind, 'weight': s.weight, 'sent': s.sent,
+                      'rate': round(s.rate) if s.rate is not None else None,
+                      'average': round(s.sent / max(now - s.started, 1e-3))}
+                     for s in self.streams), key=lambda s: -s['sent']),
+            }
+
+def allocate(demands, budget, cap=None):
+    """Weighted max-min fair rates for {stream: demand or None (unbounded)}
+
+    Streams wanting less than their fair share get their demand; what they
+    leave is split by weight among the others. Rates are None when neither
+    a budget nor a cap limits them.
+    """
+    if budget is None:
+        return {stream: cap for stream in demands}
+
+    wanted = {}
+    for stream, demand in demands.items():
+        if demand is None:
+            wanted[stream] = cap
+        else:
+            wanted[stream] = min(demand, cap) if cap else demand
+
+    rates = {}
+    remaining = float(budget)
+    pending = set(demands)
+    while pending:
+        fair = remaining / sum(stream.weight for stream in pending)
+        satisfied = {stream for stream in pending
+                     if wanted[stream] is not None and wanted[stream] <= fair * stream.weight}
+        if not satisfied:
+            for stream in pending:
+                rates[stream] = fair * stream.weight
+            break
+        for stream in satisfied:
+            rates[stream] = wanted[stream]
+            remaining -= wanted[stream]
+        pending -= satisfied
+    return rates
+
+# Process-wide scheduler for the download endpoints
+egress = EgressScheduler()
@@ -0,0 +1,188 @@
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+# Qualities offered on the download pages, highest first
+STANDARD_HEIGHTS = (1080, 720, 480, 360, 240, 144)
+
+# Progressive itags the download pages offer, by height. YouTube stopped
+# serving most of them; the same height is then muxed from DASH streams.
+PROGRESSIVE_HEIGHTS = {'18': 360, '22': 720, '37': 1080}
+
+# Audio container to pair with a video container when muxing
+AUDIO_FOR_VIDEO = {'mp4': 'm4a', 'webm': 'webm'}
+
+# Fields of a yt-dlp format dict kept in the index
+FIELDS = ('format_id', 'url', 'ext', 'height', 'width', 'fps', 'vcodec', 'acodec',
+          'abr', 'tbr', 'filesize', 'filesize_approx', 'format_note', 'protocol')
+
+def codec_family(codec):
+    """Normalise a codec string ('avc1.64001F', 'vp09.00.40.08') to its family"""
+    if not codec or codec == 'none':
+        return None
+    family = codec.split('.')[0].lower()
+    return {'vp09': 'vp9', 'av1': 'av01', 'mp4a': 'aac'}.get(family, family)
+
+def url_expiry(url):
+    """Expiry timestamp of a signed googlevideo URL, or None"""
+    try:
+        for name, value in parse_qsl(urlsplit(url).query):
+            if name == 'expire':
+                return int(value)
+    except ValueError:
+        pass
+    return None
+
+class FormatIndex:
+    """Lookup tables over the formats of one video, built once per extraction
+
+    yt-dlp lists formats worst to best, so the position of a format is its
+    rank and "best" means the highest ranked match, exactly like yt-dlp's
+    format selectors. Every lookup the app makes (by format_id, by
+    (height, codec, container), best under a standard height, best audio,
+    the quality list of the download page) is a dict lookup instead of a
+    scan of info['formats'].
+    """
+
+    def __init__(self, formats):
+        """Index a list of yt-dlp format dicts (in yt-dlp's order)"""
+        self.formats = [{field: f.get(field) for field in FIELDS}
+                        for f in formats if f.get('format_id') and f.get('url')]
+        self.by_id = {}
+        self.by_key = {}
+        self.audio_by_abr = {}
+        self.audio_by_ext = {}
+        self.standard = {}
+        self.best_under = {}
+        self.expires_at = None
+
+        best_progressive = best_video = best_audio = None
+        for rank, f in enumerate(self.formats):
+            f['rank'] = rank
+            self.by_id[f['format_id']] = f
+            height = f['height'] or 0
+            has_video = codec_family(f['vcodec']) is not None
+            has_audio = codec_family(f['acodec']) is not None
+
+            if has_video:
+                self.by_key[(height, codec_family(f['vcodec']), f['ext'])] = f
+                best_video = f
+                if has_audio:
+                    best_progressive = f
+                note = (f['format_note'] or '').replace('p60', 'p')
+                if note.endswith('p') and note[:-1].isdigit() and int(note[:-1]) in STANDARD_HEIGHTS:
+                    self.standard[int(note[:-1])] = f
+            elif has_audio:
+                self.audio_by_abr[round(f['abr'] or 0)] = f
+                self.audio_by_ext[f['ext']] = f
+                best_audio = f
+
+            expires = url_expiry(f['url'])
+            if expires and (self.expires_at is None or expires < self.expires_at):
+                self.expires_at = expires
+
+        self.best_progressive = best_progressive
+        self.best_video = best_video
+        self.best_audio = best_audio
+        for cap in STANDARD_HEIGHTS:
+            self.best_under[cap] = self._scan_best(cap, progressive=True)
+
+    def _scan_best(self, max_height, progressive):
+        """Highest ranked video format no taller than max_height"""
+        for f in reversed(self.formats):
+            if codec_family(f['vcodec']) is None or (f['height'] or 0) > max_height:
+                continue
+            if progressive and codec_family(f['acodec']) is None:
+                continue
+            return f
+        return None
+
+    def __len__(self):
+        return len(self.formats)
+
+    def get(self, format_id):
+        """The format with this format_id, or None"""
+        return self.by_id.get(format_id)
+
+    def find(self, height, codec=None, container=None):
+        """Best format of a given height, optionally of a codec family and container"""
+        if codec and container:
+            return self.by_key.get((height, codec_family(codec), container))
+        matches = [f for (h, c, ext), f in self.by_key.items()
+                   if h == height and (not codec or c == codec_family(codec))
+                   and (not container or ext == container)]
+        return max(matches, key=lambda f: f['rank']) if matches else None
+
+    def best(self, max_height=None):
+        """Best format with audio and video, like yt-dlp's best[height<=N]
+
+        Without a height limit it falls back to the best format of any kind
+        when the video has no progressive format, as yt-dlp's "best" does.
+        """
+        if max_height is None:
+            return self.best_progressive or (self.formats[-1] if self.formats else None)
+        if max_height in self.best_under:
+            return self.best_under[max_height]
+        return self._scan_best(max_height, progressive=True)
+
+    def audio(self, abr=None):
+        """Best audio-only format, or the one with the given bitrate (kbps)"""
+        if abr is None:
+            return self.best_audio
+        return self.audio_by_abr.get(round(abr))
+
+    def resolve(self, format_id, download_type='video'):
+        """The format the downloader would select for a request
+
+        Mirrors the selectors get_direct_url used to pass to yt-dlp:
+        "<id>/bestaudio" for audio and "<id>/best[height<=720]/best" for
+        video, with "best" and "bestaudio" accepted as format_id.
+        """
+        if format_id == 'best':
+            return self.best()
+        f = self.best_audio if format_id == 'bestaudio' else self.by_id.get(format_id)
+        if f is not None:
+            return f
+        if download_type == 'audio':
+            return self.best_audio
+        if download_type == 'video':
+            return self.best(720) or self.best()
+        return None
+
+    def audio_for(self, video):
+        """Best audio-only format to mux with a video-only format"""
+        return self.audio_by_ext.get(AUDIO_FOR_VIDEO.get(video['ext'])) or self.best_audio
+
+    def resolve_streams(self, format_id):
+        """(video, audio) formats to serve for a video request
+
+        audio is None when the video format has its own audio track.
+        Video-only (DASH) formats come with the audio format to mux in,
+        and a progressive format that is no longer offered is replaced by
+        the DASH video of the same height instead of a lower quality.
+        """
+        f = self.by_id.get(format_id)
+        if f is None and format_id in PROGRESSIVE_HEIGHTS:
+            height = PROGRESSIVE_HEIGHTS[format_id]
+            f = self.find(height, container='mp4') or self.find(height)
+        if f is None:
+            return self.resolve(format_id, 'video'), None
+        if codec_family(f['vcodec']) is not None and codec_family(f['acodec']) is None:
+            return f, self.audio_for(f)
+        return f, None
+
+    def standard_formats(self):
+        """One video format per standard quality, highest quality first"""
+        return [self.standard[height] for height in STANDARD_HEIGHTS if height in self.standard]
+
+    def expired(self, margin=300):
+        """True once the signed URLs expire within margin seconds"""
+        return self.expires_at is not None and self.expires_at - margin < time.time()
+
+    def to_dict(self):
+        """JSON serializable form, see from_dict"""
+        return {'formats': [{field: f[field] for field in FIELDS} for f in self.formats]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an index stored with to_dict"""
+        return cls(data.get('formats', []))
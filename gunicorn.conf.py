@@ -0,0 +1,173 @@
+# gunicorn reads this file from the working directory automatically.
+#
+# Production profile:
+# - The app is preloaded in the master, together with yt-dlp and its compiled
+#   extractor patterns, then gc.freeze() keeps the garbage collector from
+#   touching those objects so the workers share their pages copy-on-write.
+# - Workers are threaded (gthread): requests mostly wait on YouTube or on
+#   clients reading streams. The worker count follows CPUs and memory.
+# - on_starting runs once in the master: schema creation/upgrades, the
+#   static asset build (see assets.py) and clearing metrics and egress
+#   settings files of the previous run.
+# - post_fork runs in every worker: DB pool, background threads and other
+#   per-process resources (see app.start_background_tasks).
+# - child_exit runs in the master when a worker is gone and folds its
+#   metrics into the archive (see metrics.archive).
+# - Without preload (GUNICORN_PRELOAD=0, e.g. with --reload in development)
+#   the master never imports project modules: workers are forked from it,
+#   so they would inherit those modules and keep running their old code
+#   after a reload. The hooks above then run this file as a script instead.
+#
+# Everything can be overridden with GUNICORN_* variables or CLI flags.
+import gc
+import os
+import sys
+import logging
+import subprocess
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def _cpu_count():
+    """CPUs available to this container (cgroup quota or affinity)"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _memory_bytes():
+    """Memory available to this container (cgroup limit or physical memory)"""
+    try:
+        with open('/sys/fs/cgroup/memory.max') as f:
+            value = f.read().strip()
+        if value != 'max':
+            return int(value)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _worker_count():
+    """2 * CPUs + 1, capped by how many workers fit in memory"""
+    if os.environ.get('GUNICORN_WORKERS'):
+        return int(os.environ['GUNICORN_WORKERS'])
+    count = 2 * _cpu_count() + 1
+    memory = _memory_bytes()
+    if memory:
+        # Workers share the preloaded app, this is what each adds on top
+        per_worker = int(os.environ.get('WORKER_MEMORY_MB', 150)) * 1024 * 1024
+        reserved = int(os.environ.get('RESERVED_MEMORY_MB', 256)) * 1024 * 1024
+        count = min(count, max(1, (memory - reserved) // per_worker))
+    return max(1, count)
+
+
+def _worker_class():
+    """gthread unless another class is requested and installed"""
+    requested = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+    if requested == 'gevent':
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            logger.warning("gevent is not installed, using gthread workers")
+            return 'gthread'
+    return requested
+
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+worker_class = _worker_class()
+workers = _worker_count()
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# Downloads can stream for minutes; gthread workers heartbeat independently of requests
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+# send_file() of finished downloads uses os.sendfile() through wsgi.file_wrapper
+sendfile = True
+# Recycle workers now and then to bound memory growth from yt-dlp and caches
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+
+def _prepare(log):
+    """Per-run setup before workers start (see on_starting)"""
+    from metrics import metrics
+    from egress import egress
+    metrics.reset_directory()
+    egress.reset_directory()
+
+    if os.environ.get("SKIP_INIT_DB") != "1":
+        from app import init_database
+        init_database()
+
+    # Workers read the asset manifest after fork, so they see this build
+    from assets import build_assets
+    try:
+        build_assets()
+    except Exception as e:
+        log.warning("Asset build failed, serving original static files: %s", e)
+
+
+def _archive(pid):
+    from metrics import metrics
+    metrics.archive(pid)
+
+
+def _run_script(*args, check=False):
+    """Run a hook step in a separate interpreter, keeping the master clean"""
+    subprocess.run([sys.executable, __file__, *map(str, args)], check=check)
+
+
+def on_starting(server):
+    if server.cfg.preload_app:
+        _prepare(server.log)
+    else:
+        _run_script('prepare', check=True)
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from downloader import warm_up_yt_dlp
+    extractors = warm_up_yt_dlp()
+    # Move everything allocated so far out of the collector's reach, so
+    # collections in the workers don't write to (and un-share) these pages
+    gc.collect()
+    gc.freeze()
+    server.log.info("Preloaded app and %d yt-dlp extractors, %d objects frozen",
+                    extractors, gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    from app import start_background_tasks
+    start_background_tasks()
+
+
+def child_exit(server, worker):
+    if server.cfg.preload_app:
+        _archive(worker.pid)
+    else:
+        _run_script('archive', worker.pid)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1] == 'prepare':
+        _prepare(logger)
+    elif sys.argv[1] == 'archive':
+        _archive(int(sys.argv[2]))
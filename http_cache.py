@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import hashlib
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Cache lifetimes in seconds: (browsers, shared caches such as a CDN).
+# Browsers get the shorter one since a CDN can be purged and they can't.
+POLICIES = {
+    # Pages that only change with a deploy (home, FAQ, legal pages)
+    'static': (300, int(os.environ.get("CACHE_STATIC_SECONDS", 3600))),
+    # Video pages and video info, which change when the video's formats do
+    'video': (60, int(os.environ.get("CACHE_VIDEO_SECONDS", 600))),
+}
+
+def _deploy_version():
+    """APP_VERSION, or a digest of the templates and static files of this deploy"""
+    if os.environ.get("APP_VERSION"):
+        return os.environ["APP_VERSION"]
+    digest = hashlib.sha1()
+    for directory in ('templates', 'static'):
+        for dirpath, dirnames, filenames in os.walk(os.path.join(ROOT, directory)):
+            # Build output (static/dist) follows from the sources
+            dirnames[:] = sorted(d for d in dirnames if d != 'dist')
+            for filename in sorted(filenames):
+                stat = os.stat(os.path.join(dirpath, filename))
+                digest.update(f"{dirpath}/{filename}:{stat.st_size}:{int(stat.st_mtime)}".encode())
+    return digest.hexdigest()[:12]
+
+# Part of every ETag, so a deploy changing templates or assets invalidates them
+DEPLOY_VERSION = _deploy_version()
+
+def make_etag(*parts):
+    """ETag value for a response built from parts (IDs, versions, ...)"""
+    key = json.dumps([DEPLOY_VERSION, *parts], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+def info_version(video_info):
+    """Digest of the video info fields pages and the info API are rendered from"""
+    fields = [video_info.get(name) for name in
+              ('title', 'duration', 'thumbnail', 'is_playlist', 'video_formats', 'audio_formats')]
+    return hashlib.sha1(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+def _has_session():
+    """Whether the request carries a session cookie
+
+    Touching flask.session at all adds Vary: Cookie to the response, which
+    would split shared caches by cookie; without a cookie there is nothing
+    personal to look for.
+    """
+    return current_app.config['SESSION_COOKIE_NAME'] in request.cookies
+
+def flashes_pending():
+    """Whether the visitor has flashed messages that a cached page would not show"""
+    return _has_session() and '_flashes' in session
+
+def not_modified(etag):
+    """A 304 response if the client already has this ETag, else None"""
+    if request.if_none_match.contains_weak(etag) and not flashes_pending():
+        response = make_response('', 304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+def cacheable(response, policy, etag=None):
+    """Set caching headers of a policy on a response and answer conditional requests
+
+    A response that changed the session (e.g. showed flashed messages) is
+    personal and is never stored.
+    """
+    response = make_response(response)
+    if response.status_code != 200 or (_has_session() and session.modified):
+        return no_store(response)
+    browser_seconds, shared_seconds = POLICIES[policy]
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = min(browser_seconds, shared_seconds)
+    response.cache_control.s_maxage = shared_seconds
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response = response.make_conditional(request)
+    return response
+
+def no_store(*args):
+    """Mark a response (or view return value, as for make_response) as not to be stored"""
+    response = make_response(*args)
+    response.cache_control.no_store = True
+    response.cache_control.public = False
+    response.cache_control.max_age = None
+    response.cache_control.s_maxage = None
+    return response
+
+def static_page(view):
+    """Cache a view that only changes with a deploy, keyed by path and query string"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = make_etag(request.full_path, time.strftime('%Y'))
+        return not_modified(etag) or cacheable(view(*args, **kwargs), 'static', etag)
+    return wrapper
+
+def uncached(view):
+    """Mark whatever a view returns (downloads, redirects to them) as not storable"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return no_store(view(*args, **kwargs))
+    return wrapper
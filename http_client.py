@@ -0,0 +1,68 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+# Idle keep-alive connections kept per host (googlevideo serves each video
+# from its own host, so downloads of one video share a pool)
+POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 32))
+# Hosts with a pool kept open, least recently used are dropped first
+POOL_HOSTS = int(os.environ.get('UPSTREAM_POOL_HOSTS', 16))
+CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+# Longest silence between two reads of a response before it is abandoned
+READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 30))
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+_adapter = None
+_session = None
+_pid = None
+_session_class = None
+_lock = threading.Lock()
+
+def _reset_for_process():
+    """Create this process's connection pools (lock held); forked children get their own"""
+    global _adapter, _session, _pid
+    from requests.adapters import HTTPAdapter
+
+    _adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE)
+    _session = _new_session(_adapter)
+    # Shared by every request of the process: never keep cookies across them
+    _session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    _pid = os.getpid()
+
+def _new_session(adapter):
+    global _session_class
+    if _session_class is None:
+        import requests  # Deferred to keep it out of the app's import time
+
+        class UpstreamSession(requests.Session):
+            """Session applying DEFAULT_TIMEOUT to calls that don't pass a timeout"""
+
+            def request(self, method, url, **kwargs):
+                kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+                return super().request(method, url, **kwargs)
+
+        _session_class = UpstreamSession
+
+    session = _session_class()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session():
+    """The process-wide session for talking to YouTube
+
+    Thread safe: connections come from per-host keep-alive pools and the
+    session keeps no cookies. Calls without a timeout get DEFAULT_TIMEOUT,
+    so a silent upstream can't pin a worker thread.
+    """
+    with _lock:
+        if _pid != os.getpid():
+            _reset_for_process()
+        return _session
+
+def new_session():
+    """A session with its own cookie jar, using the process-wide connection pools"""
+    with _lock:
+        if _pid != os.getpid():
+            _reset_for_process()
+        return _new_session(_adapter)
@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 'production' keeps request threads quiet: INFO for our modules, yt-dlp only
+# from WARNING up. 'development' logs yt-dlp's verbose output too.
+LOG_PROFILE = os.environ.get("LOG_PROFILE",
+                             "production" if os.environ.get("REPLIT_DEPLOYMENT") else "development")
+
+_listener = None
+_listener_pid = None
+_configure_lock = threading.Lock()
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most burst records per message template through every interval
+
+    Records are keyed by logger, level and the unformatted message, so this
+    only works for lazy %-style calls (logger.info("... %s", value)); an
+    f-string makes every message unique. When a key is allowed again, the
+    number of records suppressed in the meantime is appended to it.
+    Records at or above exempt_level (errors by default) always pass.
+    """
+
+    def __init__(self, interval=10.0, burst=5, exempt_level=logging.ERROR, max_keys=2048):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.exempt_level = exempt_level
+        self.max_keys = max_keys
+        self.windows = {}  # key -> [window start, count, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.exempt_level:
+            return True
+
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                if window is None and len(self.windows) >= self.max_keys:
+                    self.windows.clear()
+                self.windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+                return True
+
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock QueueHandler formats every record in the calling thread. Here
+    only the message is interpolated, since its args may change or go away
+    once the logging call returns; timestamps, the log format and
+    tracebacks are rendered by the listener.
+    """
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+class YtDlpLogger:
+    """Logger object for yt-dlp's 'logger' option
+
+    yt-dlp sends all screen output to debug(); real debug lines are prefixed
+    with '[debug] '. Everything goes to the 'yt_dlp' logger so its level
+    (set by the logging profile) decides what is kept. Messages are passed
+    without args, so they are never %-interpolated.
+    """
+
+    def __init__(self, name='yt_dlp'):
+        self.logger = logging.getLogger(name)
+
+    def debug(self, message):
+        if message.startswith('[debug] '):
+            self.logger.debug(message[8:])
+        else:
+            self.logger.info(message)
+
+    def info(self, message):
+        self.logger.info(message)
+
+    def warning(self, message):
+        self.logger.warning(message)
+
+    def error(self, message):
+        self.logger.error(message)
+
+ytdlp_logger = YtDlpLogger()
+
+def ytdlp_log_options():
+    """yt-dlp options routing its output through the filtered 'yt_dlp' logger"""
+    return {
+        'logger': ytdlp_logger,
+        'quiet': True,
+        'no_warnings': False,
+        'verbose': LOG_PROFILE == 'development',
+    }
+
+def configure_logging(level=None):
+    """Install the queued, rate limited root handler (once per process)
+
+    Safe to call again after a fork: the listener thread does not survive
+    fork(), so a child process gets its own.
+    """
+    global _listener, _listener_pid
+    with _configure_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            return
+
+        level = level or os.environ.get("LOG_LEVEL", "INFO")
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(RateLimitFilter(
+            interval=float(os.environ.get("LOG_RATE_INTERVAL", 10)),
+            burst=int(os.environ.get("LOG_RATE_BURST", 5)),
+        ))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        ytdlp_level = logging.DEBUG if LOG_PROFILE == 'development' else logging.WARNING
+        logging.getLogger('yt_dlp').setLevel(ytdlp_level)
+        # Per-request access lines are already covered by the request metrics
+        logging.getLogger('werkzeug').setLevel(logging.WARNING if LOG_PROFILE == 'production' else logging.INFO)
+
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        if _listener_pid is None:
+            atexit.register(stop_logging)
+        _listener_pid = os.getpid()
+
+def stop_logging():
+    """Flush and stop the listener thread"""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import fcntl
+import atexit
+import logging
+import tempfile
+import threading
+from contextlib import ContextDecorator, contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Directory where every worker process publishes its metrics for aggregation
+METRICS_DIR = os.environ.get("METRICS_DIR",
+                             os.path.join(tempfile.gettempdir(), "ytdl-metrics"))
+
+# Totals of worker processes that have exited
+ARCHIVE_FILE = 'metrics-archive.json'
+
+class MetricsRegistry:
+    """Process-local counters, gauges and histograms with Prometheus export
+
+    gunicorn runs several worker processes, so each process periodically
+    writes its values to METRICS_DIR and /metrics merges the files of all
+    workers: counters and histograms are summed and gauges of live workers
+    are reported with a pid label. When a worker exits, its counters and
+    histograms are folded into metrics-archive.json (see archive()) so
+    totals never go backwards.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.definitions = {}  # name -> {'type', 'help', 'buckets'}
+        self.counters = {}     # (name, labels) -> value
+        self.gauges = {}       # (name, labels) -> value
+        self.histograms = {}   # (name, labels) -> [bucket counts..., sum, count]
+        self.collectors = []   # callables returning [(name, labels dict, value)] gauges
+        self.node_collectors = []  # the same for node-wide gauges, see register_collector()
+        self.lock = threading.Lock()
+        self.flush_thread = None
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        """Declare a metric; metric_type is 'counter', 'gauge' or 'histogram'"""
+        self.definitions[name] = {
+            'type': metric_type,
+            'help': help_text,
+            'buckets': list(buckets or DEFAULT_BUCKETS) if metric_type == 'histogram' else None,
+        }
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to value"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """Record an observation in a histogram"""
+        buckets = self.definitions[name]['buckets']
+        key = (name, _label_key(labels))
+        with self.lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def timed(self, name, **labels):
+        """Context manager / decorator observing elapsed seconds in a histogram"""
+        return _Timer(self, name, labels)
+
+    def register_collector(self, collector, node_wide=False):
+        """Register a callable returning [(gauge name, labels, value)] at export time
+
+        Gauges of node_wide collectors describe state shared by all workers;
+        they are reported once, by the process serving /metrics, without a
+        pid label.
+        """
+        (self.node_collectors if node_wide else self.collectors).append(collector)
+
+    def start(self):
+        """Start publishing this process's metrics (call once per worker process)"""
+        os.makedirs(self.directory, exist_ok=True)
+        if self.flush_thread is None or not self.flush_thread.is_alive():
+            # A file with this pid is from an earlier process that was not archived
+            self.archive(os.getpid())
+            self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self.flush_thread.start()
+            atexit.register(self.flush)
+
+    def reset_directory(self):
+        """Remove files left by previous server runs (call before forking workers)"""
+        if not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.startswith('metrics-') and filename.endswith('.json'):
+                os.remove(os.path.join(self.directory, filename))
+
+    def _collect_gauges(self):
+        """Gauges set directly plus those reported by collectors"""
+        with self.lock:
+            gauges = dict(self.gauges)
+        gauges.update(self._run_collectors(self.collectors))
+        return gauges
+
+    def _run_collectors(self, collectors):
+        gauges = {}
+        for collector in collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges[(name, _label_key(labels))] = value
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+        return gauges
+
+    def flush(self):
+        """Write this process's current values to the shared directory"""
+        gauges = self._collect_gauges()
+        with self.lock:
+            state = {
+                'pid': os.getpid(),
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), series] for (name, labels), series in self.histograms.items()],
+            }
+        state['gauges'] = [[name, list(labels), value] for (name, labels), value in gauges.items()]
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write(self._path(os.getpid()), state)
+        except OSError as e:
+            logger.warning("Could not write metrics file: %s", e)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"metrics-{pid}.json")
+
+    def _write(self, path, state):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def archive(self, pid):
+        """Fold the counters and histograms of an exited process into the archive
+
+        The gunicorn master calls this when a worker exits (child_exit), so
+        files of dead workers don't pile up and a new worker reusing the pid
+        can't overwrite their totals.
+        """
+        path = self._path(pid)
+        if not os.path.exists(path):
+            return
+        try:
+            with self._archive_lock(fcntl.LOCK_EX):
+                states = self._read_states([os.path.basename(path), ARCHIVE_FILE])
+                counters, histograms = _merge_totals(states)
+                self._write(os.path.join(self.directory, ARCHIVE_FILE), {
+                    'pid': None,
+                    'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+                    'histograms': [[name, list(labels), series] for (name, labels), series in histograms.items()],
+                })
+                os.remove(path)
+        except OSError as e:
+            logger.warning("Could not archive metrics of process %s: %s", pid, e)
+
+    def _flush_loop(self):
+        """Periodically publish metrics"""
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    @contextmanager
+    def _archive_lock(self, operation):
+        """Lock against archive() moving totals between files"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'archive.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            yield
+
+    def _load_all(self):
+        """Read the published state of every worker process and the archive"""
+        if not os.path.isdir(self.directory):
+            return []
+        with self._archive_lock(fcntl.LOCK_SH):
+            return self._read_states(filename for filename in os.listdir(self.directory)
+                                     if filename.startswith('metrics-') and filename.endswith('.json'))
+
+    def _read_states(self, filenames):
+        states = []
+        for filename in filenames:
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    states.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return states
+
+    def export(self):
+        """Render the metrics of all workers in Prometheus text format"""
+        self.flush()
+
+        states = self._load_all()
+        counters, histograms = _merge_totals(states)
+        gauges = {}
+        for state in states:
+            if _pid_alive(state.get('pid')):
+                for name, labels, value in state.get('gauges', []):
+                    labels = tuple(map(tuple, labels)) + (('pid', str(state['pid'])),)
+                    gauges[(name, labels)] = value
+        gauges.update(self._run_collectors(self.node_collectors))
+
+        lines = []
+        for name in sorted(self.definitions):
+            definition = self.definitions[name]
+            lines.append(f"# HELP {name} {definition['help']}")
+            lines.append(f"# TYPE {name} {definition['type']}")
+
+            if definition['type'] == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            elif definition['type'] == 'gauge':
+                for (metric, labels), value in sorted(gauges.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            else:
+                buckets = definition['buckets']
+                for (metric, labels), series in sorted(histograms.items()):
+                    if metric != name or len(series) != len(buckets) + 2:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets, series):
+                        cumulative += count
+                        bucket_labels = labels + (('le', _format_value(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                    inf_labels = labels + (('le', '+Inf'),)
+                    lines.append(f"{name}_bucket{_format_labels(inf_labels)} {series[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(series[-2])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {series[-1]}")
+
+        return "\n".join(lines) + "\n"
+
+class _Timer(ContextDecorator):
+    """Observes the duration of a block, adding an outcome label (ok/error)"""
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def _recreate_cm(self):
+        # A fresh timer per decorated call, so concurrent calls don't share state
+        return _Timer(self.registry, self.name, self.labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = 'error' if exc_type else 'ok'
+        self.registry.observe(self.name, time.perf_counter() - self.start,
+                              outcome=outcome, **self.labels)
+        return False
+
+def _label_key(labels):
+    """Hashable, ordered representation of a labels dict"""
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def _merge_totals(states):
+    """Sum the counters and histograms of several process states"""
+    counters, histograms = {}, {}
+    for state in states:
+        for name, labels, value in state.get('counters', []):
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, series in state.get('histograms', []):
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], series)]
+            else:
+                histograms[key] = list(series)
+    return counters, histograms
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+metrics = MetricsRegistry()
+
+# Metric definitions
+metrics.describe('http_request_seconds', 'histogram', 'Time spent handling HTTP requests')
+metrics.describe('youtube_downloader_seconds', 'histogram', 'Time spent in YoutubeDownloader methods')
+metrics.describe('youtube_extract_seconds', 'histogram', 'Time spent in yt-dlp extract_info calls')
+metrics.describe('ffmpeg_postprocess_seconds', 'histogram', 'Time spent in yt-dlp FFmpeg post-processors')
+metrics.describe('cookie_refresh_seconds', 'histogram', 'Time spent refreshing YouTube cookies')
+metrics.describe('db_commit_seconds', 'histogram', 'Time spent committing database writes')
+metrics.describe('cache_requests_total', 'counter', 'Cache lookups by cache, tier and result')
+metrics.describe('cache_evictions_total', 'counter', 'Entries evicted from a cache because it was full')
+metrics.describe('format_index_lookups_total', 'counter', 'get_direct_url resolutions served from a cached format index')
+metrics.describe('proxied_bytes_total', 'counter', 'Bytes sent to clients by the download endpoints')
+metrics.describe('upstream_governor_state', 'gauge', 'Upstream circuit breaker state (0 closed, 1 half-open, 2 open)')
+metrics.describe('upstream_governor_rate', 'gauge', 'Current adaptive upstream call rate (calls/second)')
+metrics.describe('upstream_governor_events', 'gauge', 'Upstream governor event counts of the node')
+metrics.describe('admission_active', 'gauge', 'Requests currently admitted')
+metrics.describe('admission_queued', 'gauge', 'Requests waiting for admission')
+metrics.describe('admission_rejected', 'gauge', 'Requests rejected by admission control in live workers')
+metrics.describe('transcode_jobs_total', 'counter', 'Transcode jobs by outcome')
+metrics.describe('transcode_seconds', 'histogram', 'FFmpeg run time of finished transcodes')
+metrics.describe('transcode_queue_seconds', 'histogram', 'Time transcode jobs waited for a slot')
+metrics.describe('transcode_queued', 'gauge', 'Transcode jobs waiting for a slot')
+metrics.describe('transcode_running', 'gauge', 'Transcode jobs running')
+metrics.describe('ffmpeg_streams_total', 'counter', 'FFmpeg stdout streams (video/audio muxing) by outcome')
+metrics.describe('ffmpeg_streaming', 'gauge', 'FFmpeg stdout streams in progress')
+metrics.describe('upstream_segments_total', 'counter', 'Media segments fetched from upstream by result')
+metrics.describe('segmented_fetch_connections', 'histogram', 'Peak upstream connections used per segmented download',
+                 buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+metrics.describe('egress_stream_bytes_per_second', 'histogram', 'Average throughput of finished download streams',
+                 buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6))
+metrics.describe('egress_throttled_seconds_total', 'counter', 'Time download streams were held back by the egress scheduler')
+metrics.describe('egress_streams', 'gauge', 'Download streams sent through the egress scheduler')
+metrics.describe('egress_throughput', 'gauge', 'Bytes/second sent by the download streams of a worker')
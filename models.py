@@ -1,13 +1,108 @@
+import json
+import logging
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, timezone
+
+from youtube_link_utils import get_video_id
+from metrics import metrics
+from tracing import span
+from db_profiles import begin_write
+
+logger = logging.getLogger(__name__)
 
 db = SQLAlchemy()
 
+def commit(operation):
+    """Commit the session, recording how long the write took"""
+    with metrics.timed('db_commit_seconds', operation=operation), span('db.commit', operation=operation):
+        db.session.commit()
+
+class Video(db.Model):
+    """Catalog of videos keyed by YouTube video ID.
+
+    Also the persistent store behind the in-memory info cache, so that a
+    freshly started worker can answer without re-extracting.
+    """
+    id = db.Column(db.String(11), primary_key=True)  # YouTube video ID
+    title = db.Column(db.String(255))
+    channel = db.Column(db.String(255))
+    duration = db.Column(db.Integer)                 # Duration in seconds
+    formats = db.Column(db.Text)                     # JSON list of last-seen format IDs
+    info = db.Column(db.Text)                        # JSON of the last extracted video info
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<Video {self.id}: {self.title}>'
+
+    @staticmethod
+    def ensure(video_id, title=None):
+        """Return the catalog entry for a video, creating it if needed (no commit)"""
+        video = db.session.get(Video, video_id)
+        if not video:
+            video = Video(id=video_id, title=title[:255] if title else None)
+            db.session.add(video)
+        elif title and not video.title:
+            video.title = title[:255]
+        return video
+
+    @staticmethod
+    def store_info(video_id, info):
+        """Write extracted video info to the catalog"""
+        format_ids = [f.get('format_id') for f in
+                      info.get('video_formats', []) + info.get('audio_formats', [])]
+        placeholder = info.get('title') == f"YouTube Video {video_id}"
+
+        for attempt in range(2):
+            try:
+                begin_write(db.session)
+                video = Video.ensure(video_id)
+                # Canned info (see youtube_link_utils) carries a placeholder
+                # title, channel and duration: keep what the catalog knows
+                if not (placeholder and video.title):
+                    video.title = (info.get('title') or '')[:255] or video.title
+                    video.channel = (info.get('channel') or '')[:255] or video.channel
+                    video.duration = info.get('duration') or video.duration
+                video.formats = json.dumps(format_ids)
+                video.info = json.dumps(info)
+                video.updated_at = datetime.utcnow()
+                commit('video_store_info')
+                return video
+            except IntegrityError:
+                # Another worker inserted the same video concurrently, retry as update
+                db.session.rollback()
+        return None
+
+    @staticmethod
+    def get_cached_info(video_id, max_age=None):
+        """Get (info, stored_at) for stored video info younger than max_age seconds, or None
+
+        stored_at is when the info was extracted, as a Unix timestamp.
+        """
+        video = db.session.get(Video, video_id)
+        if not video or not video.info:
+            return None
+        if max_age is not None and video.updated_at < datetime.utcnow() - timedelta(seconds=max_age):
+            return None
+        return json.loads(video.info), video.updated_at.replace(tzinfo=timezone.utc).timestamp()
+
+    @staticmethod
+    def recent_info(limit, max_age):
+        """(video_id, info, stored_at) of the most recently stored info younger than max_age seconds"""
+        videos = (Video.query
+                  .filter(Video.info.isnot(None),
+                          Video.updated_at >= datetime.utcnow() - timedelta(seconds=max_age))
+                  .order_by(Video.updated_at.desc())
+                  .limit(limit)
+                  .all())
+        return [(video.id, json.loads(video.info), video.updated_at.replace(tzinfo=timezone.utc).timestamp())
+                for video in videos]
+
 class Download(db.Model):
     """Model to track download history"""
     id = db.Column(db.Integer, primary_key=True)
-    url = db.Column(db.String(255), nullable=False)
-    video_title = db.Column(db.String(255))
+    video_id = db.Column(db.String(11), db.ForeignKey('video.id'), nullable=False, index=True)
     format_type = db.Column(db.String(50))  # video or audio
     quality = db.Column(db.String(50))      # e.g., 1080p, 720p, etc.
     file_size = db.Column(db.Integer)       # Size in bytes
@@ -15,31 +110,49 @@ class Download(db.Model):
     status = db.Column(db.String(50))       # completed, failed, etc.
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     ip_address = db.Column(db.String(50))   # To track unique users (anonymized)
-    
+
+    video = db.relationship('Video', lazy='joined')
+
     def __repr__(self):
-        return f'<Download {self.id}: {self.video_title}>'
-    
+        return f'<Download {self.id}: {self.video_id}>'
+
+    @property
+    def url(self):
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+    @property
+    def video_title(self):
+        return self.video.title if self.video and self.video.title else f"YouTube Video {self.video_id}"
+
     @staticmethod
-    def add_download(url, video_title, format_type, quality, file_size=None, 
+    def add_download(video_id, format_type, quality, video_title=None, file_size=None,
                     download_time=None, status="started", ip_address=None):
         """Create a new download record"""
-        download = Download(
-            url=url,
-            video_title=video_title,
-            format_type=format_type,
-            quality=quality,
-            file_size=file_size,
-            download_time=download_time,
-            status=status,
-            ip_address=ip_address
-        )
-        db.session.add(download)
-        db.session.commit()
-        return download
+        for attempt in range(2):
+            try:
+                begin_write(db.session)
+                Video.ensure(video_id, video_title)
+                download = Download(
+                    video_id=video_id,
+                    format_type=format_type,
+                    quality=quality,
+                    file_size=file_size,
+                    download_time=download_time,
+                    status=status,
+                    ip_address=ip_address
+                )
+                db.session.add(download)
+                commit('download_add')
+                return download
+            except IntegrityError:
+                # Another worker inserted the same video concurrently, retry with it
+                db.session.rollback()
+        return None
     
     @staticmethod
     def update_status(download_id, status, file_size=None, download_time=None):
         """Update an existing download record with completion info"""
+        begin_write(db.session)
         download = Download.query.get(download_id)
         if download:
             download.status = status
@@ -47,7 +160,7 @@ class Download(db.Model):
                 download.file_size = file_size
             if download_time:
                 download.download_time = download_time
-            db.session.commit()
+            commit('download_update_status')
             return download
         return None
     
@@ -55,8 +168,8 @@ class Download(db.Model):
     def get_popular_downloads(limit=10):
         """Get most popular downloaded videos"""
         return Download.query.filter_by(status="completed").group_by(
-            Download.video_title).order_by(
-            db.func.count(Download.video_title).desc()).limit(limit).all()
+            Download.video_id).order_by(
+            db.func.count(Download.video_id).desc()).limit(limit).all()
 
 class Statistics(db.Model):
     """Model to track website usage statistics"""
@@ -73,6 +186,7 @@ class Statistics(db.Model):
     @staticmethod
     def record_visit():
         """Increment visit counter for today"""
+        begin_write(db.session)
         today = datetime.utcnow().date()
         stats = Statistics.query.filter_by(date=today).first()
         
@@ -82,12 +196,13 @@ class Statistics(db.Model):
         else:
             stats.visits += 1
         
-        db.session.commit()
+        commit('statistics_visit')
         return stats
     
     @staticmethod
     def record_download(format_type):
         """Increment download counter for today"""
+        begin_write(db.session)
         today = datetime.utcnow().date()
         stats = Statistics.query.filter_by(date=today).first()
         
@@ -106,5 +221,64 @@ class Statistics(db.Model):
             elif format_type == 'audio':
                 stats.audio_downloads += 1
         
-        db.session.commit()
-        return stats
\ No newline at end of file
+        commit('statistics_download')
+        return stats
+
+def upgrade_download_catalog():
+    """Migrate a legacy download table (url/video_title per row) to the video catalog.
+
+    Must be called inside an app context after db.create_all(). Legacy rows are
+    copied into the new layout and each distinct video gets a catalog entry.
+    Rows whose URL has no video ID are kept as they were in download_legacy.
+    """
+    columns = {c['name'] for c in inspect(db.engine).get_columns('download')}
+    if 'video_id' in columns or 'url' not in columns:
+        return False
+
+    logger.info("Migrating download history to the video catalog")
+    begin_write(db.session)
+    with db.engine.begin() as conn:
+        legacy_rows = conn.execute(text(
+            "SELECT id, url, video_title, format_type, quality, file_size, "
+            "download_time, status, created_at, ip_address FROM download"
+        ).columns(created_at=db.DateTime)).mappings().all()
+
+        existing_videos = {row[0] for row in conn.execute(text("SELECT id FROM video"))}
+        videos = {}
+        downloads = []
+        unparsable = []
+        for row in legacy_rows:
+            video_id = get_video_id(row['url'] or '')
+            if not video_id:
+                unparsable.append({'id': row['id']})
+                continue
+            if video_id not in existing_videos and video_id not in videos:
+                videos[video_id] = {'id': video_id, 'title': row['video_title'],
+                                    'updated_at': row['created_at'] or datetime.utcnow()}
+            download = dict(row)
+            download.pop('url')
+            download.pop('video_title')
+            download['video_id'] = video_id
+            downloads.append(download)
+
+        if unparsable:
+            if not inspect(conn).has_table('download_legacy'):
+                conn.execute(text("CREATE TABLE download_legacy AS SELECT * FROM download WHERE 1 = 0"))
+            conn.execute(text("INSERT INTO download_legacy SELECT * FROM download WHERE id = :id"), unparsable)
+            logger.warning("Kept %s downloads without a video ID in download_legacy", len(unparsable))
+
+        conn.execute(text("DROP TABLE download"))
+        Download.__table__.create(bind=conn)
+        if videos:
+            conn.execute(Video.__table__.insert(), list(videos.values()))
+        if downloads:
+            conn.execute(Download.__table__.insert(), downloads)
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text(
+                    "SELECT setval(pg_get_serial_sequence('download', 'id'), "
+                    "(SELECT MAX(id) FROM download))"
+                ))
+
+    logger.info("Migrated %s downloads across %s videos", len(downloads), len(videos))
+    return True
+
@@ -0,0 +1,84 @@
+import time
+import logging
+
+from flask import current_app, request, render_template
+from markupsafe import escape
+
+from cache_manager import CacheManager
+from http_cache import flashes_pending
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Site root that static pages are pre-rendered for; replaced by the
+# request's root (layout.html puts request.url in canonical/og tags)
+SHELL_ROOT = 'http://render-cache.invalid/'
+
+class RenderCache:
+    """Rendered template output
+
+    - render(key, fn): output of fn() kept per request URL and key in an
+      LRU (a CacheManager), for pages built from cached data such as video
+      info; the key should carry a version of that data.
+    - static(template): pages that only depend on their template, rendered
+      once per worker for SHELL_ROOT (see prerender) and served with the
+      request's site root substituted.
+
+    Nothing is cached while the visitor has flashed messages pending, as
+    rendering may consume and show them.
+    """
+
+    def __init__(self, max_size=200, expiry_time=3600):
+        self.pages = CacheManager(max_size=max_size, expiry_time=expiry_time, name='render')
+        self.static_pages = {}    # template -> (path, context)
+        self.shells = {}          # (template, year) -> output for SHELL_ROOT
+
+    def start(self):
+        """Start the LRU's cleanup thread (call once per worker process, after fork)"""
+        self.pages.start()
+
+    def render(self, key, render):
+        """Cached output of render() for the request URL and key"""
+        if flashes_pending():
+            return render()
+        key = (request.url, *key)
+        page = self.pages.get_cache(key)
+        if page is None:
+            page = render()
+            self.pages.add_to_cache(key, page)
+        return page
+
+    def add_static_page(self, path, template, **context):
+        """Register a page served at path that only depends on its template"""
+        self.static_pages[template] = (path, context)
+
+    def static(self, template):
+        """Output of a registered static page for the current request"""
+        path, context = self.static_pages[template]
+        year = time.strftime('%Y')
+        if request.query_string or request.script_root or flashes_pending():
+            # Query strings end up in the canonical URL and a script root in
+            # every link: cache per URL instead
+            return self.render((template, year), lambda: render_template(template, **context))
+        shell = self.shells.get((template, year))
+        if shell is None:
+            shell = self._render_shell(template, path, context)
+            self.shells[(template, year)] = shell
+        return shell.replace(SHELL_ROOT, str(escape(request.url_root)))
+
+    def _render_shell(self, template, path, context):
+        with span('render_template', template=template):
+            with current_app.test_request_context(path, base_url=SHELL_ROOT):
+                return render_template(template, **context)
+
+    def prerender(self, app, templates=()):
+        """Render the static pages and compile other templates ahead of the first request"""
+        started = time.perf_counter()
+        year = time.strftime('%Y')
+        with app.app_context():
+            for template, (path, context) in self.static_pages.items():
+                self.shells[(template, year)] = self._render_shell(template, path, context)
+            for template in templates:
+                app.jinja_env.get_template(template)
+        logger.info("Pre-rendered %s pages in %.1f ms", len(self.static_pages),
+                    (time.perf_counter() - started) * 1000)
@@ -0,0 +1,275 @@
+import os
+import re
+import time
+import logging
+import threading
+
+from upstream_governor import governor
+from http_client import get_session, DEFAULT_TIMEOUT
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+SEGMENT_SIZE = int(os.environ.get('UPSTREAM_SEGMENT_SIZE', 4 * 1024 * 1024))
+MIN_CONNECTIONS = int(os.environ.get('UPSTREAM_MIN_CONNECTIONS', 2))
+MAX_CONNECTIONS = int(os.environ.get('UPSTREAM_MAX_CONNECTIONS', 6))
+# Largest chunk handed to the WSGI server per iteration
+CHUNK_SIZE = int(os.environ.get('PROXY_CHUNK_SIZE', 1024 * 1024))
+
+class UpstreamError(Exception):
+    """Raised when a media stream or segment can't be fetched"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class SegmentedStream:
+    """A media stream fetched as byte ranges over several connections
+
+    googlevideo throttles each connection, so the stream is split into
+    segments fetched concurrently and yielded in order. At most `window`
+    segments are fetched ahead of the consumer, which bounds memory to
+    window * segment_size no matter how slowly the client reads.
+
+    The number of connections adapts: it grows while the consumer is
+    waiting on upstream and each added connection still raises the
+    throughput, and shrinks again when it stops helping or upstream
+    throttles.
+    """
+
+    def __init__(self, url, headers, total, first_response, segment_size,
+                 min_connections=2, max_connections=6, timeout=DEFAULT_TIMEOUT):
+        self.url = url
+        self.headers = headers
+        self.total = total
+        self.segment_size = segment_size
+        self.segments = (total + segment_size - 1) // segment_size
+        self.min_connections = min(min_connections, max_connections)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session = get_session()
+
+        self.target = self.min_connections
+        self.window = max_connections + 2
+        self.workers = 0
+        self.next_segment = 1    # segment 0 comes from first_response
+        self.next_yield = 0
+        self.results = {}        # segment index -> bytes or exception
+        self.closed = False
+        self.cond = threading.Condition()
+
+        # Throughput at each connection count, for the adaptation
+        self.rate_at = {}
+        self.window_started = time.monotonic()
+        self.window_bytes = 0
+        self.starved = False
+        self.peak_connections = self.target
+
+        self.first_response = first_response
+
+    def _range(self, index):
+        start = index * self.segment_size
+        return start, min(start + self.segment_size, self.total) - 1
+
+    def _fetch(self, index, attempts=3):
+        """Fetch one segment, retrying transient failures"""
+        start, end = self._range(index)
+        headers = dict(self.headers, Range=f"bytes={start}-{end}")
+        for attempt in range(attempts):
+            try:
+                response = self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout)
+                governor.observe_response(response)
+                if response.status_code != 206:
+                    response.close()
+                    if response.status_code in (403, 429):
+                        self._throttled()
+                    raise UpstreamError(f"Segment {index} answered with HTTP {response.status_code}",
+                                        response.status_code)
+                data = _read_segment(response, end - start + 1)
+                metrics.inc('upstream_segments_total', result='ok')
+                return data
+            except Exception as e:
+                metrics.inc('upstream_segments_total', result='retry' if attempt + 1 < attempts else 'failed')
+                if self.closed or attempt + 1 == attempts:
+                    raise UpstreamError(f"Segment {index} failed: {e}") from e
+                time.sleep(0.5 * (attempt + 1))
+
+    def _throttled(self):
+        with self.cond:
+            self.target = max(1, self.target // 2)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while (not self.closed and self.next_segment < self.segments and
+                       self.next_segment >= self.next_yield + self.window and
+                       self.workers <= self.target):
+                    self.cond.wait()
+                if self.closed or self.next_segment >= self.segments or self.workers > self.target:
+                    self.workers -= 1
+                    self.cond.notify_all()
+                    return
+                index = self.next_segment
+                self.next_segment += 1
+
+            try:
+                result = self._fetch(index)
+            except Exception as e:
+                result = e
+            with self.cond:
+                if not self.closed:
+                    self.results[index] = result
+                self.cond.notify_all()
+
+    def _spawn(self):
+        """Start workers up to the target connection count (cond held)"""
+        while self.workers < self.target and self.next_segment < self.segments:
+            self.workers += 1
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def _adapt(self, size):
+        """Adjust the connection target from the throughput of the last window (cond held)"""
+        self.window_bytes += size
+        elapsed = time.monotonic() - self.window_started
+        if elapsed < 1.0 or self.window_bytes < 4 * self.segment_size:
+            return
+        rate = self.window_bytes / elapsed
+        previous = self.rate_at.get(self.target - 1)
+        self.rate_at[self.target] = rate
+        if self.starved and self.target < self.max_connections and (previous is None or rate > previous * 1.1):
+            self.target += 1
+        elif previous is not None and rate < previous * 1.05 and self.target > self.min_connections:
+            # The last connection didn't help
+            self.target -= 1
+        self.peak_connections = max(self.peak_connections, self.target)
+        self.window_started = time.monotonic()
+        self.window_bytes = 0
+        self.starved = False
+
+    def __iter__(self):
+        with self.cond:
+            self._spawn()
+        try:
+            # The first segment streams while the others are being fetched
+            start, end = self._range(0)
+            received = 0
+            for chunk in iter_body(self.first_response):
+                received += len(chunk)
+                yield chunk
+            if received != end - start + 1:
+                raise UpstreamError(f"Connection closed after {received} of {end - start + 1} bytes")
+            with self.cond:
+                self.next_yield = 1
+                self.cond.notify_all()
+
+            for index in range(1, self.segments):
+                with self.cond:
+                    if index not in self.results:
+                        self.starved = True
+                    while index not in self.results:
+                        self.cond.wait()
+                    result = self.results.pop(index)
+                    self.next_yield = index + 1
+                    if isinstance(result, Exception):
+                        raise result
+                    self._adapt(len(result))
+                    self._spawn()
+                    self.cond.notify_all()
+                yield result
+        finally:
+            self.close()
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.results.clear()
+            self.cond.notify_all()
+        self.first_response.close()
+        metrics.observe('segmented_fetch_connections', self.peak_connections)
+
+def _read_segment(response, size):
+    """Read a whole segment with one read, straight into the bytes that get yielded"""
+    try:
+        data = response.raw.read(size)
+    finally:
+        response.close()
+    if len(data) != size:
+        raise UpstreamError(f"Connection closed after {len(data)} of {size} bytes")
+    return data
+
+def iter_body(response, chunk_size=None):
+    """Yield a streamed response body in large chunks
+
+    read1() returns what has arrived, up to chunk_size, as one bytes object
+    that goes to the WSGI server unchanged. Unlike iter_content() it
+    doesn't wait for a full chunk, so large chunks cost no latency, and a
+    1 MiB chunk means ~1000 iterations per GB instead of ~250000 at 4 KiB.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    read1 = getattr(response.raw, 'read1', None)
+    if read1 is None:
+        # urllib3 < 2
+        yield from response.iter_content(chunk_size=chunk_size)
+        return
+    while True:
+        chunk = read1(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+class UpstreamStream:
+    """Response of open_stream: status, headers and an iterator over the body"""
+
+    def __init__(self, status_code, headers, length, chunks, close):
+        self.status_code = status_code
+        self.headers = headers
+        self.length = length
+        self.chunks = chunks
+        self.close = close
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+def open_stream(url, headers, segment_size=None, min_connections=None, max_connections=None,
+                chunk_size=None, timeout=DEFAULT_TIMEOUT):
+    """Open a media URL for proxying, segmented when it's large enough
+
+    The first request asks for the first segment; when the server answers
+    206 with the total length and the file is bigger than one segment, the
+    rest is fetched by a SegmentedStream. Otherwise the single response is
+    streamed as is. Raises UpstreamError when the server answers with an
+    error status (e.g. 403 for an expired URL).
+    """
+    segment_size = segment_size or SEGMENT_SIZE
+    max_connections = max_connections or MAX_CONNECTIONS
+    session = get_session()
+
+    first_headers = headers
+    if max_connections > 1:
+        first_headers = dict(headers, Range=f"bytes=0-{segment_size - 1}")
+    response = governor.fetch(session.get, url, headers=first_headers, stream=True, timeout=timeout)
+    if response.status_code >= 400:
+        response.close()
+        raise UpstreamError(f"Upstream answered with HTTP {response.status_code}", response.status_code)
+
+    match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+    total = int(match.group(3)) if response.status_code == 206 and match else None
+
+    if total is not None and total > segment_size and max_connections > 1:
+        stream = SegmentedStream(url, headers, total, response, segment_size,
+                                 min_connections=min_connections or MIN_CONNECTIONS,
+                                 max_connections=max_connections, timeout=timeout)
+        return UpstreamStream(200, response.headers, total, stream, stream.close)
+
+    if total is not None and total <= segment_size:
+        # The first segment is the whole file
+        return UpstreamStream(200, response.headers, total,
+                              iter_body(response, chunk_size), response.close)
+
+    length = response.headers.get('Content-Length')
+    return UpstreamStream(response.status_code, response.headers, int(length) if length else None,
+                          iter_body(response, chunk_size), response.close)
@@ -183,17 +183,12 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show loader
         videoLoader.style.display = 'block';
 
-        // Fetch video info from server
-        const formData = new FormData();
-        formData.append('url', youtubeUrl);
-
-        fetch('/video_info', {
-            method: 'POST',
+        // Fetch video info from server (a GET, so browsers and the CDN can cache it)
+        fetch('/video_info?url=' + encodeURIComponent(youtubeUrl), {
             headers: {
                 'X-Requested-With': 'XMLHttpRequest',
                 'Accept': 'application/json'
-            },
-            body: formData
+            }
         })
         .then(response => {
             if (!response.ok) {
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# The app reads its configuration at import time
+_workdir = tempfile.mkdtemp(prefix='ytdl-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(_workdir, 'test.db')}",
+    'METRICS_DIR': os.path.join(_workdir, 'metrics'),
+    'DOWNLOAD_SLOT_DIR': os.path.join(_workdir, 'slots'),
+    'EGRESS_DIR': os.path.join(_workdir, 'egress'),
+    'GOVERNOR_DIR': os.path.join(_workdir, 'governor'),
+    'COOKIE_REFRESHER': '0',
+    'ADMIN_TOKEN': 'test-admin-token',
+    'LOG_LEVEL': 'WARNING',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,27 @@
+import pytest
+
+import app as app_module
+
+ADMIN_PAGES = ['/admin', '/admin/traces', '/admin/upstream', '/admin/admission', '/admin/egress']
+
+
+@pytest.fixture
+def client():
+    app_module.init_database()
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize('path', ADMIN_PAGES)
+def test_admin_pages_require_the_token(client, path):
+    response = client.get(path)
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Basic realm="admin"'
+
+    response = client.get(path, headers={'Authorization': 'Bearer wrong'})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize('path', ADMIN_PAGES)
+def test_admin_pages_with_the_token(client, path):
+    response = client.get(path, headers={'Authorization': 'Bearer test-admin-token'})
+    assert response.status_code == 200
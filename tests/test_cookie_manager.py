@@ -0,0 +1,28 @@
+import threading
+import time
+
+import cookie_manager
+
+
+def test_concurrent_stale_checks_refresh_once(monkeypatch, tmp_path):
+    cookie_file = tmp_path / 'cookies.txt'
+    monkeypatch.setattr(cookie_manager, 'COOKIE_FILE', str(cookie_file))
+    calls = []
+
+    def refresh_cookies():
+        calls.append(1)
+        time.sleep(0.2)
+        cookie_file.write_text("# Netscape HTTP Cookie File\n")
+        return True
+
+    monkeypatch.setattr(cookie_manager, 'refresh_cookies', refresh_cookies)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cookie_manager.ensure_fresh_cookies()))
+               for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [True] * 20
+    assert len(calls) == 1
@@ -0,0 +1,62 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+from cache_manager import CacheManager
+from models import db, Video
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+URL = f"https://youtu.be/{VIDEO_ID}"
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """Replace extraction with a counter returning fresh info"""
+    app_module.init_database()
+    app_module.cache_manager.clear_cache()
+    calls = []
+
+    def get_yt_info(url):
+        calls.append(url)
+        return {'title': 'Fresh', 'video_formats': [], 'audio_formats': []}
+
+    monkeypatch.setattr(app_module, 'get_yt_info', get_yt_info)
+    with app_module.app.app_context():
+        Video.query.delete()
+        db.session.commit()
+        yield calls
+
+
+def store_catalog_info(age_seconds):
+    Video.store_info(VIDEO_ID, {'title': 'Old', 'video_formats': [], 'audio_formats': []})
+    video = db.session.get(Video, VIDEO_ID)
+    video.updated_at = datetime.utcnow() - timedelta(seconds=age_seconds)
+    db.session.commit()
+
+
+def test_memory_entry_past_hard_ttl_is_a_miss():
+    cache = CacheManager(expiry_time=3600, soft_ttl=900)
+    cache.add_to_cache('key', 'value', stored_at=time.time() - 7200)
+    assert cache.get_cache('key') is None
+
+
+def test_catalog_entry_past_hard_ttl_is_fetched_blocking(extractions):
+    store_catalog_info(2 * 3600)
+
+    for _ in range(3):
+        assert app_module.fetch_video_info(URL)['title'] == 'Fresh'
+    assert len(extractions) == 1
+    assert not app_module.cache_manager.refreshing
+
+
+def test_catalog_entry_past_soft_ttl_is_served_and_refreshed(extractions):
+    store_catalog_info(1200)
+
+    assert app_module.fetch_video_info(URL)['title'] == 'Old'
+    deadline = time.time() + 5
+    while app_module.cache_manager.refreshing and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(extractions) == 1
+    assert app_module.fetch_video_info(URL)['title'] == 'Fresh'
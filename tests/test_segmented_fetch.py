@@ -0,0 +1,33 @@
+import pytest
+
+import segmented_fetch
+from segmented_fetch import UpstreamError, open_stream
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {'Content-Type': 'text/plain', 'Content-Length': '9'}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, status_code):
+        self.response = FakeResponse(status_code)
+
+    def get(self, url, **kwargs):
+        return self.response
+
+
+@pytest.mark.parametrize('status_code', [403, 404, 500])
+def test_error_status_raises(monkeypatch, status_code):
+    session = FakeSession(status_code)
+    monkeypatch.setattr(segmented_fetch, 'get_session', lambda: session)
+
+    with pytest.raises(UpstreamError) as error:
+        open_stream('https://example.googlevideo.com/videoplayback', {})
+    assert error.value.status_code == status_code
+    assert session.response.closed
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from metrics import MetricsRegistry
+from upstream_governor import UpstreamGovernor, is_throttle_error
+
+
+@pytest.fixture
+def governor(tmp_path):
+    return UpstreamGovernor(directory=str(tmp_path))
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Count state files written by the governor"""
+    calls = []
+    replace = os.replace
+
+    def counting_replace(src, dst):
+        calls.append(dst)
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', counting_replace)
+    return calls
+
+
+@pytest.mark.parametrize('message', [
+    'ERROR: [youtube] abc: Unable to download webpage: HTTP Error 429: Too Many Requests',
+    '429 Client Error: Too Many Requests for url: https://www.youtube.com/',
+    "Sign in to confirm you're not a bot",
+    'The current session has been rate-limited by YouTube',
+])
+def test_throttle_errors(message):
+    assert is_throttle_error(Exception(message))
+
+
+@pytest.mark.parametrize('message', [
+    'ERROR: [youtube] x429abcdefg: Video unavailable',
+    'Got 14290 bytes, expected 20000',
+    'Unsupported sample rate, limit is 48000',
+])
+def test_other_errors(message):
+    assert not is_throttle_error(Exception(message))
+
+
+def test_steady_successes_and_snapshots_do_not_write(governor, writes):
+    governor.record_throttled()
+    for _ in range(50):
+        governor.record_success()
+    writes.clear()
+
+    for _ in range(10):
+        governor.record_success()
+        governor.snapshot()
+    assert writes == []
+
+    governor.record_throttled()
+    assert len(writes) == 1
+
+
+def test_governor_gauges_are_reported_once_per_node(tmp_path):
+    registry = MetricsRegistry(directory=str(tmp_path))
+    registry.describe('upstream_governor_events', 'gauge', 'Events')
+    registry.register_collector(lambda: [('upstream_governor_events', {'event': 'calls'}, 7)],
+                                node_wide=True)
+
+    assert 'upstream_governor_events{event="calls"} 7' in registry.export().splitlines()
@@ -0,0 +1,223 @@
+import io
+import os
+import time
+import heapq
+import pstats
+import random
+import cProfile
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import ContextDecorator
+
+logger = logging.getLogger(__name__)
+
+# Span currently open in this request (None when the request isn't traced)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """A timed stage of a request; spans nest to form the request's tree"""
+
+    __slots__ = ('name', 'attrs', 'start', 'end', 'children', 'error')
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self):
+        """JSON friendly representation of the span tree"""
+        return {
+            'name': self.name,
+            'attrs': self.attrs,
+            'ms': round(self.duration * 1000, 2),
+            'error': self.error,
+            'children': [child.to_dict() for child in self.children],
+        }
+
+    def format_tree(self, indent=0):
+        """Indented text rendering of the span tree"""
+        attrs = ' '.join(f"{k}={v}" for k, v in self.attrs.items())
+        line = f"{'  ' * indent}{self.name} {self.duration * 1000:.1f} ms"
+        if attrs:
+            line += f" [{attrs}]"
+        if self.error:
+            line += f" ERROR: {self.error}"
+        lines = [line]
+        for child in self.children:
+            lines.append(child.format_tree(indent + 1))
+        return "\n".join(lines)
+
+class _SpanContext(ContextDecorator):
+    """Context manager / decorator opening a child span of the current span"""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.span = None
+        self.token = None
+
+    def _recreate_cm(self):
+        return _SpanContext(self.name, self.attrs)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is None:
+            return None  # Request not traced, nothing to record
+        self.span = Span(self.name, dict(self.attrs))
+        parent.children.append(self.span)
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is not None:
+            self.span.end = time.perf_counter()
+            if exc is not None:
+                self.span.error = f"{exc_type.__name__}: {str(exc)[:200]}"
+            _current_span.reset(self.token)
+        return False
+
+def span(name, **attrs):
+    """Trace a stage of the current request (no-op when it isn't traced)"""
+    return _SpanContext(name, attrs)
+
+class SlowTraceBuffer:
+    """Keeps the span trees of the slowest requests seen within a time window"""
+
+    def __init__(self, capacity=20, window=3600):
+        self.capacity = capacity
+        self.window = window
+        self.entries = []  # min-heap of (duration, sequence, recorded_at, trace dict)
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def add(self, root, path):
+        """Consider a finished request for the buffer"""
+        duration = root.duration
+        with self.lock:
+            self._expire()
+            if len(self.entries) >= self.capacity and duration <= self.entries[0][0]:
+                return
+            self.sequence += 1
+            trace = {
+                'path': path,
+                'ms': round(duration * 1000, 2),
+                'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'tree': root.format_tree(),
+            }
+            entry = (duration, self.sequence, time.time(), trace)
+            if len(self.entries) >= self.capacity:
+                heapq.heapreplace(self.entries, entry)
+            else:
+                heapq.heappush(self.entries, entry)
+
+    def _expire(self):
+        """Drop entries older than the window (lock held)"""
+        cutoff = time.time() - self.window
+        if any(entry[2] < cutoff for entry in self.entries):
+            self.entries = [entry for entry in self.entries if entry[2] >= cutoff]
+            heapq.heapify(self.entries)
+
+    def slowest(self):
+        """Traces sorted slowest first"""
+        with self.lock:
+            self._expire()
+            return [entry[3] for entry in sorted(self.entries, reverse=True)]
+
+class RequestTracer:
+    """Request level tracing with sampling and an on-demand profiler
+
+    A sampled request gets a root span; the slowest traces are kept in a
+    SlowTraceBuffer. A request is profiled with cProfile when it carries the
+    X-Profile header with the configured token, or while the admin has
+    armed the profiler for the next N requests.
+    """
+
+    def __init__(self, sample_rate=1.0, slow_capacity=20, profile_token=None, profile_reports=10):
+        self.sample_rate = sample_rate
+        self.slow_traces = SlowTraceBuffer(slow_capacity)
+        self.profile_token = profile_token
+        self.profile_reports = deque(maxlen=profile_reports)
+        self.profile_budget = 0      # Requests left to profile, armed from /admin
+        self.profile_lock = threading.Lock()
+        self.lock = threading.Lock()
+
+    def start(self, name):
+        """Start tracing a request; returns a state object for finish()
+
+        The current span is always (re)set, so an unsampled request never
+        attaches spans to a previous request's tree.
+        """
+        root = None
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            root = Span(name)
+        return {'root': root, 'token': _current_span.set(root), 'profiler': None}
+
+    def arm_profiler(self, count):
+        """Profile the next count requests"""
+        with self.lock:
+            self.profile_budget = max(0, count)
+
+    def should_profile(self, header_value):
+        """Whether the current request should be profiled"""
+        if self.profile_token and header_value == self.profile_token:
+            return True
+        with self.lock:
+            if self.profile_budget > 0:
+                self.profile_budget -= 1
+                return True
+        return False
+
+    def start_profiler(self, state):
+        """Start cProfile for this request (one profiled request at a time)"""
+        if not self.profile_lock.acquire(blocking=False):
+            logger.info("Profiler busy, request not profiled")
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        state['profiler'] = profiler
+
+    def finish(self, state, path, status=None):
+        """Finish the request's trace and profile, recording them"""
+        if not state:
+            return
+
+        profiler = state.get('profiler')
+        if profiler is not None:
+            profiler.disable()
+            self.profile_lock.release()
+            self._store_profile(profiler, path)
+
+        _current_span.reset(state['token'])
+        root = state.get('root')
+        if root is not None:
+            root.end = time.perf_counter()
+            if status is not None:
+                root.attrs['status'] = status
+            self.slow_traces.add(root, path)
+
+    def _store_profile(self, profiler, path):
+        """Keep a text report of a profiled request"""
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats('cumulative').print_stats(40)
+        self.profile_reports.appendleft({
+            'path': path,
+            'pid': os.getpid(),
+            'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'report': output.getvalue(),
+        })
+
+tracer = RequestTracer(
+    sample_rate=float(os.environ.get('TRACE_SAMPLE_RATE', 1.0)),
+    slow_capacity=int(os.environ.get('TRACE_SLOW_CAPACITY', 20)),
+    profile_token=os.environ.get('PROFILE_TOKEN'),
+)
@@ -0,0 +1,459 @@
+import os
+import time
+import fcntl
+import heapq
+import shutil
+import hashlib
+import logging
+import select
+import resource
+import tempfile
+import itertools
+import threading
+import subprocess
+
+from admission import NodeSlots
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Job priorities, lower runs first
+INTERACTIVE = 0
+BATCH = 1
+
+# Bytes per read of FFmpeg output, and the stdout pipe size that lets a read get that much
+CHUNK_SIZE = 1024 * 1024
+
+BROWSER_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                      '(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36')
+
+class TranscodeError(Exception):
+    """Raised when a transcode cannot be queued, fails or times out"""
+
+def input_args(source):
+    """FFmpeg arguments reading source, a URL or a path"""
+    args = []
+    if source.startswith(('http://', 'https://')):
+        args += ['-user_agent', BROWSER_USER_AGENT,
+                 '-headers', 'Referer: https://www.youtube.com/\r\n',
+                 '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+    return args + ['-i', source]
+
+def audio_args(source, codec='mp3', quality='192'):
+    """FFmpeg arguments converting the audio of source (URL or path) to codec"""
+    args = input_args(source) + ['-vn']
+    if codec == 'mp3':
+        args += ['-c:a', 'libmp3lame', '-b:a', f"{quality}k", '-f', 'mp3']
+    else:
+        raise ValueError(f"Unsupported audio codec: {codec}")
+    return args
+
+def mux_args(video_source, audio_source):
+    """FFmpeg arguments muxing separate video and audio streams into fragmented MP4
+
+    Both streams are copied, not re-encoded. A fragmented MP4 (moov first,
+    then self-contained fragments) can be written to a pipe and played
+    while it downloads.
+    """
+    return [*input_args(video_source), *input_args(audio_source),
+            '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy',
+            '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof', 'pipe:1']
+
+class FFmpegStream:
+    """FFmpeg writing to stdout, read as fast as the client consumes it
+
+    Memory stays bounded by the pipe buffer and one chunk: when the client
+    reads slowly, FFmpeg blocks on the pipe and stops fetching its inputs.
+    Nothing is staged on disk.
+    """
+
+    def __init__(self, pool, process, chunk_size=CHUNK_SIZE):
+        self.pool = pool
+        self.process = process
+        self.chunk_size = chunk_size
+        self.first = None
+        self.closed = False
+
+    def wait_for_output(self, timeout):
+        """Read the first chunk; raises TranscodeError if none arrives in time"""
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if ready:
+            self.first = self.process.stdout.read1(self.chunk_size)
+        if not self.first:
+            self.close()
+            metrics.inc('ffmpeg_streams_total', result='failed')
+            raise TranscodeError("Could not combine the video and audio streams")
+
+    def __iter__(self):
+        if self.first:
+            first, self.first = self.first, None
+            yield first
+        while True:
+            chunk = self.process.stdout.read1(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        returncode = self.process.wait()
+        metrics.inc('ffmpeg_streams_total', result='finished' if returncode == 0 else 'failed')
+        if returncode != 0:
+            logger.warning("FFmpeg stream exited with %s", returncode)
+
+    def close(self):
+        """Stop FFmpeg (the client went away or the response is done)"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+        with self.pool.lock:
+            self.pool.streaming -= 1
+
+class TranscodeJob:
+    """One FFmpeg run whose output can be streamed while it is written
+
+    Identical requests share a job (see TranscodePool.submit); every reader
+    holds a reference and the output file is removed when the last one is
+    released.
+    """
+
+    def __init__(self, key, args, output_path, priority, keep=False):
+        self.key = key
+        self.args = args
+        self.output_path = output_path
+        self.priority = priority
+        self.keep = keep
+        self.state = 'queued'  # queued, running, finished, failed, cancelled
+        self.cancelled = False # all readers left while running
+        self.error = None
+        self.readers = 1
+        self.process = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.done = threading.Event()
+
+    def wait_for_output(self, timeout):
+        """Wait until FFmpeg wrote its first bytes; raises TranscodeError on failure"""
+        deadline = time.monotonic() + timeout
+        while not self.done.is_set():
+            try:
+                if os.path.getsize(self.output_path) > 0:
+                    return
+            except OSError:
+                pass
+            if time.monotonic() >= deadline:
+                raise TranscodeError("Timed out waiting for the transcode to start")
+            self.done.wait(0.1)
+        if self.state != 'finished':
+            raise TranscodeError(self.error or "Transcode failed")
+
+    def wait(self, timeout=None):
+        """Wait until the job is done; raises TranscodeError unless it finished"""
+        if not self.done.wait(timeout):
+            raise TranscodeError("Timed out waiting for the transcode")
+        if self.state != 'finished':
+            raise TranscodeError(self.error or "Transcode failed")
+
+    def stream(self, chunk_size=CHUNK_SIZE, poll=0.1):
+        """Yield the output as it is written until the job is done"""
+        f = None
+        try:
+            while f is None:
+                try:
+                    # Unbuffered: each read lands directly in the bytes that are yielded
+                    f = open(self.output_path, 'rb', buffering=0)
+                except FileNotFoundError:
+                    if self.done.is_set():
+                        raise TranscodeError(self.error or "Transcode failed")
+                    self.done.wait(poll)
+
+            while True:
+                # Check done before reading so the last read sees all output
+                finished = self.done.is_set()
+                chunk = f.read(chunk_size)
+                if chunk:
+                    yield chunk
+                elif finished:
+                    if self.state != 'finished':
+                        raise TranscodeError(self.error or "Transcode failed")
+                    return
+                else:
+                    self.done.wait(poll)
+        finally:
+            if f is not None:
+                f.close()
+
+class TranscodePool:
+    """Runs FFmpeg jobs off the request path
+
+    - At most `workers` FFmpeg processes run per node (by default one per
+      CPU), shared by all worker processes through flock slots.
+    - Jobs wait in a priority queue: interactive requests before batch work.
+      The queue is per worker process; between processes, slots go to
+      whichever dispatcher polls first when one frees, regardless of
+      priority. Every caller submits interactive jobs today.
+    - FFmpeg runs niced, with a CPU time limit (RLIMIT_CPU) and a wall
+      clock limit after which it is killed.
+    - Identical jobs (same key, e.g. video, codec and quality) in flight
+      are deduplicated: later requests attach to the running job and
+      stream the same output.
+    """
+
+    def __init__(self, workers=None, max_queue=64, cpu_limit=300, time_limit=600, nice=10,
+                 directory=None, ffmpeg=None):
+        self.workers = workers or _cpu_count()
+        self.max_queue = max_queue
+        self.cpu_limit = cpu_limit
+        self.time_limit = time_limit
+        self.nice = nice
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ytdl-transcodes')
+        self.ffmpeg = ffmpeg or shutil.which('ffmpeg')
+        self.node_slots = NodeSlots(os.path.join(self.directory, 'slots'), self.workers)
+
+        self.queue = []   # heap of (priority, sequence, job)
+        self.jobs = {}    # key -> job in flight
+        self.running = 0
+        self.streaming = 0
+        self.counters = {'submitted': 0, 'deduplicated': 0, 'finished': 0,
+                         'failed': 0, 'cancelled': 0, 'rejected': 0}
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.threads = []
+        self.pid = None
+
+    def available(self):
+        """Whether an FFmpeg binary was found"""
+        return self.ffmpeg is not None
+
+    def start(self):
+        """Start the dispatcher threads (call once per worker process, after fork)"""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.threads = [threading.Thread(target=self._dispatch, daemon=True)
+                            for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, args, priority=INTERACTIVE, suffix='.mp3', output_path=None):
+        """Queue a job, or join the identical one in flight
+
+        Returns a TranscodeJob holding one reader reference, which the
+        caller must give back with release(). With output_path the result
+        is written there and kept; otherwise it goes to a temporary file.
+        """
+        if not self.available():
+            raise TranscodeError("FFmpeg is not available on this server")
+        self.start()
+
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None and job.state in ('queued', 'running') and not job.cancelled:
+                job.readers += 1
+                self.counters['deduplicated'] += 1
+                metrics.inc('transcode_jobs_total', result='deduplicated')
+                return job
+
+            if len(self.queue) >= self.max_queue:
+                self.counters['rejected'] += 1
+                metrics.inc('transcode_jobs_total', result='rejected')
+                raise TranscodeError("Too many conversions in progress, please try again shortly")
+
+            keep = output_path is not None
+            if output_path is None:
+                os.makedirs(self.directory, exist_ok=True)
+                digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+                output_path = os.path.join(self.directory,
+                                           f"{digest}-{os.getpid()}-{next(self.sequence)}{suffix}")
+
+            job = TranscodeJob(key, args, output_path, priority, keep=keep)
+            self.jobs[key] = job
+            heapq.heappush(self.queue, (priority, next(self.sequence), job))
+            self.counters['submitted'] += 1
+            self.wakeup.notify()
+            return job
+
+    def open_stream(self, args):
+        """Start an FFmpeg process writing to stdout, see FFmpegStream
+
+        Stream copies (muxing) take little CPU, so they don't wait for a
+        transcode slot; the download admission control bounds them.
+        """
+        if not self.available():
+            raise TranscodeError("FFmpeg is not available on this server")
+        process = subprocess.Popen([self.ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error', *args],
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+        self._limit(process.pid)
+        try:
+            fcntl.fcntl(process.stdout, fcntl.F_SETPIPE_SZ, CHUNK_SIZE)
+        except (AttributeError, OSError):
+            # Older Python or above /proc/sys/fs/pipe-max-size: keep the default 64 KiB
+            pass
+        with self.lock:
+            self.streaming += 1
+        return FFmpegStream(self, process)
+
+    def release(self, job):
+        """Drop a reader reference; the last one cancels unfinished work"""
+        with self.lock:
+            job.readers -= 1
+            if job.readers > 0:
+                return
+            if job.state == 'queued':
+                self._finish(job, 'cancelled', "Cancelled")
+            elif job.state == 'running':
+                # Nobody is waiting for the output any more. Before FFmpeg
+                # was started, _run sees the flag and doesn't start it.
+                job.cancelled = True
+                if job.process is not None:
+                    job.process.kill()
+        if job.done.is_set():
+            self._cleanup(job)
+
+    def _dispatch(self):
+        """Dispatcher thread: run queued jobs in priority order"""
+        while True:
+            with self.lock:
+                while not self.queue:
+                    self.wakeup.wait()
+                _, _, job = heapq.heappop(self.queue)
+                if job.state != 'queued':
+                    continue
+
+            slot = self._acquire_slot(job)
+            if slot is None:
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                logger.error("Transcode %s failed: %s", job.key, e)
+                with self.lock:
+                    self._finish(job, 'failed', str(e))
+            finally:
+                self.node_slots.release(slot)
+                with self.lock:
+                    self.running -= 1
+                if job.readers <= 0:
+                    self._cleanup(job)
+
+    def _acquire_slot(self, job):
+        """Wait for a node-wide FFmpeg slot; None if the job was cancelled meanwhile"""
+        while True:
+            fd = self.node_slots.try_acquire()
+            with self.lock:
+                if job.state != 'queued':
+                    if fd is not None:
+                        self.node_slots.release(fd)
+                    return None
+                if fd is not None:
+                    job.state = 'running'
+                    job.started = time.monotonic()
+                    self.running += 1
+                    return fd
+            time.sleep(0.05)
+
+    def _run(self, job):
+        """Run FFmpeg for a job under the CPU and time limits"""
+        metrics.observe('transcode_queue_seconds', job.started - job.submitted)
+        command = [self.ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error',
+                   *job.args, '-y', job.output_path]
+        with self.lock:
+            if job.cancelled:
+                self._finish(job, 'cancelled', "Cancelled")
+                return
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        with self.lock:
+            job.process = process
+            # Released while FFmpeg was starting
+            cancelled = job.cancelled
+        if cancelled:
+            process.kill()
+        self._limit(process.pid)
+
+        try:
+            _, stderr = process.communicate(timeout=self.time_limit)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            with self.lock:
+                self._finish(job, 'failed', "Conversion took too long")
+            logger.warning("Transcode %s killed after %ss", job.key, self.time_limit)
+            return
+
+        elapsed = time.monotonic() - job.started
+        with self.lock:
+            if job.cancelled:
+                self._finish(job, 'cancelled', "Cancelled")
+            elif process.returncode == 0:
+                self._finish(job, 'finished')
+                metrics.observe('transcode_seconds', elapsed)
+            else:
+                message = stderr.decode(errors='replace').strip().splitlines()
+                logger.warning("Transcode %s exited with %s: %s", job.key, process.returncode,
+                               message[-1] if message else '')
+                self._finish(job, 'failed', "Conversion failed")
+
+    def _limit(self, pid):
+        """Lower the priority of an FFmpeg process and cap its CPU time
+
+        Applied after spawning instead of in preexec_fn, which is not safe
+        in a threaded server.
+        """
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+            resource.prlimit(pid, resource.RLIMIT_CPU, (self.cpu_limit, self.cpu_limit + 5))
+        except (OSError, AttributeError) as e:
+            logger.debug("Could not limit transcode process %s: %s", pid, e)
+
+    def _finish(self, job, state, error=None):
+        """Mark a job done (lock held)"""
+        job.state = state
+        job.error = error
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+        self.counters[state] += 1
+        metrics.inc('transcode_jobs_total', result=state)
+        job.done.set()
+
+    def _cleanup(self, job):
+        """Remove the temporary output of a job nobody reads any more"""
+        if job.keep and job.state == 'finished':
+            return
+        try:
+            os.remove(job.output_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not remove transcode output %s: %s", job.output_path, e)
+
+    def snapshot(self):
+        """Current state for metrics and the admin page"""
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'available': self.available(),
+                'queued': len(self.queue),
+                'running': self.running,
+                'streaming': self.streaming,
+                **self.counters,
+            }
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+transcoder = TranscodePool(
+    workers=int(os.environ.get('TRANSCODE_WORKERS', 0)) or None,
+    max_queue=int(os.environ.get('TRANSCODE_MAX_QUEUE', 64)),
+    cpu_limit=int(os.environ.get('TRANSCODE_CPU_LIMIT', 300)),
+    time_limit=int(os.environ.get('TRANSCODE_TIME_LIMIT', 600)),
+    nice=int(os.environ.get('TRANSCODE_NICE', 10)),
+    directory=os.environ.get('TRANSCODE_DIR'),
+)
@@ -0,0 +1,297 @@
+import os
+import re
+import json
+import time
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Shared by the worker processes of a node: the governor state and its lock file
+GOVERNOR_DIR = os.environ.get("GOVERNOR_DIR", os.path.join(tempfile.gettempdir(), "ytdl-governor"))
+
+class UpstreamUnavailableError(Exception):
+    """Raised when a YouTube call is refused because the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__("YouTube rate limit exceeded. Please wait a moment and try again.")
+        self.retry_after = retry_after
+
+class UpstreamGovernor:
+    """Shared governor for every call this node makes to YouTube
+
+    - A token bucket limits the call rate of the node.
+    - The rate adapts AIMD style: it is halved whenever YouTube answers with a
+      429 or a bot check, and grows back additively while calls succeed.
+    - A circuit breaker opens after repeated throttling responses so callers
+      fail fast (and serve cached or negative results) instead of retrying
+      into the throttle. After the cool-down one trial call is let through,
+      and only its outcome closes or reopens the breaker.
+
+    The state lives in a JSON file in `directory`, read and updated under an
+    flock()ed lock file, so all worker processes of the node share one
+    bucket, rate and breaker.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, directory=GOVERNOR_DIR, max_rate=5.0, min_rate=0.2, burst=10,
+                 increase_step=0.1, failure_threshold=5, open_seconds=30, max_wait=10,
+                 trial_seconds=120):
+        """Initialize with rates in calls/second and breaker settings
+
+        A trial call that has not reported back after trial_seconds (its
+        worker died) no longer blocks the next one.
+        """
+        self.directory = directory
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.increase_step = increase_step
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_wait = max_wait
+        self.trial_seconds = trial_seconds
+
+        self.lock = threading.Lock()
+        self.lock_fd = None
+        self.lock_pid = None
+
+    @property
+    def state_path(self):
+        return os.path.join(self.directory, 'governor.json')
+
+    def _initial_state(self):
+        return {
+            'state': self.CLOSED,
+            'rate': self.max_rate,
+            'tokens': float(self.burst),
+            'last_refill': time.time(),
+            'consecutive_failures': 0,
+            'opened_at': 0.0,
+            'trial': None,          # ID of the half-open trial call in flight
+            'trial_started': 0.0,
+            'counters': {'calls': 0, 'throttled': 0, 'rejected': 0, 'circuit_opened': 0},
+        }
+
+    def _lock_file(self):
+        """This process's descriptor of the lock file
+
+        flock() locks belong to the open file, which a forked worker shares
+        with its parent, so every process opens its own.
+        """
+        if self.lock_pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self.lock_fd = os.open(os.path.join(self.directory, 'governor.lock'), os.O_CREAT | os.O_RDWR)
+            self.lock_pid = os.getpid()
+        return self.lock_fd
+
+    def _load(self):
+        """The node-wide state and the file content it was read from (None if missing)"""
+        try:
+            with open(self.state_path) as f:
+                content = f.read()
+            state = json.loads(content)
+        except FileNotFoundError:
+            return self._initial_state(), None
+        except (OSError, ValueError) as e:
+            logger.warning("Resetting unreadable upstream governor state: %s", e)
+            return self._initial_state(), None
+        # Settings may differ from those of the process that wrote it
+        state['rate'] = min(self.max_rate, max(self.min_rate, state['rate']))
+        return state, content
+
+    @contextmanager
+    def _shared(self):
+        """The node-wide state, locked for a read-modify-write and saved if changed"""
+        with self.lock:
+            fd = self._lock_file()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                state, content = self._load()
+                try:
+                    yield state
+                finally:
+                    new_content = json.dumps(state)
+                    if new_content != content:
+                        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                        with open(tmp_path, 'w') as f:
+                            f.write(new_content)
+                        os.replace(tmp_path, self.state_path)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _refill(self, state, now):
+        """Add tokens for the time elapsed since the last refill (state locked)"""
+        elapsed = max(0.0, now - state['last_refill'])
+        state['tokens'] = min(self.burst, state['tokens'] + elapsed * state['rate'])
+        state['last_refill'] = now
+
+    def _open(self, state, now):
+        """Open the breaker (state locked)"""
+        if state['state'] != self.OPEN:
+            state['counters']['circuit_opened'] += 1
+            logger.warning("Upstream circuit opened for %ss after %s throttled calls",
+                           self.open_seconds, state['consecutive_failures'])
+        state['state'] = self.OPEN
+        state['opened_at'] = now
+        state['trial'] = None
+
+    def acquire(self):
+        """Wait for permission to make one upstream call
+
+        Returns the ID of the trial call when the breaker is half-open (to
+        be passed to the record_* methods), else None. Raises
+        UpstreamUnavailableError if the breaker is open or the wait for a
+        token would exceed max_wait.
+        """
+        while True:
+            with self._shared() as state:
+                now = time.time()
+
+                if state['state'] == self.OPEN:
+                    remaining = self.open_seconds - (now - state['opened_at'])
+                    if remaining > 0:
+                        state['counters']['rejected'] += 1
+                        raise UpstreamUnavailableError(int(remaining) + 1)
+                    state['state'] = self.HALF_OPEN
+                    state['trial'] = None
+                    logger.info("Upstream circuit half-open, allowing a trial call")
+
+                if state['state'] == self.HALF_OPEN:
+                    if state['trial'] and now - state['trial_started'] < self.trial_seconds:
+                        state['counters']['rejected'] += 1
+                        raise UpstreamUnavailableError(1)
+                    state['trial'] = f"{os.getpid()}-{os.urandom(4).hex()}"
+                    state['trial_started'] = now
+                    state['counters']['calls'] += 1
+                    return state['trial']
+
+                self._refill(state, now)
+                if state['tokens'] >= 1:
+                    state['tokens'] -= 1
+                    state['counters']['calls'] += 1
+                    return None
+
+                wait = (1 - state['tokens']) / state['rate']
+                if wait > self.max_wait:
+                    state['counters']['rejected'] += 1
+                    raise UpstreamUnavailableError(int(wait) + 1)
+
+            time.sleep(wait)
+
+    def record_success(self, trial=None):
+        """Report a successful upstream call (trial: what acquire() returned)"""
+        if trial is None:
+            # Most successes change nothing: check without taking the lock.
+            # The file is replaced atomically, so an unlocked read is consistent.
+            state, _ = self._load()
+            if state['state'] != self.CLOSED or (
+                    state['consecutive_failures'] == 0 and state['rate'] >= self.max_rate):
+                return
+        with self._shared() as state:
+            if state['state'] == self.CLOSED:
+                state['consecutive_failures'] = 0
+                state['rate'] = min(self.max_rate, state['rate'] + self.increase_step)
+            elif trial is not None and trial == state['trial']:
+                state['state'] = self.CLOSED
+                state['consecutive_failures'] = 0
+                state['trial'] = None
+                logger.info("Upstream circuit closed")
+
+    def record_throttled(self, trial=None):
+        """Report a 429 / bot-check response from YouTube"""
+        with self._shared() as state:
+            state['counters']['throttled'] += 1
+            state['consecutive_failures'] += 1
+            state['rate'] = max(self.min_rate, state['rate'] / 2)
+
+            if state['state'] == self.CLOSED:
+                if state['consecutive_failures'] >= self.failure_threshold:
+                    self._open(state, time.time())
+            elif trial is not None and trial == state['trial']:
+                self._open(state, time.time())
+
+    def record_error(self, trial=None):
+        """Report a failure unrelated to throttling (frees a half-open trial)"""
+        with self._shared() as state:
+            if trial is not None and trial == state['trial']:
+                state['trial'] = None
+
+    def call(self, func, *args, **kwargs):
+        """Run func under the governor, classifying its outcome
+
+        An exception counts as throttling when is_throttle_error() matches it.
+        """
+        trial = self.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_throttle_error(e):
+                self.record_throttled(trial)
+            else:
+                self.record_error(trial)
+            raise
+        self.record_success(trial)
+        return result
+
+    def fetch(self, func, *args, **kwargs):
+        """Run an HTTP call (e.g. requests.get) under the governor
+
+        The response status decides whether the call counted as throttled.
+        """
+        trial = self.acquire()
+        try:
+            response = func(*args, **kwargs)
+        except Exception:
+            self.record_error(trial)
+            raise
+        return self.observe_response(response, trial)
+
+    def observe_response(self, response, trial=None):
+        """Feed a requests response into the governor and return it
+
+        Responses to requests that were not admitted by acquire() (e.g. the
+        further segments of a download) adjust the rate but never take a
+        half-open breaker's trial.
+        """
+        if response.status_code == 429 or (
+                response.status_code in (302, 303) and
+                'google.com/sorry' in response.headers.get('Location', '')):
+            self.record_throttled(trial)
+        else:
+            self.record_success(trial)
+        return response
+
+    def snapshot(self):
+        """Return the current state for metrics and the admin page (read-only)"""
+        state, _ = self._load()
+        self._refill(state, time.time())
+        return dict(state['counters'],
+                    state=state['state'],
+                    rate=round(state['rate'], 3),
+                    tokens=round(state['tokens'], 2),
+                    consecutive_failures=state['consecutive_failures'])
+
+# HTTP 429 as yt-dlp and requests report it; a bare '429' may be part of a
+# video ID or a byte count
+_THROTTLE_PATTERN = re.compile(
+    r"\bhttp error 429\b|\b429 too many requests\b|\bstatus(?: code)?:? 429\b|"
+    r"too many requests|not a bot|rate limit exceeded|rate-limited")
+
+def is_throttle_error(error):
+    """Whether an error message indicates YouTube throttling or a bot check"""
+    return _THROTTLE_PATTERN.search(str(error).lower()) is not None
+
+# Node-wide governor (see GOVERNOR_DIR) used by all modules talking to YouTube
+governor = UpstreamGovernor(
+    max_rate=float(os.environ.get('UPSTREAM_MAX_RATE', 5)),
+    burst=int(os.environ.get('UPSTREAM_BURST', 10)),
+    failure_threshold=int(os.environ.get('UPSTREAM_FAILURE_THRESHOLD', 5)),
+    open_seconds=int(os.environ.get('UPSTREAM_OPEN_SECONDS', 30)),
+)
@@ -1,63 +1,147 @@
 import logging
 import os
 import re
-import time
-import random
 import urllib.parse
 import json
-import requests
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlsplit, unquote_plus
+from collections import namedtuple
+from functools import lru_cache
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hosts serving YouTube videos, mapped to the kind of host
+HOST_KINDS = {
+    'youtube.com': 'youtube',
+    'www.youtube.com': 'youtube',
+    'm.youtube.com': 'mobile',
+    'music.youtube.com': 'music',
+    'youtu.be': 'short_link',
+    'www.youtu.be': 'short_link',
+    'youtube-nocookie.com': 'nocookie',
+    'www.youtube-nocookie.com': 'nocookie',
+}
+
+_VIDEO_ID_RE = re.compile(r'[0-9A-Za-z_-]{11}')
+_PLAYLIST_ID_RE = re.compile(r'[0-9A-Za-z_-]{2,64}')
+# Paths carrying the video ID: /embed/ID, /v/ID, /e/ID, /shorts/ID, /live/ID
+_PATH_VIDEO_RE = re.compile(r'/(?:embed|v|e|shorts|live)/([0-9A-Za-z_-]{11})(?:/|$)')
+_TIMESTAMP_RE = re.compile(r'(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s?)?')
+# Query parameters parse_youtube_url reads
+_QUERY_KEYS = frozenset(('v', 'list', 't', 'start'))
+
+class YouTubeURL(namedtuple('YouTubeURL', 'video_id playlist_id timestamp host_kind')):
+    """Normalised parts of a YouTube URL (fields are None when absent)"""
+
+    __slots__ = ()
+
+    @property
+    def is_youtube(self):
+        return self.host_kind is not None
+
+    @property
+    def is_playlist(self):
+        return self.playlist_id is not None
+
+NOT_YOUTUBE = YouTubeURL(None, None, None, None)
+
+@lru_cache(maxsize=4096)
+def parse_youtube_url(url):
+    """Parse a YouTube URL in a single pass
+
+    Only URLs on YouTube hosts yield IDs, so arbitrary URLs (including
+    googlevideo.com stream URLs) whose path happens to contain 11 ID-like
+    characters are no longer mistaken for videos. Results are memoised,
+    the same URL is usually parsed several times per request.
+    """
+    if not url or not isinstance(url, str):
+        return NOT_YOUTUBE
+
+    url = url.strip()
+    if '://' not in url:
+        url = 'https://' + url
+    try:
+        parts = urlsplit(url)
+        # The netloc is usually just the host; .hostname handles ports and user info
+        host_kind = HOST_KINDS.get(parts.netloc.lower()) or HOST_KINDS.get((parts.hostname or '').lower())
+    except ValueError:
+        return NOT_YOUTUBE
+
+    if host_kind is None:
+        return NOT_YOUTUBE
+
+    query = _query_params(parts.query)
+
+    video_id = None
+    path = parts.path
+    if host_kind == 'short_link':
+        candidate = path.strip('/').split('/', 1)[0]
+        if _VIDEO_ID_RE.fullmatch(candidate):
+            video_id = candidate
+    else:
+        candidate = query.get('v')
+        if candidate and _VIDEO_ID_RE.fullmatch(candidate):
+            video_id = candidate
+        else:
+            match = _PATH_VIDEO_RE.match(path)
+            if match:
+                video_id = match.group(1)
+
+    playlist_id = query.get('list')
+    if playlist_id and not _PLAYLIST_ID_RE.fullmatch(playlist_id):
+        playlist_id = None
+
+    return YouTubeURL(video_id, playlist_id, _parse_timestamp(query.get('t') or query.get('start')),
+                      host_kind)
+
+def _query_params(query):
+    """First value of each parameter in _QUERY_KEYS
+
+    Same results as parse_qsl() for those keys, but the other parameters
+    (si, pp, utm_*, ...) are skipped without unquoting them, which is most
+    of the cost of parsing a shared link.
+    """
+    params = {}
+    for field in query.split('&'):
+        key, _, value = field.partition('=')
+        if not value:
+            continue
+        if '%' in key or '+' in key:
+            key = unquote_plus(key)
+        if key in _QUERY_KEYS and key not in params:
+            params[key] = unquote_plus(value) if '%' in value or '+' in value else value
+    return params
+
+def _parse_timestamp(value):
+    """Seconds from a t=/start= value such as 90, 90s or 1h2m3s"""
+    if not value:
+        return None
+    match = _TIMESTAMP_RE.fullmatch(value)
+    if not match or not any(match.groups()):
+        return None
+    hours, minutes, seconds = (int(group or 0) for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
 def clean_youtube_url(url):
     """
     Clean up YouTube URL to its simplest form (remove query params except video ID)
     """
     if not url:
         return url
-    
-    # Parse the URL
-    parsed_url = urlparse(url)
-    
-    # Check if it's a youtu.be URL
-    if parsed_url.netloc == 'youtu.be':
-        video_id = parsed_url.path.strip('/')
+
+    video_id = parse_youtube_url(url).video_id
+    if video_id:
         return f"https://www.youtube.com/watch?v={video_id}"
-    
-    # For regular youtube.com URLs
-    if 'youtube.com' in parsed_url.netloc:
-        # Get the query parameters
-        query_params = parse_qs(parsed_url.query)
-        
-        # Extract video ID
-        if 'v' in query_params:
-            video_id = query_params['v'][0]
-            return f"https://www.youtube.com/watch?v={video_id}"
-    
+
     # Return original URL if no simplification was possible
     return url
 
 def get_video_id(url):
     """Extract the YouTube video ID from a URL"""
-    # Regular expressions to match YouTube URL patterns
-    patterns = [
-        r'(?:v=|\/)([0-9A-Za-z_-]{11}).*',  # Standard and shortened YouTube URLs
-        r'(?:embed\/|v\/|youtu.be\/)([0-9A-Za-z_-]{11})',  # Embedded and youtu.be URLs
-        r'(?:watch\?v=)([0-9A-Za-z_-]{11})'  # Standard watch URL
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    
-    return None
+    return parse_youtube_url(url).video_id
 
 def is_playlist(url):
     """Check if the URL is a YouTube playlist"""
-    return 'list=' in url or 'playlist' in url
+    return parse_youtube_url(url).is_playlist
 
 def get_direct_video_url(video_id, itag):
     """Generate a direct download URL using YouTube's video ID and itag (format)"""
@@ -88,6 +172,14 @@ def get_video_info_via_api(url):
         
         # Create robust video formats that match what script.js expects
         video_formats = [
+            {
+                # Video and audio are separate streams at 1080p, muxed by /download-file
+                'format_id': '137',
+                'format': '1080p (mp4)',
+                'ext': 'mp4',
+                'resolution': '1080p',
+                'filesize': 20000000  # 20MB (estimated)
+            },
             {
                 'format_id': '22',
                 'format': '720p (mp4)',
@@ -115,9 +207,17 @@ def get_video_info_via_api(url):
             {
                 'format_id': '251',
                 'format': 'Audio (160kbps opus)',
-                'ext': 'opus',
+                'ext': 'webm',
                 'abr': '160kbps',
                 'filesize': 3500000  # 3.5MB (estimated)
+            },
+            {
+                # Converted on the server, the other audio formats are served as is
+                'format_id': 'mp3',
+                'format': 'Audio (192kbps mp3)',
+                'ext': 'mp3',
+                'abr': '192kbps',
+                'filesize': 4500000  # 4.5MB (estimated)
             }
         ]
         
@@ -133,20 +233,20 @@ def get_video_info_via_api(url):
         }
             
     except Exception as e:
-        logger.error(f"Error getting video info via API: {str(e)}")
+        logger.error("Error getting video info via API: %s", e)
         # Return default formats when an error occurs
         return get_default_video_info(url)
 
 def get_video_info(url):
     """Get video information - fallback to default if API fails"""
     try:
-        logger.info(f"Getting video info for: {url}")
+        logger.info("Getting video info for: %s", url)
         
         # Use the more reliable API approach
         return get_video_info_via_api(url)
             
     except Exception as e:
-        logger.error(f"Error getting video info: {str(e)}")
+        logger.error("Error getting video info: %s", e)
         # Return default video info when an error occurs
         return get_default_video_info(url)
 
@@ -164,12 +264,14 @@ def get_default_video_info(url):
         'duration': 180,  # 3 minutes default
         'views': 10000,
         'video_formats': [
+            {'format_id': '137', 'format': '1080p (mp4)', 'ext': 'mp4', 'resolution': '1080p'},
             {'format_id': '22', 'format': '720p (mp4)', 'ext': 'mp4', 'resolution': '720p'},
             {'format_id': '18', 'format': '360p (mp4)', 'ext': 'mp4', 'resolution': '360p'},
         ],
         'audio_formats': [
             {'format_id': '140', 'format': 'Audio (128kbps m4a)', 'ext': 'm4a', 'abr': '128kbps'},
-            {'format_id': '251', 'format': 'Audio (160kbps opus)', 'ext': 'opus', 'abr': '160kbps'},
+            {'format_id': '251', 'format': 'Audio (160kbps opus)', 'ext': 'webm', 'abr': '160kbps'},
+            {'format_id': 'mp3', 'format': 'Audio (192kbps mp3)', 'ext': 'mp3', 'abr': '192kbps'},
         ]
     }
 
@@ -177,13 +279,15 @@ def get_default_formats(url, sample=False):
     """Generate default format options for video or playlist"""
     # Create standard format options when we can't get actual formats
     video_formats = [
+        {'format_id': '137', 'format': '1080p (mp4)', 'ext': 'mp4', 'resolution': '1080p'},
         {'format_id': '22', 'format': '720p (mp4)', 'ext': 'mp4', 'resolution': '720p'},
         {'format_id': '18', 'format': '360p (mp4)', 'ext': 'mp4', 'resolution': '360p'},
     ]
     
     audio_formats = [
         {'format_id': '140', 'format': 'Audio (128kbps m4a)', 'ext': 'm4a', 'abr': '128kbps'},
-        {'format_id': '251', 'format': 'Audio (160kbps opus)', 'ext': 'opus', 'abr': '160kbps'},
+        {'format_id': '251', 'format': 'Audio (160kbps opus)', 'ext': 'webm', 'abr': '160kbps'},
+        {'format_id': 'mp3', 'format': 'Audio (192kbps mp3)', 'ext': 'mp3', 'abr': '192kbps'},
     ]
     
     return {
@@ -200,16 +304,14 @@ def generate_clipto_url(youtube_url, format_id, download_type='video'):
     # Instead of redirecting to YouTube, use our own endpoint
     base_url = "/direct-download"
     
-    # Generate random timestamp to avoid caching issues
-    timestamp = int(time.time())
-    
-    # Build the URL to our internal endpoint
+    # Stable URLs so the pages linking to them can be cached; the
+    # download endpoints themselves are marked no-store
     if download_type == 'audio':
         # For audio downloads
-        return f"{base_url}?v={video_id}&format={format_id}&type=audio&_t={timestamp}"
+        return f"{base_url}?v={video_id}&format={format_id}&type=audio"
     else:
         # For video downloads
-        return f"{base_url}?v={video_id}&format={format_id}&type=video&_t={timestamp}"
+        return f"{base_url}?v={video_id}&format={format_id}&type=video"
         
 def generate_download_file_url(youtube_url, format_id, download_type='video'):
     """Generate a direct file download URL (real file, not HTML)"""
@@ -220,16 +322,10 @@ def generate_download_file_url(youtube_url, format_id, download_type='video'):
     # Use a dedicated file download endpoint
     base_url = "/download-file"
     
-    # Generate random timestamp to avoid caching issues
-    timestamp = int(time.time()) 
-    
-    # Add a random ID to further prevent caching issues
-    random_id = ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=8))
-    
-    # Build the URL to our direct file download endpoint
+    # Stable URL (see generate_clipto_url); /download-file responses are no-store
     if download_type == 'audio':
         # For audio downloads
-        return f"{base_url}?v={video_id}&format={format_id}&type=audio&_t={timestamp}&r={random_id}"
+        return f"{base_url}?v={video_id}&format={format_id}&type=audio"
     else:
         # For video downloads
-        return f"{base_url}?v={video_id}&format={format_id}&type=video&_t={timestamp}&r={random_id}"
\ No newline at end of file
+        return f"{base_url}?v={video_id}&format={format_id}&type=video"
\ No newline at end of file